@@ -1,14 +1,56 @@
 # GESTOR-DOC-backend/app.py
 import os
-from flask import Flask, jsonify
+import sys
+import time
+
+_IMPORTS_STARTED = time.perf_counter()
+
+from flask import Flask, Response, jsonify
 from flask_cors import CORS
 from routes.documentos import documentos_bp
+from utils.admission import admission_stats
+from utils.code_extraction import extraction_stats
+from utils.code_index import index_stats
+from utils.db import pool_stats
+from utils.highlight_cache import cache_stats as highlight_cache_stats
+from utils.highlight_jobs import job_stats
+from utils.highlighter import highlighter_stats
+from utils.metrics import TimedJSONProvider, render_prometheus
+from utils.object_store import object_store_stats
+from utils.response_cache import cache_stats as response_cache_stats
+from utils.tenants import get_registry, install_reload_signal, registry_stats
+from utils.warmup import prewarm, readiness_status
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORTS_STARTED
+
+# Módulos que solo deben cargarse en el primer uso (no al arrancar el worker)
+LAZY_MODULES = ("boto3", "botocore", "requests", "fitz")
+
+
+def check_import_budget():
+    """
+    Avisa en el log si importar la aplicación superó ``STARTUP_IMPORT_BUDGET_MS``
+    (1500) o si algún módulo pesado se cargó antes de tiempo.
+    """
+    budget_ms = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "1500"))
+    eager = [name for name in LAZY_MODULES if name in sys.modules]
+    if IMPORT_SECONDS * 1000 > budget_ms or eager:
+        print(f"ADVERTENCIA: importaciones de arranque en {IMPORT_SECONDS * 1000:.0f} ms "
+              f"(presupuesto {budget_ms:.0f} ms); cargados antes de tiempo: {eager or 'ninguno'}")
+
 
 def create_app() -> Flask:
     """
     Crea una instancia de la aplicación Flask configurada para un entorno multi-cliente.
     """
+    check_import_budget()
+    # Falla al arrancar si la configuración de clientes no se puede leer
+    registry = get_registry()
+    install_reload_signal()
+
     app = Flask(__name__)
+    # Cuenta el tiempo de serialización JSON como fase "json" (Server-Timing)
+    app.json = TimedJSONProvider(app)
 
     # --- CONFIGURACIÓN DE CORS MEJORADA ---
     # Lee los dominios permitidos desde una variable de entorno.
@@ -27,6 +69,11 @@ def create_app() -> Flask:
     # Registrar el blueprint que contiene todas nuestras rutas
     app.register_blueprint(documentos_bp, url_prefix="/api/documentos")
 
+    # Despertar en segundo plano las BD de todos los clientes para que la
+    # primera petición no pague el arranque en frío.
+    if os.getenv("DB_PREWARM", "1") != "0":
+        prewarm(registry.tenants())
+
     @app.route("/api")
     def index() -> jsonify:
         """Ruta de diagnóstico para confirmar que la API se ejecuta."""
@@ -42,9 +89,26 @@ def create_app() -> Flask:
         return jsonify({
             "message": "Diagnóstico del backend.",
             "codigo_version": "4.0-final-fix",
-            "boto3_version": boto3.__version__
+            "boto3_version": boto3.__version__,
+            "tenants": registry_stats(),
+            "startup_import_ms": round(IMPORT_SECONDS * 1000, 1),
+            "db_pools": pool_stats(),
+            "db_readiness": readiness_status(),
+            "code_index": index_stats(),
+            "highlight_cache": highlight_cache_stats(),
+            "highlight_jobs": job_stats(),
+            "code_extraction": extraction_stats(),
+            "admission": admission_stats(),
+            "object_store": object_store_stats(),
+            "highlighter": highlighter_stats(),
+            "response_cache": response_cache_stats(),
         })
 
+    @app.route("/api/metrics")
+    def metrics():
+        """Latencias por cliente, ruta y fase en formato de texto de Prometheus."""
+        return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
     return app
 
 # Este bloque solo se ejecuta si corres el archivo directamente (ej. python app.py)
@@ -0,0 +1,78 @@
+# bench_cover.py — Benchmark del motor de cobertura de ``search_optima``
+#
+# Uso:
+#   python -m benchmarks.bench_cover                   # 10k códigos × 50k documentos
+#   python -m benchmarks.bench_cover --codes 2000 --docs 5000 --legacy
+#
+# Genera documentos sintéticos con códigos aleatorios y compara el voraz
+# perezoso con el voraz original (reordenar toda la lista en cada vuelta,
+# solo con ``--legacy`` porque es muy lento a gran escala) y con el modo
+# exacto acotado por tiempo.
+import argparse
+import itertools
+import random
+import time
+
+from utils.cover import solve_cover
+
+
+def synthetic(n_codes: int, n_docs: int, max_codes: int, seed: int):
+    rng = random.Random(seed)
+    universe = [f"C{i:06d}" for i in range(n_codes)]
+    # Distribución sesgada: algunos códigos aparecen en muchos documentos
+    cum_weights = list(itertools.accumulate(1.0 / (1 + i) ** 0.5 for i in range(n_codes)))
+    docs = [set(rng.choices(universe, cum_weights=cum_weights, k=rng.randint(1, max_codes)))
+            for _ in range(n_docs)]
+    return universe, docs
+
+
+def legacy_greedy(requested, docs):
+    docs_sets = [{"doc": i, "codes": codes} for i, codes in enumerate(docs)]
+    faltantes = set(requested)
+    seleccionados = []
+    while faltantes and docs_sets:
+        docs_sets.sort(key=lambda d: len(d["codes"] & faltantes), reverse=True)
+        best = docs_sets.pop(0)
+        cubre = best["codes"] & faltantes
+        if not cubre:
+            break
+        seleccionados.append(best["doc"])
+        faltantes -= cubre
+    return seleccionados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--codes", type=int, default=10_000)
+    parser.add_argument("--docs", type=int, default=50_000)
+    parser.add_argument("--max-codes", type=int, default=20, help="códigos máximos por documento")
+    parser.add_argument("--requested", type=int, default=0, help="códigos pedidos (0 = todos)")
+    parser.add_argument("--budget", type=float, default=5.0, help="segundos para el modo exacto")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--legacy", action="store_true", help="medir también el algoritmo original")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    universe, docs = synthetic(args.codes, args.docs, args.max_codes, args.seed)
+    requested = universe if not args.requested else random.Random(args.seed).sample(universe, args.requested)
+    print(f"datos: {len(requested)} códigos pedidos, {len(docs)} documentos "
+          f"({time.perf_counter() - t0:.2f}s para generarlos)")
+
+    t0 = time.perf_counter()
+    greedy = solve_cover(requested, docs)
+    print(f"voraz perezoso: {len(greedy.selected)} documentos, {len(greedy.missing)} faltantes, "
+          f"{time.perf_counter() - t0:.3f}s")
+
+    t0 = time.perf_counter()
+    exact = solve_cover(requested, docs, exact=True, time_budget=args.budget)
+    print(f"exacto (≤{args.budget}s): {len(exact.selected)} documentos, óptimo={exact.optimal}, "
+          f"{time.perf_counter() - t0:.3f}s")
+
+    if args.legacy:
+        t0 = time.perf_counter()
+        legacy = legacy_greedy(requested, docs)
+        print(f"voraz original: {len(legacy)} documentos, {time.perf_counter() - t0:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# bench_highlight.py — Motor de resaltado local frente al servicio externo
+#
+# Uso:
+#   python -m benchmarks.bench_highlight                       # solo motor local
+#   python -m benchmarks.bench_highlight --remote-url https://resaltador.example
+#   python -m benchmarks.bench_highlight --pages 1,10,100,500 --codes 20 --repeat 5
+#
+# Genera con PyMuPDF PDFs sintéticos de distinto número de páginas (texto
+# con códigos repartidos) y mide, por número de páginas, la mediana de:
+#   - ``local``: ``highlight_file`` en este proceso;
+#   - ``pool``:  el mismo trabajo enviado al pool de procesos (incluye el
+#     paso de argumentos y el arranque perezoso del pool en la primera);
+#   - ``remote``: subida + descarga contra ``--remote-url`` (contrato
+#     ``/descargar/``), con el cliente de ``utils/highlighter.py``.
+import os
+import re
+import random
+import argparse
+import statistics
+import tempfile
+import time
+
+from utils import pdf_highlight
+
+
+def synthetic_pdf(path: str, pages: int, codes: list[str], rng: random.Random):
+    import fitz
+
+    words = ["documento", "factura", "lote", "referencia", "cantidad", "total", "fecha", "pieza"]
+    with fitz.open() as doc:
+        for _ in range(pages):
+            page = doc.new_page()
+            lines = []
+            for _ in range(45):
+                line = [rng.choice(words) for _ in range(8)]
+                if rng.random() < 0.3:
+                    line[rng.randrange(len(line))] = rng.choice(codes)
+                lines.append(" ".join(line))
+            page.insert_text((40, 40), "\n".join(lines), fontsize=9)
+        doc.save(path)
+
+
+def _median_seconds(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def _remote(url: str, path: str, codes: list[str]):
+    from utils.highlighter import get_highlighter
+
+    client = get_highlighter()
+    with open(path, "rb") as f:
+        resp = client.post(url, files={"pdf_file": (os.path.basename(path), f, "application/pdf")},
+                           data={"specific_codes": ",".join(codes)})
+    resp.raise_for_status()
+    match = re.search(r'href="(/descargar/[^\"]+)"', resp.text)
+    if not match:
+        raise RuntimeError("El resaltador no devolvió enlace de descarga")
+    with client.get(url.rstrip("/") + match.group(1), stream=True) as pdf:
+        pdf.raise_for_status()
+        for _ in pdf.iter_content(64 * 1024):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resaltado local vs servicio externo por número de páginas")
+    parser.add_argument("--pages", default="1,10,50,200")
+    parser.add_argument("--codes", type=int, default=10, help="códigos resaltados por petición")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--remote-url", default=os.getenv("HIGHLIGHTER_URL"))
+    parser.add_argument("--no-remote", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if not pdf_highlight.pymupdf_installed():
+        parser.error("hace falta PyMuPDF (pip install pymupdf)")
+    rng = random.Random(args.seed)
+    codes = [f"C{rng.randrange(10**6):06d}" for _ in range(args.codes)]
+    remote_url = None if args.no_remote else args.remote_url
+
+    print(f"{'páginas':>8} {'local ms':>10} {'pool ms':>10} {'remoto ms':>10} {'coincid.':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in (int(p) for p in args.pages.split(",")):
+            src = os.path.join(tmp, f"p{pages}.pdf")
+            dst = os.path.join(tmp, f"p{pages}.out.pdf")
+            synthetic_pdf(src, pages, codes, rng)
+            result = pdf_highlight.highlight_file(src, dst, codes)
+            local = _median_seconds(lambda: pdf_highlight.highlight_file(src, dst, codes), args.repeat)
+            pool = _median_seconds(
+                lambda: pdf_highlight.run_in_pool(pdf_highlight.highlight_file, src, dst, codes),
+                args.repeat,
+            )
+            remote = _median_seconds(lambda: _remote(remote_url, src, codes), args.repeat) if remote_url else None
+            print(f"{pages:>8} {local * 1000:>10.1f} {pool * 1000:>10.1f} "
+                  f"{(f'{remote * 1000:.1f}' if remote is not None else '-'):>10} {result['matches']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# bench_startup.py — Tiempo de importación de la aplicación (arranque en frío)
+#
+# Uso:
+#   python -m benchmarks.bench_startup                  # presupuesto STARTUP_IMPORT_BUDGET_MS (1500)
+#   python -m benchmarks.bench_startup --budget-ms 800 --top 20
+#
+# Importa ``app`` en un intérprete nuevo con ``-X importtime`` y muestra los
+# módulos más caros.  Termina con código 1 si se supera el presupuesto o si
+# algún módulo de ``app.LAZY_MODULES`` (boto3, requests, fitz...) se carga al
+# importar en lugar de en su primer uso; sirve como comprobación en CI.
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(repeat: int) -> tuple[float, list[tuple[int, int, str]], set[str]]:
+    """Mejor tiempo total (ms) de ``import app``, desglose y módulos cargados."""
+    best_total, best_rows = None, []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app"],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            raise SystemExit("No se pudo importar la aplicación")
+        rows = []
+        for line in proc.stderr.splitlines():
+            match = LINE.match(line)
+            if match:
+                self_us, cumulative_us, indent, name = match.groups()
+                rows.append((int(cumulative_us), len(indent) // 2, name))
+        total = next((c for c, _, name in rows if name == "app"), 0) / 1000
+        if best_total is None or total < best_total:
+            best_total, best_rows = total, rows
+    return best_total, best_rows, {name for _, _, name in best_rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de importación de la aplicación")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "1500")))
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=3, help="se toma la mejor de N ejecuciones")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from app import LAZY_MODULES
+
+    total, rows, loaded = measure(args.repeat)
+    print(f"{'acumulado ms':>13}  módulo")
+    # Solo los paquetes de primer nivel de cada rama (los de menos sangría)
+    top = sorted((r for r in rows if r[1] <= 1), reverse=True)[:args.top]
+    for cumulative, _, name in top:
+        print(f"{cumulative / 1000:>13.1f}  {name}")
+
+    eager = sorted(name for name in loaded if name.split(".")[0] in LAZY_MODULES)
+    ok = total <= args.budget_ms and not eager
+    print(f"\nimport app: {total:.0f} ms (presupuesto {args.budget_ms:.0f} ms)")
+    if eager:
+        print(f"Cargados al importar y deberían ser perezosos: {', '.join(eager)}")
+    print("OK" if ok else "FALLO")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
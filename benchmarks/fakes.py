@@ -0,0 +1,250 @@
+# fakes.py — Servicios locales que sustituyen a R2 y al resaltador en los benchmarks
+#
+# - ``FakeS3``: subconjunto de la API de S3 con direccionamiento por ruta
+#   (``/<bucket>/<clave>``): PUT/GET/HEAD/DELETE de objetos, ``DeleteObjects``
+#   y subida multiparte.  Guarda los objetos en memoria.
+# - ``FakeHighlighter``: el contrato del resaltador real.  ``POST /`` recibe
+#   ``pdf_file`` y ``specific_codes`` y responde un HTML con un enlace
+#   ``/descargar/<id>``; ``GET /descargar/<id>`` devuelve el PDF "resaltado"
+#   (el mismo que recibió).  ``latency`` simula el tiempo de proceso.
+import re
+import time
+import uuid
+import hashlib
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape, unescape
+
+
+def _read_body(handler: BaseHTTPRequestHandler) -> bytes:
+    if handler.headers.get("Transfer-Encoding", "").lower() == "chunked":
+        body = bytearray()
+        while True:
+            size = int(handler.rfile.readline().split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                while handler.rfile.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                return bytes(body)
+            body += handler.rfile.read(size)
+            handler.rfile.readline()
+    length = int(handler.headers.get("Content-Length") or 0)
+    body = handler.rfile.read(length) if length else b""
+    if "aws-chunked" in handler.headers.get("Content-Encoding", ""):
+        body = _decode_aws_chunked(body)
+    return body
+
+
+def _decode_aws_chunked(raw: bytes) -> bytes:
+    """``<hex>[;chunk-signature=...]\\r\\n<datos>\\r\\n ... 0\\r\\n<trailers>``"""
+    out = bytearray()
+    pos = 0
+    while pos < len(raw):
+        end = raw.index(b"\r\n", pos)
+        size = int(raw[pos:end].split(b";")[0], 16)
+        if size == 0:
+            break
+        out += raw[end + 2:end + 2 + size]
+        pos = end + 2 + size + 2
+    return bytes(out)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, owner):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.owner = owner
+
+
+class _Service:
+    handler = None
+
+    def start(self):
+        self._server = _Server(self.handler, self)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", headers: dict | None = None,
+              content_type: str = "application/xml"):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body or status not in (204, 304):
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+
+# --- S3 ---
+
+class _S3Handler(_QuietHandler):
+    def _target(self):
+        parts = urlsplit(self.path)
+        bucket, _, key = parts.path.lstrip("/").partition("/")
+        return bucket, unquote(key), parse_qs(parts.query, keep_blank_values=True)
+
+    def _not_found(self, key: str):
+        body = (f"<Error><Code>NoSuchKey</Code><Message>No existe</Message>"
+                f"<Key>{escape(key)}</Key></Error>").encode()
+        self._send(404, b"" if self.command == "HEAD" else body)
+
+    def do_PUT(self):
+        s3 = self.server.owner
+        bucket, key, query = self._target()
+        body = _read_body(self)
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if "uploadId" in query:
+            with s3.lock:
+                s3.uploads[query["uploadId"][0]]["parts"][int(query["partNumber"][0])] = body
+            self._send(200, headers={"ETag": etag})
+            return
+        s3.put(bucket, key, body, self.headers.get("Content-Type") or "binary/octet-stream")
+        self._send(200, headers={"ETag": etag})
+
+    def do_GET(self):
+        s3 = self.server.owner
+        bucket, key, _ = self._target()
+        obj = s3.get(bucket, key)
+        if obj is None:
+            self._not_found(key)
+            return
+        body, content_type, etag, modified = obj
+        self._send(200, body, {"ETag": etag, "Last-Modified": modified}, content_type)
+
+    do_HEAD = do_GET
+
+    def do_DELETE(self):
+        s3 = self.server.owner
+        bucket, key, query = self._target()
+        if "uploadId" in query:
+            with s3.lock:
+                s3.uploads.pop(query["uploadId"][0], None)
+        else:
+            s3.delete(bucket, key)
+        self._send(204)
+
+    def do_POST(self):
+        s3 = self.server.owner
+        bucket, key, query = self._target()
+        body = _read_body(self)
+        if "delete" in query:
+            keys = [unescape(k.decode()) for k in re.findall(rb"<Key>(.*?)</Key>", body)]
+            for k in keys:
+                s3.delete(bucket, k)
+            deleted = "".join(f"<Deleted><Key>{escape(k)}</Key></Deleted>" for k in keys)
+            self._send(200, f"<DeleteResult>{deleted}</DeleteResult>".encode())
+        elif "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            with s3.lock:
+                s3.uploads[upload_id] = {"key": key, "parts": {},
+                                         "content_type": self.headers.get("Content-Type")}
+            self._send(200, (f"<InitiateMultipartUploadResult><Bucket>{escape(bucket)}</Bucket>"
+                             f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>"
+                             f"</InitiateMultipartUploadResult>").encode())
+        elif "uploadId" in query:
+            with s3.lock:
+                upload = s3.uploads.pop(query["uploadId"][0], None)
+            if upload is None:
+                self._send(404, b"<Error><Code>NoSuchUpload</Code></Error>")
+                return
+            data = b"".join(upload["parts"][n] for n in sorted(upload["parts"]))
+            s3.put(bucket, key, data, upload["content_type"] or "binary/octet-stream")
+            etag = s3.get(bucket, key)[2]
+            self._send(200, (f"<CompleteMultipartUploadResult><Bucket>{escape(bucket)}</Bucket>"
+                             f"<Key>{escape(key)}</Key><ETag>{escape(etag)}</ETag>"
+                             f"</CompleteMultipartUploadResult>").encode())
+        else:
+            self._send(400, b"<Error><Code>NotImplemented</Code></Error>")
+
+
+class FakeS3(_Service):
+    handler = _S3Handler
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects: dict[tuple[str, str], tuple] = {}
+        self.uploads: dict[str, dict] = {}
+
+    def put(self, bucket: str, key: str, body: bytes, content_type: str = "application/pdf"):
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self.lock:
+            self.objects[(bucket, key)] = (body, content_type, etag, formatdate(usegmt=True))
+
+    def get(self, bucket: str, key: str):
+        with self.lock:
+            return self.objects.get((bucket, key))
+
+    def delete(self, bucket: str, key: str):
+        with self.lock:
+            self.objects.pop((bucket, key), None)
+
+
+# --- Resaltador ---
+
+def _multipart_field(body: bytes, content_type: str, name: str) -> bytes | None:
+    match = re.search(r'boundary="?([^";]+)"?', content_type or "")
+    if not match:
+        return None
+    for part in body.split(b"--" + match.group(1).encode()):
+        head, sep, data = part.partition(b"\r\n\r\n")
+        if sep and f'name="{name}"'.encode() in head:
+            return data[:-2] if data.endswith(b"\r\n") else data
+    return None
+
+
+class _HighlighterHandler(_QuietHandler):
+    def do_POST(self):
+        owner = self.server.owner
+        body = _read_body(self)
+        pdf = _multipart_field(body, self.headers.get("Content-Type"), "pdf_file")
+        if owner.latency:
+            time.sleep(owner.latency)
+        if not pdf:
+            self._send(200, b"<html><body><p>No se recibio ningun PDF</p></body></html>",
+                       content_type="text/html")
+            return
+        result_id = uuid.uuid4().hex
+        with owner.lock:
+            owner.results[result_id] = pdf
+        html = f'<html><body><a href="/descargar/{result_id}">Descargar PDF</a></body></html>'
+        self._send(200, html.encode(), content_type="text/html")
+
+    def do_GET(self):
+        owner = self.server.owner
+        match = re.fullmatch(r"/descargar/([0-9a-f]+)", urlsplit(self.path).path)
+        with owner.lock:
+            pdf = owner.results.pop(match.group(1), None) if match else None
+        if pdf is None:
+            self._send(404, b"no encontrado", content_type="text/plain")
+            return
+        self._send(200, pdf, content_type="application/pdf")
+
+
+class FakeHighlighter(_Service):
+    handler = _HighlighterHandler
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.results: dict[str, bytes] = {}
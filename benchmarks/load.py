@@ -0,0 +1,441 @@
+# load.py — Benchmark de carga de la API completa con servicios locales
+#
+# Uso:
+#   BENCH_MYSQL_PASSWORD=... python -m benchmarks.load
+#   python -m benchmarks.load --tenants 3 --docs 20000 --concurrency 16 --requests 500
+#   python -m benchmarks.load --scenarios list,search_optima --skip-seed
+#   python -m benchmarks.load --compare antes.json despues.json
+#
+# Levanta ``create_app()`` en un proceso aparte (servidor de werkzeug con
+# hilos) contra:
+#   - un MySQL local (``--mysql-*`` o ``BENCH_MYSQL_*``) con una base
+#     ``<prefijo><n>`` por cliente sintético, migrada y rellenada con
+#     documentos y códigos aleatorios (distribución sesgada);
+#   - ``FakeS3`` y ``FakeHighlighter`` (``benchmarks/fakes.py``).
+#
+# Cada escenario lanza ``--requests`` peticiones con ``--concurrency`` hilos
+# repartidas entre los clientes y mide rendimiento, p50/p95/p99 y la memoria
+# del proceso de la API.  Los resultados se guardan en JSON (por defecto en
+# ``benchmarks/results/``) para comparar ejecuciones entre commits.
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import datetime
+import itertools
+import subprocess
+import tempfile
+import threading
+import uuid
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import pymysql
+import requests
+
+from benchmarks.fakes import FakeHighlighter, FakeS3
+from utils import migrations
+from utils.db import tenant_params
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET = "gestor-bench"
+SCENARIOS = ("upload", "list", "search_by_code", "search_optima", "resaltar")
+SAMPLE_OBJECTS = 50  # documentos por cliente con PDF en el S3 falso (para resaltar)
+
+
+# --- Datos sintéticos ---
+
+def fake_pdf(size: int, rng: random.Random) -> bytes:
+    head = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    tail = b"\n%%EOF\n"
+    return head + rng.randbytes(max(size - len(head) - len(tail), 0)) + tail
+
+
+def _admin_connect(args, database=None):
+    return pymysql.connect(host=args.mysql_host, port=args.mysql_port, user=args.mysql_user,
+                           password=args.mysql_password, database=database, charset="utf8mb4",
+                           autocommit=True, cursorclass=pymysql.cursors.DictCursor)
+
+
+def tenants_config(args) -> dict:
+    return {
+        f"bench-{n}": {
+            "db_host": args.mysql_host,
+            "db_user": args.mysql_user,
+            "db_pass": args.mysql_password,
+            "db_name": f"{args.db_prefix}{n}",
+            "db_port": args.mysql_port,
+        }
+        for n in range(args.tenants)
+    }
+
+
+def seed(args, tenants: dict, universe: list[str]):
+    """Crea (o recrea) la base de cada cliente, la migra y la rellena."""
+    rng = random.Random(args.seed)
+    cum_weights = list(itertools.accumulate(1.0 / (1 + i) ** 0.5 for i in range(len(universe))))
+    admin = _admin_connect(args)
+    try:
+        for tenant_id, config in tenants.items():
+            started = time.monotonic()
+            with admin.cursor() as cur:
+                cur.execute(f"DROP DATABASE IF EXISTS `{config['db_name']}`")
+                cur.execute(f"CREATE DATABASE `{config['db_name']}` CHARACTER SET utf8mb4")
+            conn = pymysql.connect(**tenant_params(config))
+            try:
+                migrations.upgrade(conn, log=lambda *_: None)
+                conn.autocommit(False)
+                base = datetime.date(2015, 1, 1)
+                with conn.cursor() as cur:
+                    for start in range(0, args.docs, 1000):
+                        count = min(1000, args.docs - start)
+                        cur.executemany(
+                            "INSERT INTO documents (id, name, date, path) VALUES (%s, %s, %s, %s)",
+                            [(start + i + 1, f"Documento {start + i + 1}",
+                              base + datetime.timedelta(days=rng.randrange(3650)),
+                              f"{tenant_id}/bench-{start + i + 1}.pdf") for i in range(count)],
+                        )
+                        rows = []
+                        for i in range(count):
+                            doc_id = start + i + 1
+                            codes = set(rng.choices(universe, cum_weights=cum_weights,
+                                                    k=rng.randint(1, args.max_codes)))
+                            rows.extend((doc_id, code, code) for code in codes)
+                        cur.executemany(
+                            "INSERT INTO codes (document_id, code, code_norm) VALUES (%s, %s, %s)", rows,
+                        )
+                        conn.commit()
+            finally:
+                conn.close()
+            print(f"  {tenant_id}: {args.docs} documentos en {time.monotonic() - started:.1f}s")
+    finally:
+        admin.close()
+
+
+def sample_documents(tenants: dict) -> dict:
+    """Para cada cliente, ``[(id, path, [códigos])]`` de algunos documentos."""
+    samples = {}
+    for tenant_id, config in tenants.items():
+        conn = pymysql.connect(**tenant_params(config))
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id, path FROM documents ORDER BY id LIMIT %s", (SAMPLE_OBJECTS,))
+                docs = cur.fetchall()
+                cur.execute(
+                    "SELECT document_id, code FROM codes WHERE document_id <= %s",
+                    (docs[-1]["id"] if docs else 0,),
+                )
+                codes = {}
+                for row in cur.fetchall():
+                    codes.setdefault(row["document_id"], []).append(row["code"])
+        finally:
+            conn.close()
+        samples[tenant_id] = [(d["id"], d["path"], codes.get(d["id"], [])) for d in docs]
+    return samples
+
+
+# --- Proceso de la API ---
+
+def _serve(workdir: str, port: int, env: dict):
+    sys.path.insert(0, ROOT)
+    os.chdir(workdir)  # ``routes.documentos`` lee ``tenants.json`` del directorio actual
+    os.environ.update(env)
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    make_server("127.0.0.1", port, create_app(), threaded=True).serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _proc_status(pid: int, field: str) -> float | None:
+    """``VmRSS``/``VmHWM`` del proceso en MiB (solo Linux)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def start_api(args, tenants: dict, s3: FakeS3, highlighter: FakeHighlighter):
+    workdir = tempfile.mkdtemp(prefix="gestor-bench-")
+    with open(os.path.join(workdir, "tenants.json"), "w") as f:
+        json.dump(tenants, f)
+    env = {
+        "R2_ENDPOINT_URL": s3.url,
+        "R2_ADDRESSING_STYLE": "path",
+        "R2_BUCKET_NAME": BUCKET,
+        "R2_ACCESS_KEY_ID": "bench",
+        "R2_SECRET_ACCESS_KEY": "bench",
+        "HIGHLIGHTER_URL": highlighter.url,
+        "HIGHLIGHT_CACHE_DIR": os.path.join(workdir, "resaltados"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+        "METRICS_SLOW_MS": "100000",
+    }
+    if args.no_response_cache:
+        env["RESPONSE_CACHE_ENABLED"] = "0"
+    port = _free_port()
+    proc = multiprocessing.get_context("spawn").Process(target=_serve, args=(workdir, port, env), daemon=True)
+    proc.start()
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            if requests.get(f"{url}/api", timeout=1).ok:
+                return proc, url
+        except requests.RequestException:
+            pass
+        if time.monotonic() > deadline or not proc.is_alive():
+            proc.terminate()
+            raise RuntimeError("La API no arrancó (ver la salida anterior)")
+        time.sleep(0.2)
+
+
+# --- Escenarios ---
+
+class Context:
+    def __init__(self, args, url: str, tenants: dict, samples: dict, universe: list[str]):
+        self.args = args
+        self.url = url
+        self.tenant_ids = list(tenants)
+        self.samples = samples
+        self.universe = universe
+        self.counter = itertools.count()
+        self.run_id = uuid.uuid4().hex[:8]
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+
+def _upload(ctx: Context, rng: random.Random, tenant: str):
+    n = next(ctx.counter)
+    codes = ",".join(rng.sample(ctx.universe, rng.randint(1, ctx.args.max_codes)))
+    return "POST", "/api/documentos/upload", dict(
+        files={"file": (f"carga-{ctx.run_id}-{n}.pdf", fake_pdf(ctx.args.pdf_kb * 1024, rng), "application/pdf")},
+        data={"nombre": f"Carga {n}", "fecha": "2024-05-17", "codigos": codes},
+    )
+
+
+def _list(ctx: Context, rng: random.Random, tenant: str):
+    params = {"limit": 100}
+    if rng.random() < 0.5:
+        params["after_id"] = rng.randint(1, max(ctx.args.docs, 1))
+    return "GET", "/api/documentos/", dict(params=params)
+
+
+def _search_by_code(ctx: Context, rng: random.Random, tenant: str):
+    code = rng.choice(ctx.universe)
+    mode = rng.choice(("like", "exacto", "prefijo"))
+    term = code[:rng.randint(3, len(code))] if mode != "exacto" else code
+    return "POST", "/api/documentos/search_by_code", dict(json={"codigo": term, "modo": mode})
+
+
+def _search_optima(ctx: Context, rng: random.Random, tenant: str):
+    codes = rng.sample(ctx.universe, min(ctx.args.optima_codes, len(ctx.universe)))
+    return "POST", "/api/documentos/search_optima", dict(json={"codigos": " ".join(codes)})
+
+
+def _resaltar(ctx: Context, rng: random.Random, tenant: str):
+    _, path, codes = rng.choice(ctx.samples[tenant])
+    chosen = rng.sample(codes, rng.randint(1, len(codes))) if codes else [rng.choice(ctx.universe)]
+    return "POST", "/api/documentos/resaltar", dict(json={"pdf_path": path, "codes": chosen}, stream=True)
+
+
+BUILDERS = {
+    "upload": _upload,
+    "list": _list,
+    "search_by_code": _search_by_code,
+    "search_optima": _search_optima,
+    "resaltar": _resaltar,
+}
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float | None:
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_scenario(ctx: Context, name: str, proc) -> dict:
+    args = ctx.args
+    build = BUILDERS[name]
+
+    def one(i: int):
+        rng = random.Random(f"{args.seed}-{name}-{i}")
+        tenant = ctx.tenant_ids[i % len(ctx.tenant_ids)]
+        method, path, kwargs = build(ctx, rng, tenant)
+        stream = kwargs.pop("stream", False)
+        started = time.perf_counter()
+        try:
+            resp = ctx.session.request(method, ctx.url + path, headers={"X-Tenant-ID": tenant},
+                                       stream=stream, timeout=300, **kwargs)
+            for _ in resp.iter_content(64 * 1024):
+                pass
+            status = resp.status_code
+            resp.close()
+        except requests.RequestException:
+            status = 0
+        return time.perf_counter() - started, status
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.warmup)))
+        started = time.perf_counter()
+        results = list(pool.map(one, range(args.warmup, args.warmup + args.requests)))
+        wall = time.perf_counter() - started
+
+    latencies = sorted(lat for lat, status in results if 200 <= status < 400)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(latencies),
+        "statuses": statuses,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(results) / wall, 2) if wall else None,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(_percentile(latencies, 50)),
+        "p95_ms": ms(_percentile(latencies, 95)),
+        "p99_ms": ms(_percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+        "server_rss_mb": _proc_status(proc.pid, "VmRSS"),
+    }
+
+
+# --- Resultados ---
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before_path: str, after_path: str):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before.get('commit')} → {after.get('commit')}")
+    print(f"{'escenario':<16}{'rps':>20}{'p50 ms':>22}{'p95 ms':>22}{'p99 ms':>22}")
+
+    def cell(a, b):
+        if a is None or b is None:
+            return f"{a} → {b}"
+        delta = (b - a) / a * 100 if a else 0.0
+        return f"{a:.1f}→{b:.1f} ({delta:+.0f}%)"
+
+    for name in after["scenarios"]:
+        a, b = before["scenarios"].get(name), after["scenarios"][name]
+        if a is None:
+            continue
+        print(f"{name:<16}" + "".join(f"{cell(a[k], b[k]):>22}" for k in
+                                      ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")))
+    print(f"RSS pico del servidor: {before.get('server_peak_rss_mb')} → {after.get('server_peak_rss_mb')} MiB")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de carga de la API con servicios locales")
+    parser.add_argument("--mysql-host", default=os.getenv("BENCH_MYSQL_HOST", "127.0.0.1"))
+    parser.add_argument("--mysql-port", type=int, default=int(os.getenv("BENCH_MYSQL_PORT", "3306")))
+    parser.add_argument("--mysql-user", default=os.getenv("BENCH_MYSQL_USER", "root"))
+    parser.add_argument("--mysql-password", default=os.getenv("BENCH_MYSQL_PASSWORD", ""))
+    parser.add_argument("--db-prefix", default=os.getenv("BENCH_DB_PREFIX", "gestor_bench_"),
+                        help="prefijo de las bases que se crean (y borran) para cada cliente")
+    parser.add_argument("--tenants", type=int, default=2)
+    parser.add_argument("--docs", type=int, default=5000, help="documentos por cliente")
+    parser.add_argument("--codes", type=int, default=20000, help="universo de códigos")
+    parser.add_argument("--max-codes", type=int, default=20, help="máximo de códigos por documento")
+    parser.add_argument("--optima-codes", type=int, default=30, help="códigos por petición de search_optima")
+    parser.add_argument("--pdf-kb", type=int, default=256)
+    parser.add_argument("--highlighter-ms", type=float, default=50, help="latencia simulada del resaltador")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="peticiones medidas por escenario")
+    parser.add_argument("--warmup", type=int, default=10, help="peticiones previas no medidas")
+    parser.add_argument("--no-response-cache", action="store_true", help="desactiva la caché de lecturas")
+    parser.add_argument("--skip-seed", action="store_true", help="reutiliza las bases ya creadas")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="archivo JSON de resultados")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "DESPUES"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"escenarios desconocidos: {', '.join(sorted(unknown))}")
+
+    universe = [f"C{i:06d}" for i in range(args.codes)]
+    tenants = tenants_config(args)
+    if not args.skip_seed:
+        print(f"Sembrando {args.tenants} cliente(s)...")
+        seed(args, tenants, universe)
+    samples = sample_documents(tenants)
+
+    s3 = FakeS3().start()
+    highlighter = FakeHighlighter(latency=args.highlighter_ms / 1000).start()
+    rng = random.Random(args.seed)
+    for tenant_samples in samples.values():
+        for _, path, _ in tenant_samples:
+            s3.put(BUCKET, path, fake_pdf(args.pdf_kb * 1024, rng))
+
+    proc, url = start_api(args, tenants, s3, highlighter)
+    ctx = Context(args, url, tenants, samples, universe)
+    results = {}
+    try:
+        for name in scenarios:
+            print(f"{name}: {args.requests} peticiones, concurrencia {args.concurrency}...")
+            results[name] = r = run_scenario(ctx, name, proc)
+            print(f"  {r['throughput_rps']} req/s  p50 {r['p50_ms']} ms  p95 {r['p95_ms']} ms  "
+                  f"p99 {r['p99_ms']} ms  errores {r['errors']}  RSS {r['server_rss_mb']} MiB")
+        peak_rss = _proc_status(proc.pid, "VmHWM")
+    finally:
+        proc.terminate()
+        proc.join(5)
+        s3.stop()
+        highlighter.stop()
+
+    commit = _git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("mysql_password", "compare", "output")},
+        "server_peak_rss_mb": peak_rss,
+        "scenarios": results,
+    }
+    output = args.output or os.path.join(
+        ROOT, "benchmarks", "results",
+        f"load-{datetime.datetime.now():%Y%m%d-%H%M%S}-{commit or 'sin-git'}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados en {output} (RSS pico del servidor: {peak_rss} MiB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
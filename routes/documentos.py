@@ -4,8 +4,9 @@
 # ``GESTOR-DOC``.  Incluye todas las rutas CRUD para documentos y
 # configuraciones de base de datos/R2.  La versión de este archivo ha
 # sido modificada para solucionar un fallo de handshake TLS con
-# Cloudflare R2.  En concreto, la función ``get_s3_client`` ahora
-# utiliza una configuración explícita de boto3 con firma ``s3v4`` y
+# Cloudflare R2.  En concreto, la función ``get_s3_client`` (ahora en
+# ``utils/storage.py``, con un cliente compartido por proceso) utiliza
+# una configuración explícita de boto3 con firma ``s3v4`` y
 # addressing_style ``virtual`` en lugar de desactivar la verificación
 # TLS (``verify=False``), lo que evitaba el error pero no solucionaba
 # el handshake.  Además, se ha especificado ``region_name="auto"`` para
@@ -13,22 +14,90 @@
 
 import os
 import re
+import io
+import csv
 import json
-import time
+import uuid
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pymysql
-import requests
-import boto3
-from botocore.client import Config
-from flask import Blueprint, request, jsonify, Response, g
+from flask import Blueprint, request, jsonify, Response, g, current_app, stream_with_context, url_for, redirect
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
+
+from utils import code_index, text_search
+from utils.admission import admit, release_on_close, release_on_teardown
+from utils.code_extraction import (
+    PENDING as EXTRACCION_PENDIENTE, content_search_enabled, extraction_enabled, get_pipeline,
+)
+from utils.cover import solve_cover
+from utils.db import PoolTimeout
+from utils.highlight_cache import CacheBusy, cache_key, get_highlight_cache, normalize_codes
+from utils.highlight_jobs import DONE, FAILED, QueueFull, get_job_queue
+from utils.highlighter import HighlighterUnavailable, get_highlighter, is_request_error
+from utils.metrics import finish_request, phase, start_request
+from utils.pdf_highlight import highlight_object, local_enabled, map_in_pool, remote_fallback
+from utils.object_store import (
+    acquire, content_key, ensure_object, hash_object, hash_stream, is_staging_key, promote_staging, release,
+    staging_key, wait_for_deletes,
+)
+from utils.r2_cleanup import delete_unreferenced, retry_pending
+from utils.response_cache import bump_version, cached_read, data_version
+from utils.storage import get_s3_client
+from utils.tenants import get_registry
+from utils.warmup import DatabaseUnavailable, get_readiness
+from utils.zip_export import stream_zip
 
 
 documentos_bp = Blueprint("documentos", __name__)
 
-# --- Cargar la configuración de todos los clientes desde el archivo JSON ---
-with open('tenants.json', 'r') as f:
-    TENANTS_CONFIG = json.load(f)
+# Ingesta masiva: máximo de documentos por lote y subidas simultáneas a R2
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_UPLOAD_WORKERS = int(os.getenv("BATCH_UPLOAD_WORKERS", "8"))
+
+# URLs prefirmadas de R2: vigencia (s), umbral multiparte y tamaño de parte
+PRESIGN_EXPIRES = int(os.getenv("PRESIGN_EXPIRES", "900"))
+PRESIGN_MULTIPART_THRESHOLD = int(float(os.getenv("PRESIGN_MULTIPART_THRESHOLD_MB", "64")) * 1024 * 1024)
+PRESIGN_PART_SIZE = int(float(os.getenv("PRESIGN_PART_SIZE_MB", "16")) * 1024 * 1024)
+
+# Borrado masivo: máximo de documentos por petición y tamaño de cada ``IN``
+BATCH_DELETE_MAX_ITEMS = int(os.getenv("BATCH_DELETE_MAX_ITEMS", "5000"))
+DELETE_CHUNK_SIZE = 500
+
+# Tiempo máximo (segundos) del modo exacto de ``search_optima``
+COVER_EXACT_BUDGET = float(os.getenv("COVER_EXACT_BUDGET", "2"))
+
+# ``search_optima`` por lotes: máximo de listas, códigos por ``IN`` y umbrales
+# (listas y candidatos) para resolver las coberturas en el pool de procesos
+OPTIMA_BATCH_MAX_LISTS = int(os.getenv("OPTIMA_BATCH_MAX_LISTS", "200"))
+OPTIMA_IN_CHUNK = int(os.getenv("OPTIMA_IN_CHUNK", "1000"))
+OPTIMA_PARALLEL_MIN_LISTS = int(os.getenv("OPTIMA_PARALLEL_MIN_LISTS", "8"))
+OPTIMA_PARALLEL_MIN_CANDIDATES = int(os.getenv("OPTIMA_PARALLEL_MIN_CANDIDATES", "50000"))
+
+# Máximo de documentos por exportación en ZIP
+EXPORT_MAX_ITEMS = int(os.getenv("EXPORT_MAX_ITEMS", "2000"))
+
+# Resultados por página de la búsqueda por contenido
+CONTENT_SEARCH_PAGE_SIZE = int(os.getenv("CONTENT_SEARCH_PAGE_SIZE", "20"))
+CONTENT_SEARCH_MAX_OFFSET = int(os.getenv("CONTENT_SEARCH_MAX_OFFSET", "1000"))
+
+# Tamaño de página del listado paginado
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "100"))
+LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", "500"))
+
+# Segundos que el navegador puede reutilizar un PDF resaltado sin revalidar
+HIGHLIGHT_CACHE_MAX_AGE = int(os.getenv("HIGHLIGHT_CACHE_MAX_AGE", "3600"))
+
+# Tamaño de bloque al transmitir PDFs entre R2, el resaltador y el cliente
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Originales más grandes que esto (MB) se resaltan como trabajo asíncrono; 0 = nunca
+RESALTAR_SYNC_MAX_BYTES = int(float(os.getenv("RESALTAR_SYNC_MAX_MB", "25")) * 1024 * 1024)
+
+
+# --- Tiempos por fase (Server-Timing y /api/metrics); antes que el resto ---
+documentos_bp.before_request(start_request)
+documentos_bp.after_request(finish_request)
 
 
 # --- Middleware para identificar al cliente en cada petición ---
@@ -38,81 +107,75 @@ def identify_tenant():
     if request.method == 'OPTIONS':
         return None
 
+    # Registro recargable: recoge altas, bajas y cambios de ``tenants.json``
+    registry = get_registry()
+    registry.maybe_reload()
     tenant_id = request.headers.get('X-Tenant-ID')
-    if not tenant_id or tenant_id not in TENANTS_CONFIG:
+    config = registry.get(tenant_id)
+    if config is None:
         return jsonify({"error": "Cliente no válido o no especificado"}), 403
-    
-    g.tenant_config = TENANTS_CONFIG[tenant_id]
+
+    g.tenant_config = config
     g.tenant_id = tenant_id
 
 
+# --- Control de admisión por cliente y clase de ruta (429 + Retry-After) ---
+documentos_bp.before_request(admit)
+documentos_bp.after_request(release_on_close)
+documentos_bp.teardown_request(release_on_teardown)
+
+
+@documentos_bp.errorhandler(DatabaseUnavailable)
+def handle_db_unavailable(e):
+    resp = jsonify({"error": str(e)})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp
+
+
+@documentos_bp.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    resp = jsonify({"error": "Servidor ocupado, intente de nuevo."})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "1"
+    return resp
+
+
 # --- Funciones Auxiliares ---
 
 def get_db_connection():
     """
-    Devuelve una conexión a la base de datos del cliente.
-    Implementa un sistema de reintentos para manejar el "despertar" de la BD en Railway.
+    Presta una conexión del pool de la base de datos del cliente.
+
+    Si la BD está "dormida" (Railway), no se bloquea el worker reintentando:
+    se espera unos segundos al calentamiento en segundo plano y, si no
+    termina, se lanza ``DatabaseUnavailable`` (503 + ``Retry-After``).
+    La conexión se devuelve al pool con ``conn.close()``.
     """
     if 'tenant_config' not in g:
         raise Exception("Error interno: No se pudo identificar la configuración del cliente.")
-    
-    config = g.tenant_config
-    
-    max_retries = 5
-    retry_delay = 2  # segundos
-
-    for attempt in range(max_retries):
-        try:
-            # Intenta conectar con un timeout más largo
-            conn = pymysql.connect(
-                host=config["db_host"],
-                user=config["db_user"],
-                password=config["db_pass"],
-                database=config["db_name"],
-                port=config.get("db_port", 3306),
-                charset="utf8mb4",
-                cursorclass=pymysql.cursors.DictCursor,
-                autocommit=True,
-                connect_timeout=15 
-            )
-            return conn  # Si la conexión es exitosa, la devuelve
-        except pymysql.err.OperationalError as e:
-            # Si el error es "Connection refused", espera y reintenta
-            if e.args[0] == 2003 and attempt < max_retries - 1:
-                print(f"Intento {attempt + 1}: No se pudo conectar a la base de datos, reintentando en {retry_delay} segundos...")
-                time.sleep(retry_delay)
-            else:
-                # Si es otro error o el último intento, lanza la excepción
-                raise e
-
-
-def get_s3_client():
-    """
-    Devuelve un cliente S3 configurado para Cloudflare R2.
 
-    La configuración utiliza ``signature_version='s3v4'`` y ``addressing_style='virtual'``
-    según las recomendaciones de Cloudflare R2.  Además se omite el parámetro
-    ``verify=False`` para permitir la verificación TLS y se especifica
-    ``region_name='auto'`` para que R2 determine la región adecuada.
-    """
-    cfg = Config(
-        signature_version='s3v4',
-        s3={'addressing_style': 'virtual'}
-    )
-    return boto3.client(
-        's3',
-        endpoint_url=os.getenv('R2_ENDPOINT_URL'),
-        aws_access_key_id=os.getenv('R2_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('R2_SECRET_ACCESS_KEY'),
-        region_name='auto',
-        config=cfg
-    )
+    with phase("db_connect"):
+        return get_readiness(g.tenant_id, g.tenant_config).connection()
 
 
 def _codes_list(raw: str):
     if not raw:
         return []
-    return [c.strip().upper() for c in raw.replace("\n", ",").replace(";", ",").replace(" ", ",").split(",") if c.strip()]
+    # Sin repetidos: (code_norm, document_id) es único en la BD
+    return list(dict.fromkeys(
+        c.strip().upper() for c in raw.replace("\n", ",").replace(";", ",").replace(" ", ",").split(",") if c.strip()
+    ))
+
+
+# Inserción de códigos; ``code_norm`` es la columna indexada que usan las búsquedas
+SQL_INSERT_CODE = "INSERT INTO codes (document_id, code, code_norm) VALUES (%s, %s, %s)"
+SQL_INSERT_DOCUMENT = "INSERT INTO documents (name, date, path) VALUES (%s, %s, %s)"
+# Con extracción automática (requiere la migración 6)
+SQL_INSERT_DOCUMENT_EXTRACCION = (
+    "INSERT INTO documents (name, date, path, extraction_status) "
+    f"VALUES (%s, %s, %s, '{EXTRACCION_PENDIENTE}')"
+)
 
 
 
@@ -155,18 +218,7 @@ def upload_document():
     if not f.filename:
         return jsonify({"error": "Archivo sin nombre"}), 400
 
-    tenant_id = g.tenant_id
     filename = secure_filename(f.filename)
-    object_key = f"{tenant_id}/{filename}"
-    bucket_name = os.getenv("R2_BUCKET_NAME")
-    s3 = get_s3_client()
-
-    try:
-        s3.upload_fileobj(f, bucket_name, object_key, ExtraArgs={'ContentType': f.content_type})
-    except Exception as e:
-        print(f"Error al subir a R2: {str(e)}")
-        return jsonify({"error": "Error interno al guardar el archivo."}), 500
-
     name = request.form.get("nombre") or request.form.get("name") or filename
     # Intenta obtener y convertir la fecha a ISO; si no es válida, devolverá None
     raw_date = request.form.get("fecha") or request.form.get("date") or ""
@@ -174,49 +226,634 @@ def upload_document():
     codigos = request.form.get("codigos") or request.form.get("codigos_extraidos")
 
     # Validar fecha: la columna 'date' en la BD es NOT NULL, por lo que se requiere una fecha válida
+    # (antes de subir nada, para no dejar objetos sin documento)
     if date_iso is None:
         return jsonify({"error": "Formato de fecha no válido; utilice YYYY-MM-DD o DD/MM/YYYY"}), 400
 
+    try:
+        object_key, subido = _guardar_objeto(f)
+    except Exception as e:
+        print(f"Error al subir a R2: {str(e)}")
+        return jsonify({"error": "Error interno al guardar el archivo."}), 500
+
+    conn = None
+    try:
+        # Dentro del ``try``: si no hay conexión también se suelta la referencia ya fijada
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            document_id = _insertar_documento(cur, name, date_iso, object_key, _codes_list(codigos))
+        return jsonify({"ok": True, "id": document_id, "reutilizado": not subido})
+    except Exception as e:
+        _soltar_objetos([object_key])
+        if isinstance(e, (DatabaseUnavailable, PoolTimeout)):
+            raise  # 503 con ``Retry-After``
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn and conn.open:
+            conn.close()
+
+
+# --- Objetos por contenido (``utils/object_store.py``) ---
+
+def _fijar_objetos(refs: list):
+    """
+    Fija una referencia por cada ``(clave, sha256, tamaño)`` antes de subir o
+    registrar nada y espera a que acabe un borrado en curso de esas claves.
+    """
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO documents (name, date, path) VALUES (%s, %s, %s)",
-                (name, date_iso, object_key),
+            acquire(cur, refs)
+            wait_for_deletes(cur, [ref[0] for ref in refs])
+    finally:
+        if conn and conn.open:
+            conn.close()
+
+
+def _soltar_objetos(keys: list):
+    """Suelta referencias fijadas que no llegaron a un documento y borra lo que quede sin uso."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            release(cur, keys)
+            delete_unreferenced(cur, keys)
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudieron soltar {len(keys)} referencia(s) a objetos de R2: {e}")
+    finally:
+        if conn and conn.open:
+            conn.close()
+
+
+def _guardar_objeto(f) -> tuple[str, bool]:
+    """
+    Guarda ``f`` en su clave por contenido: calcula el SHA-256, fija la
+    referencia y sube el archivo solo si R2 no lo tiene.  Devuelve
+    ``(clave, subido)``; si la subida falla, suelta la referencia.
+    """
+    digest, size = hash_stream(f)
+    object_key = content_key(g.tenant_id, digest)
+    _fijar_objetos([(object_key, digest, size)])
+    try:
+        subido = ensure_object(f, object_key, digest, size, f.content_type)
+    except Exception:
+        _soltar_objetos([object_key])
+        raise
+    return object_key, subido
+
+
+def _insertar_documento(cur, name: str, date_iso: str, object_key: str, codes: list) -> int:
+    """
+    Inserta el documento y sus códigos, sube la versión de datos del cliente,
+    lo añade al índice de códigos y, si el cliente lo tiene configurado,
+    encola la extracción automática de códigos del PDF.
+    """
+    extraer = extraction_enabled(g.tenant_config)
+    cur.execute(SQL_INSERT_DOCUMENT_EXTRACCION if extraer else SQL_INSERT_DOCUMENT,
+                (name, date_iso, object_key))
+    document_id = cur.lastrowid
+    if codes:
+        cur.executemany(SQL_INSERT_CODE, [(document_id, code, code.strip().upper()) for code in codes])
+    version = bump_version(g.tenant_id)
+    code_index.document_saved(
+        g.tenant_id,
+        {"id": document_id, "name": name, "date": datetime.date.fromisoformat(date_iso), "path": object_key},
+        codes,
+        version,
+    )
+    if extraer:
+        _encolar_extraccion([(document_id, object_key)])
+    return document_id
+
+
+def _encolar_extraccion(documentos: list):
+    """Encola ``[(id, clave)]`` ya guardados con ``extraction_status = 'pendiente'``."""
+    pipeline = get_pipeline()
+    for document_id, object_key in documentos:
+        if not pipeline.submit(g.tenant_id, g.tenant_config, document_id, object_key):
+            print(f"ADVERTENCIA: Cola de extracción llena; el documento {document_id} queda pendiente")
+
+
+# --- Ingesta masiva ---
+
+def _leer_manifiesto():
+    """
+    Lee el manifiesto de ``/upload/batch``: campo ``manifest`` con JSON, o un
+    archivo ``manifest`` en JSON o CSV (columnas ``archivo``, ``nombre``,
+    ``fecha``, ``codigos``).  Devuelve una lista de dicts.
+    """
+    archivo = request.files.get("manifest")
+    if archivo is not None:
+        texto = archivo.read().decode("utf-8-sig")
+        if (archivo.filename or "").lower().endswith(".csv"):
+            return list(csv.DictReader(io.StringIO(texto)))
+    else:
+        texto = request.form.get("manifest") or ""
+    if not texto.strip():
+        return []
+    items = json.loads(texto)
+    if not isinstance(items, list):
+        raise ValueError("El manifiesto debe ser una lista")
+    return items
+
+
+@documentos_bp.route("/upload/batch", methods=["POST"])
+def subir_lote():
+    """
+    Ingesta de muchos documentos en una petición.
+
+    Los archivos se suben a R2 en paralelo (una vez por contenido y solo si
+    R2 no lo tiene) y todas las filas de ``documents``/``codes`` se escriben
+    en una sola transacción (los códigos con ``executemany``).  Si la
+    transacción falla se sueltan las referencias y se borran de R2 los
+    objetos que queden sin uso.  La respuesta trae el resultado de cada elemento.
+    """
+    try:
+        manifiesto = _leer_manifiesto()
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": f"Manifiesto no válido: {e}"}), 400
+    if not manifiesto:
+        return jsonify({"error": "El manifiesto está vacío"}), 400
+    if len(manifiesto) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Máximo {BATCH_MAX_ITEMS} documentos por lote"}), 400
+
+    archivos = {}
+    for campo in request.files:
+        if campo == "manifest":
+            continue
+        for f in request.files.getlist(campo):
+            if f.filename:
+                archivos[f.filename] = f
+
+    # 1. Validar cada elemento
+    resultados = []
+    pendientes = []  # (índice, archivo, nombre, fecha, códigos)
+    vistos = set()
+    for i, item in enumerate(manifiesto):
+        item = item if isinstance(item, dict) else {}
+        nombre_archivo = item.get("archivo") or item.get("file") or ""
+        resultado = {"indice": i, "archivo": nombre_archivo, "ok": False}
+        resultados.append(resultado)
+        f = archivos.get(nombre_archivo)
+        date_iso = _parse_date(str(item.get("fecha") or item.get("date") or ""))
+        if f is None:
+            resultado["error"] = "Archivo no incluido en la petición"
+        elif nombre_archivo in vistos:
+            resultado["error"] = "Archivo repetido en el lote"
+        elif date_iso is None:
+            resultado["error"] = "Formato de fecha no válido"
+        else:
+            vistos.add(nombre_archivo)
+            codigos = item.get("codigos") or item.get("codigos_extraidos") or ""
+            if isinstance(codigos, list):
+                codigos = ",".join(codigos)
+            nombre = item.get("nombre") or item.get("name") or secure_filename(nombre_archivo)
+            pendientes.append((i, f, nombre, date_iso, _codes_list(codigos)))
+
+    # 2. Hash de cada archivo, referencias fijadas y subida a R2 en paralelo
+    #    de cada contenido distinto que R2 aún no tenga
+    def hashear(pendiente):
+        try:
+            return hash_stream(pendiente[1])
+        except Exception as e:
+            print(f"Error al leer {resultados[pendiente[0]]['archivo']}: {e}")
+            return None
+
+    subidos = []  # (índice, archivo, clave, nombre, fecha, códigos)
+    with ThreadPoolExecutor(max_workers=BATCH_UPLOAD_WORKERS) as pool:
+        hashes = list(pool.map(hashear, pendientes))
+        leidos = []
+        for pendiente, hashed in zip(pendientes, hashes):
+            if hashed is None:
+                resultados[pendiente[0]]["error"] = "No se pudo leer el archivo"
+            else:
+                leidos.append((pendiente, content_key(g.tenant_id, hashed[0]), *hashed))
+        if leidos:
+            _fijar_objetos([(object_key, digest, size) for _, object_key, digest, size in leidos])
+
+        unicos = {}
+        for pendiente, object_key, digest, size in leidos:
+            unicos.setdefault(object_key, (pendiente[1], digest, size))
+        futuros = {
+            pool.submit(ensure_object, f, object_key, digest, size, f.content_type): object_key
+            for object_key, (f, digest, size) in unicos.items()
+        }
+        fallidas = set()
+        for futuro in as_completed(futuros):
+            try:
+                futuro.result()
+            except Exception as e:
+                print(f"Error al subir a R2 {futuros[futuro]}: {e}")
+                fallidas.add(futuros[futuro])
+
+    for (i, f, nombre, date_iso, codes), object_key, _, _ in leidos:
+        if object_key in fallidas:
+            resultados[i]["error"] = "Error al guardar el archivo"
+        else:
+            subidos.append((i, f, object_key, nombre, date_iso, codes))
+    if fallidas:
+        _soltar_objetos([object_key for _, object_key, _, _ in leidos if object_key in fallidas])
+
+    # 3. Una sola transacción para todas las filas
+    ids = []
+    extraer = extraction_enabled(g.tenant_config)
+    if subidos:
+        conn = None
+        try:
+            conn = get_db_connection()
+            conn.begin()
+            with conn.cursor() as cur:
+                filas_codigos = []
+                for i, _, object_key, nombre, date_iso, codes in subidos:
+                    cur.execute(SQL_INSERT_DOCUMENT_EXTRACCION if extraer else SQL_INSERT_DOCUMENT,
+                                (nombre, date_iso, object_key))
+                    ids.append(cur.lastrowid)
+                    filas_codigos.extend((cur.lastrowid, code, code.strip().upper()) for code in codes)
+                if filas_codigos:
+                    cur.executemany(SQL_INSERT_CODE, filas_codigos)
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            print(f"Error en la ingesta masiva, soltando {len(subidos)} objetos: {e}")
+            _soltar_objetos([p[2] for p in subidos])
+            for p in subidos:
+                resultados[p[0]]["error"] = f"Error de base de datos: {e}"
+            subidos, ids = [], []
+        finally:
+            if conn and conn.open:
+                conn.close()
+
+        # Una sola versión nueva para todo el lote
+        version = bump_version(g.tenant_id) if ids else None
+        for (i, _, object_key, nombre, date_iso, codes), document_id in zip(subidos, ids):
+            resultados[i].update(ok=True, id=document_id, key=object_key)
+            code_index.document_saved(
+                g.tenant_id,
+                {"id": document_id, "name": nombre, "date": datetime.date.fromisoformat(date_iso), "path": object_key},
+                codes,
+                version,
             )
-            document_id = cur.lastrowid
-            if codigos:
-                for code in _codes_list(codigos):
-                    cur.execute(
-                        "INSERT INTO codes (document_id, code) VALUES (%s, %s)",
-                        (document_id, code),
-                    )
-        return jsonify({"ok": True, "id": document_id})
+        if extraer:
+            _encolar_extraccion([(document_id, p[2]) for p, document_id in zip(subidos, ids)])
+
+    correctos = sum(1 for r in resultados if r["ok"])
+    status = 200 if correctos == len(resultados) else (207 if correctos else 400)
+    return jsonify({"ok": correctos == len(resultados), "total": len(resultados),
+                    "correctos": correctos, "resultados": resultados}), status
+
+
+# --- Subida y descarga directas contra R2 (URLs prefirmadas) ---
+
+def _staging_key(filename: str) -> str | None:
+    filename = secure_filename(filename or "")
+    return staging_key(g.tenant_id, filename) if filename else None
+
+
+@documentos_bp.route("/upload/init", methods=["POST"])
+def iniciar_subida():
+    """
+    Primera fase de la subida directa: devuelve una URL prefirmada ``PUT``
+    o, para archivos grandes (o con ``"multipart": true``), las URLs de
+    cada parte de una subida multiparte.  El archivo nunca pasa por Flask:
+    va a una clave temporal que ``/upload/complete`` pasa a la de su contenido.
+    """
+    data = request.get_json(silent=True) or {}
+    object_key = _staging_key(data.get("filename"))
+    if not object_key:
+        return jsonify({"error": "Falta 'filename'"}), 400
+    content_type = data.get("content_type") or "application/pdf"
+    try:
+        size = int(data.get("size") or 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "'size' debe ser un entero"}), 400
+
+    s3 = get_s3_client()
+    bucket_name = os.getenv("R2_BUCKET_NAME")
+    multipart = bool(data.get("multipart")) or size > PRESIGN_MULTIPART_THRESHOLD
+    try:
+        if not multipart:
+            url = s3.generate_presigned_url(
+                "put_object",
+                Params={"Bucket": bucket_name, "Key": object_key, "ContentType": content_type},
+                ExpiresIn=PRESIGN_EXPIRES,
+            )
+            return jsonify({
+                "key": object_key,
+                "method": "PUT",
+                "url": url,
+                "headers": {"Content-Type": content_type},
+                "expires_in": PRESIGN_EXPIRES,
+            })
+
+        if not size:
+            return jsonify({"error": "La subida multiparte requiere 'size'"}), 400
+        n_parts = -(-size // PRESIGN_PART_SIZE)
+        if n_parts > 10000:
+            return jsonify({"error": "Archivo demasiado grande"}), 400
+        upload = s3.create_multipart_upload(Bucket=bucket_name, Key=object_key, ContentType=content_type)
+        parts = [
+            {
+                "part_number": n,
+                "url": s3.generate_presigned_url(
+                    "upload_part",
+                    Params={"Bucket": bucket_name, "Key": object_key,
+                            "UploadId": upload["UploadId"], "PartNumber": n},
+                    ExpiresIn=PRESIGN_EXPIRES,
+                ),
+            }
+            for n in range(1, n_parts + 1)
+        ]
+        return jsonify({
+            "key": object_key,
+            "upload_id": upload["UploadId"],
+            "part_size": PRESIGN_PART_SIZE,
+            "parts": parts,
+            "expires_in": PRESIGN_EXPIRES,
+        })
+    except Exception as e:
+        print(f"Error al preparar la subida directa a R2: {e}")
+        return jsonify({"error": "No se pudo preparar la subida."}), 500
+
+
+@documentos_bp.route("/upload/complete", methods=["POST"])
+def completar_subida():
+    """
+    Segunda fase: cierra la subida multiparte (si la hubo), verifica el
+    objeto con ``HEAD``, lo pasa a su clave por contenido y registra el
+    documento y sus códigos.
+    """
+    data = request.get_json(silent=True) or {}
+    staging = data.get("key") or ""
+    # El objeto debe ser una subida temporal del cliente que hace la petición
+    if not is_staging_key(g.tenant_id, staging):
+        return jsonify({"error": "Clave de objeto no válida"}), 400
+
+    date_iso = _parse_date(data.get("fecha") or data.get("date") or "")
+    if date_iso is None:
+        return jsonify({"error": "Formato de fecha no válido; utilice YYYY-MM-DD o DD/MM/YYYY"}), 400
+    name = data.get("nombre") or data.get("name") or os.path.basename(staging)
+    codigos = data.get("codigos") or data.get("codigos_extraidos") or ""
+    if isinstance(codigos, list):
+        codigos = ",".join(codigos)
+
+    s3 = get_s3_client()
+    bucket_name = os.getenv("R2_BUCKET_NAME")
+    upload_id = data.get("upload_id")
+    if upload_id:
+        try:
+            parts = sorted(
+                ({"PartNumber": int(p["part_number"]), "ETag": p["etag"]} for p in data.get("parts") or []),
+                key=lambda p: p["PartNumber"],
+            )
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "'parts' debe ser una lista de {part_number, etag}"}), 400
+        try:
+            s3.complete_multipart_upload(
+                Bucket=bucket_name, Key=staging, UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except Exception as e:
+            print(f"Error al completar la subida multiparte {staging}: {e}")
+            return jsonify({"error": "No se pudo completar la subida multiparte."}), 400
+
+    try:
+        head = s3.head_object(Bucket=bucket_name, Key=staging)
+    except Exception:
+        return jsonify({"error": "El archivo no se encuentra en el almacenamiento"}), 400
+    if not head.get("ContentLength"):
+        return jsonify({"error": "El archivo subido está vacío"}), 400
+    try:
+        digest, size = hash_object(staging)
+    except Exception as e:
+        print(f"Error al leer la subida {staging}: {e}")
+        return jsonify({"error": "No se pudo leer el archivo subido."}), 500
+    object_key = content_key(g.tenant_id, digest)
+
+    # La referencia va antes que la copia y el documento: desde aquí el objeto no se borra
+    _fijar_objetos([(object_key, digest, size)])
+    try:
+        copiado = promote_staging(staging, object_key, digest, size, head.get("ContentType"))
+    except Exception as e:
+        print(f"Error al mover la subida {staging} a {object_key}: {e}")
+        _soltar_objetos([object_key])
+        return jsonify({"error": "Error interno al guardar el archivo."}), 500
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            document_id = _insertar_documento(cur, name, date_iso, object_key, _codes_list(codigos))
+        return jsonify({"ok": True, "id": document_id, "size": size, "reutilizado": not copiado})
     except Exception as e:
+        _soltar_objetos([object_key])
+        if isinstance(e, (DatabaseUnavailable, PoolTimeout)):
+            raise
         return jsonify({"error": str(e)}), 500
     finally:
         if conn and conn.open:
             conn.close()
 
 
+@documentos_bp.route("/download/<int:doc_id>", methods=["GET"])
+def descargar_documento(doc_id):
+    """
+    URL prefirmada ``GET`` del PDF original.  Con ``?redirect=1`` responde
+    ``302`` hacia ella; si no, la devuelve en JSON.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT name, path FROM documents WHERE id=%s", (doc_id,))
+            row = cur.fetchone()
+    finally:
+        if conn and conn.open:
+            conn.close()
+    if not row or not row.get("path"):
+        return jsonify({"error": "Documento no encontrado"}), 404
+
+    filename = secure_filename(row.get("name") or "") or os.path.basename(row["path"])
+    if not filename.lower().endswith(".pdf"):
+        filename += ".pdf"
+    url = get_s3_client().generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": os.getenv("R2_BUCKET_NAME"),
+            "Key": row["path"],
+            "ResponseContentDisposition": f'inline; filename="{filename}"',
+            "ResponseContentType": "application/pdf",
+        },
+        ExpiresIn=PRESIGN_EXPIRES,
+    )
+    if request.args.get("redirect") in ("1", "true"):
+        return redirect(url, code=302)
+    return jsonify({"url": url, "expires_in": PRESIGN_EXPIRES})
+
+
+def _like_escape(texto: str) -> str:
+    """Escapa los comodines de LIKE (con ``ESCAPE '\\'``) para buscarlos literalmente."""
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _like_prefix(texto: str) -> str:
+    """Escapa los comodines de LIKE y añade ``%`` para buscar por prefijo."""
+    return _like_escape(texto) + "%"
+
+
+def _filtros_listado(args):
+    """
+    Traduce los filtros opcionales del listado (``desde``, ``hasta``,
+    ``nombre``) a condiciones SQL sobre ``documents d``.
+    Devuelve ``(condiciones, parámetros, error)``.
+    """
+    condiciones, params = [], []
+    for clave, op in (("desde", ">="), ("hasta", "<=")):
+        raw = args.get(clave)
+        if raw:
+            fecha = _parse_date(raw)
+            if fecha is None:
+                return None, None, f"Formato de fecha no válido en '{clave}'"
+            condiciones.append(f"d.date {op} %s")
+            params.append(fecha)
+    nombre = (args.get("nombre") or "").strip()
+    if nombre:
+        condiciones.append("d.name LIKE %s ESCAPE '\\\\'")
+        params.append(_like_prefix(nombre))
+    return condiciones, params, None
+
+
+def _codigos_por_documento(cur, ids) -> dict:
+    """Códigos de varios documentos en una sola consulta (sin ``GROUP_CONCAT``)."""
+    if not ids:
+        return {}
+    placeholders = ",".join(["%s"] * len(ids))
+    cur.execute(
+        f"SELECT document_id, code FROM codes WHERE document_id IN ({placeholders}) ORDER BY document_id, code",
+        tuple(ids),
+    )
+    codigos = {}
+    for row in cur.fetchall():
+        codigos.setdefault(row["document_id"], []).append(row["code"])
+    return codigos
+
+
+def _stream_documentos(conn, condiciones, params, ndjson: bool, dumps):
+    """
+    Genera la exportación completa del listado sin cargarla en memoria.
+
+    Usa un cursor sin buffer (``SSDictCursor``) sobre ``documents LEFT JOIN
+    codes`` ordenado por documento, y agrupa los códigos consecutivos de cada
+    documento en Python.  La salida se agrupa en bloques de ~64 KiB.
+    """
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    cur = conn.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        cur.execute(
+            f"""
+            SELECT d.id, d.name, d.date, d.path, c.code
+            FROM documents d
+            LEFT JOIN codes c ON c.document_id = d.id
+            {where}
+            ORDER BY d.id DESC, c.code
+            """,
+            tuple(params),
+        )
+        buffer = [] if ndjson else ["["]
+        size = 0
+        primero = True
+        actual = None
+        codigos = []
+
+        def serializar(doc, codigos):
+            nonlocal primero
+            doc["codigos_extraidos"] = ",".join(codigos) if codigos else None
+            texto = dumps(doc)
+            if ndjson:
+                return texto + "\n"
+            if primero:
+                primero = False
+                return texto
+            return "," + texto
+
+        for row in cur:
+            if actual is None or row["id"] != actual["id"]:
+                if actual is not None:
+                    chunk = serializar(actual, codigos)
+                    buffer.append(chunk)
+                    size += len(chunk)
+                    if size >= 65536:
+                        yield "".join(buffer)
+                        buffer, size = [], 0
+                actual = {k: row[k] for k in ("id", "name", "date", "path")}
+                codigos = []
+            if row["code"] is not None:
+                codigos.append(row["code"])
+        if actual is not None:
+            buffer.append(serializar(actual, codigos))
+        if not ndjson:
+            buffer.append("]")
+        yield "".join(buffer)
+    finally:
+        cur.close()
+        conn.close()
+
+
 @documentos_bp.route("/", methods=["GET"])
+@cached_read
 def listar_documentos():
+    """
+    Listado de documentos.
+
+    - Con ``limit`` y/o ``after_id``: una página por cursor (``id`` descendente)
+      ``{"items": [...], "next_after_id": ...}``.
+    - Sin ellos: exportación completa en streaming, como arreglo JSON o como
+      NDJSON con ``formato=ndjson``.
+
+    Filtros opcionales: ``desde``/``hasta`` (fechas) y ``nombre`` (prefijo).
+    Las páginas se cachean con ``ETag``; la exportación en streaming no.
+    """
+    condiciones, params, error = _filtros_listado(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+
+    paginado = "limit" in request.args or "after_id" in request.args
+    if not paginado:
+        ndjson = (request.args.get("formato") or "").lower() == "ndjson"
+        conn = get_db_connection()
+        resp = Response(
+            stream_with_context(_stream_documentos(conn, condiciones, params, ndjson, current_app.json.dumps)),
+            mimetype="application/x-ndjson" if ndjson else "application/json",
+        )
+        # Devolver la conexión aunque el cliente se desconecte antes de empezar
+        resp.call_on_close(conn.close)
+        return resp
+
+    try:
+        limit = min(max(int(request.args.get("limit", LIST_PAGE_SIZE)), 1), LIST_MAX_PAGE_SIZE)
+        after_id = int(request.args["after_id"]) if request.args.get("after_id") else None
+    except ValueError:
+        return jsonify({"error": "'limit' y 'after_id' deben ser enteros"}), 400
+    if after_id is not None:
+        condiciones.append("d.id < %s")
+        params.append(after_id)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
-                """
-                SELECT 
-                    d.id, d.name, d.date, d.path,
-                    GROUP_CONCAT(c.code ORDER BY c.code) AS codigos_extraidos
-                FROM documents d
-                LEFT JOIN codes c ON c.document_id = d.id
-                GROUP BY d.id
-                ORDER BY d.id DESC
-                """
+                f"SELECT d.id, d.name, d.date, d.path FROM documents d {where} ORDER BY d.id DESC LIMIT %s",
+                tuple(params) + (limit,),
             )
             rows = cur.fetchall()
-        return jsonify(rows)
+            codigos = _codigos_por_documento(cur, [r["id"] for r in rows])
+        for row in rows:
+            lista = codigos.get(row["id"])
+            row["codigos_extraidos"] = ",".join(lista) if lista else None
+        next_after_id = rows[-1]["id"] if len(rows) == limit else None
+        return jsonify({"items": rows, "next_after_id": next_after_id})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -225,6 +862,7 @@ def listar_documentos():
 
 
 @documentos_bp.route("/ ", methods=["GET"])
+@cached_read
 def obtener_documento(doc_id):
     conn = get_db_connection()
     try:
@@ -262,34 +900,35 @@ def editar_documento(doc_id):
 
     new_object_key = None
     old_object_key = None
-    
+    sin_confirmar = None  # referencia fijada que aún no usa ningún documento
+
     # 1. Lógica para manejar la actualización del archivo PDF
     if "file" in request.files:
         new_file = request.files["file"]
         if new_file and new_file.filename:
-            tenant_id = g.tenant_id
-            filename = secure_filename(new_file.filename)
-            new_object_key = f"{tenant_id}/{filename}"
-            bucket_name = os.getenv("R2_BUCKET_NAME")
-            s3 = get_s3_client()
-            
             try:
-                # Primero, subimos el nuevo archivo a R2
-                s3.upload_fileobj(new_file, bucket_name, new_object_key, ExtraArgs={'ContentType': new_file.content_type})
+                # Primero, guardamos el nuevo archivo (con su referencia; no se sube si R2 ya lo tiene)
+                new_object_key, _ = _guardar_objeto(new_file)
+                sin_confirmar = new_object_key
             except Exception as e:
                 print(f"Error al subir el nuevo archivo a R2 durante la edición: {str(e)}")
                 return jsonify({"error": "No se pudo actualizar el archivo en el almacenamiento."}), 500
 
-    conn = get_db_connection()
+    conn = None
     try:
+        conn = get_db_connection()
         with conn.cursor() as cur:
-            # Si subimos un archivo nuevo, necesitamos borrar el antiguo de R2
+            # Cambio de archivo y referencias en la misma transacción
+            conn.begin()
             if new_object_key:
                 # Obtenemos la ruta (key) del archivo antiguo ANTES de actualizar la BD
-                cur.execute("SELECT path FROM documents WHERE id=%s", (doc_id,))
+                cur.execute("SELECT path FROM documents WHERE id=%s FOR UPDATE", (doc_id,))
                 result = cur.fetchone()
-                if result:
-                    old_object_key = result.get('path')
+                if not result:
+                    conn.rollback()
+                    _soltar_objetos([new_object_key])
+                    return jsonify({"error": "Documento no encontrado"}), 404
+                old_object_key = result.get('path')
 
             # 2. Construir la consulta SQL dinámicamente
             sql_parts = ["name=%s"]
@@ -298,10 +937,17 @@ def editar_documento(doc_id):
             if date_iso is not None:
                 sql_parts.append("date=%s")
                 params.append(date_iso)
-            # Si se subió un archivo, actualizar también el path
+            # Si se subió un archivo, actualizar también el path (y volver a extraer)
+            extraer = bool(new_object_key) and extraction_enabled(g.tenant_config)
             if new_object_key:
                 sql_parts.append("path=%s")
                 params.append(new_object_key)
+            if extraer:
+                sql_parts.append("extraction_status=%s, extraction_error=NULL")
+                params.append(EXTRACCION_PENDIENTE)
+                cur.execute("DELETE FROM code_pages WHERE document_id=%s", (doc_id,))
+                if content_search_enabled(g.tenant_config):
+                    cur.execute("DELETE FROM document_texts WHERE document_id=%s", (doc_id,))
 
             params.append(doc_id)
             query = f"UPDATE documents SET {', '.join(sql_parts)} WHERE id=%s"
@@ -310,29 +956,49 @@ def editar_documento(doc_id):
             # 3. Actualizar los códigos (lógica sin cambios)
             if codigos is not None:
                 cur.execute("DELETE FROM codes WHERE document_id=%s", (doc_id,))
-                for code in _codes_list(codigos):
-                    cur.execute(
-                        "INSERT INTO codes (document_id, code) VALUES (%s, %s)",
-                        (doc_id, code),
-                    )
+                codes = _codes_list(codigos)
+                if codes:
+                    cur.executemany(SQL_INSERT_CODE, [(doc_id, code, code.strip().upper()) for code in codes])
+
+            # El documento deja de usar el objeto antiguo (aunque sea el mismo contenido:
+            # la subida ya fijó una referencia nueva)
+            if old_object_key:
+                release(cur, [old_object_key])
+            conn.commit()
+            sin_confirmar = None
+
+            # Invalidar las lecturas cacheadas y refrescar el índice de códigos
+            version = bump_version(g.tenant_id)
+            if code_index.is_loaded(g.tenant_id):
+                cur.execute("SELECT id, name, date, path FROM documents WHERE id=%s", (doc_id,))
+                row = cur.fetchone()
+                if row:
+                    cur.execute("SELECT code FROM codes WHERE document_id=%s", (doc_id,))
+                    code_index.document_saved(g.tenant_id, row, [r["code"] for r in cur.fetchall()], version)
         # 4. Si todo salió bien en la BD y reemplazamos un archivo, borrar el antiguo de R2
+        #    si ningún otro documento lo usa (si falla, queda en la cola de reintento)
         if old_object_key and old_object_key != new_object_key:
             try:
-                s3 = get_s3_client()
-                s3.delete_object(Bucket=os.getenv("R2_BUCKET_NAME"), Key=old_object_key)
+                with conn.cursor() as cur:
+                    delete_unreferenced(cur, [old_object_key])
             except Exception as e:
                 # Si falla el borrado, solo lo registramos, no revertimos la operación
                 print(f"ADVERTENCIA: No se pudo borrar el archivo antiguo '{old_object_key}' de R2: {e}")
 
+        if extraer:
+            _encolar_extraccion([(doc_id, new_object_key)])
         return jsonify({"ok": True})
     except Exception as e:
-        # Si hay un error con la BD, debemos borrar el nuevo archivo que ya subimos a R2
-        if new_object_key:
-            try:
-                s3 = get_s3_client()
-                s3.delete_object(Bucket=os.getenv("R2_BUCKET_NAME"), Key=new_object_key)
-            except:
-                pass  # Ignorar error de borrado en cascada
+        # Si hay un error con la BD, soltamos la referencia del archivo nuevo (y lo
+        # borramos de R2 si nadie más lo usa)
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        if sin_confirmar:
+            _soltar_objetos([sin_confirmar])
+        if isinstance(e, (DatabaseUnavailable, PoolTimeout)):
+            raise
         return jsonify({"error": str(e)}), 500
     finally:
         if conn and conn.open:
@@ -344,26 +1010,207 @@ def eliminar_documento(doc_id):
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT path FROM documents WHERE id=%s", (doc_id,))
+            # Fila y referencia al objeto en la misma transacción
+            conn.begin()
+            cur.execute("SELECT path FROM documents WHERE id=%s FOR UPDATE", (doc_id,))
             row = cur.fetchone()
-            if row and row.get("path"):
-                try:
-                    s3 = get_s3_client()
-                    s3.delete_object(Bucket=os.getenv("R2_BUCKET_NAME"), Key=row["path"])
-                except Exception as e:
-                    print(f"Advertencia: No se pudo eliminar de R2 el objeto {row['path']}: {e}")
-            
+            path = row.get("path") if row else None
             cur.execute("DELETE FROM codes WHERE document_id=%s", (doc_id,))
             cur.execute("DELETE FROM documents WHERE id=%s", (doc_id,))
+            release(cur, [path])
+            conn.commit()
+            code_index.document_deleted(g.tenant_id, doc_id, bump_version(g.tenant_id))
+
+            # El objeto solo se borra de R2 si ningún otro documento lo usa;
+            # si falla queda en la cola de reintento
+            if path:
+                try:
+                    delete_unreferenced(cur, [path])
+                except Exception as e:
+                    print(f"Advertencia: No se pudo eliminar de R2 el objeto {path}: {e}")
         return jsonify({"ok": True, "message": "Documento eliminado correctamente"})
     except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
         return jsonify({"ok": False, "error": str(e)}), 500
     finally:
         if conn and conn.open:
             conn.close()
 
 
+def _chunks(items: list, size: int = DELETE_CHUNK_SIZE):
+    for inicio in range(0, len(items), size):
+        yield items[inicio:inicio + size]
+
+
+@documentos_bp.route("/delete/batch", methods=["POST"])
+def eliminar_lote():
+    """
+    Borrado masivo: ``{"ids": [...]}`` o ``{"filtro": {"desde", "hasta", "nombre"}}``.
+    Las filas se borran en una transacción con ``IN`` por bloques y los
+    objetos de R2 con ``DeleteObjects`` en paralelo; los que fallan quedan
+    en la cola de reintento.  Responde el resultado de cada id.
+    """
+    data = request.get_json(silent=True) or {}
+    ids, filtro = data.get("ids"), data.get("filtro")
+    if ids is not None:
+        try:
+            ids = list(dict.fromkeys(int(i) for i in ids))
+        except (TypeError, ValueError):
+            return jsonify({"error": "'ids' debe ser una lista de enteros"}), 400
+        condiciones = None
+    elif isinstance(filtro, dict):
+        condiciones, params, error = _filtros_listado(filtro)
+        if error:
+            return jsonify({"error": error}), 400
+        if not condiciones:
+            return jsonify({"error": "El filtro necesita al menos 'desde', 'hasta' o 'nombre'"}), 400
+    else:
+        return jsonify({"error": "Indique 'ids' o 'filtro'"}), 400
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            # 1. Documentos afectados
+            encontrados = {}
+            if condiciones is None:
+                if len(ids) > BATCH_DELETE_MAX_ITEMS:
+                    return jsonify({"error": f"Máximo {BATCH_DELETE_MAX_ITEMS} documentos por petición"}), 400
+                for bloque in _chunks(ids):
+                    cur.execute(
+                        f"SELECT id, path FROM documents WHERE id IN ({', '.join(['%s'] * len(bloque))})",
+                        bloque,
+                    )
+                    encontrados.update((row["id"], row["path"]) for row in cur.fetchall())
+            else:
+                cur.execute(
+                    f"SELECT d.id, d.path FROM documents d WHERE {' AND '.join(condiciones)} "
+                    "ORDER BY d.id LIMIT %s",
+                    (*params, BATCH_DELETE_MAX_ITEMS + 1),
+                )
+                encontrados = {row["id"]: row["path"] for row in cur.fetchall()}
+                if len(encontrados) > BATCH_DELETE_MAX_ITEMS:
+                    return jsonify({"error": f"El filtro afecta a más de {BATCH_DELETE_MAX_ITEMS} documentos"}), 400
+                ids = list(encontrados)
+            borrar = [i for i in ids if i in encontrados]
+
+            # 2. Una transacción para todas las filas y sus referencias a objetos
+            #    (releídas con bloqueo: un borrado simultáneo no las resta dos veces)
+            if borrar:
+                conn.begin()
+                try:
+                    for bloque in _chunks(borrar):
+                        marcas = ", ".join(["%s"] * len(bloque))
+                        cur.execute(f"SELECT path FROM documents WHERE id IN ({marcas}) FOR UPDATE", bloque)
+                        release(cur, [row["path"] for row in cur.fetchall()])
+                        cur.execute(f"DELETE FROM codes WHERE document_id IN ({marcas})", bloque)
+                        cur.execute(f"DELETE FROM documents WHERE id IN ({marcas})", bloque)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                version = bump_version(g.tenant_id)
+                for doc_id in borrar:
+                    code_index.document_deleted(g.tenant_id, doc_id, version)
+
+            # 3. Objetos de R2 que ya no usa ningún documento
+            claves = list(dict.fromkeys(encontrados[i] for i in borrar if encontrados[i]))
+            fallidos, en_uso = delete_unreferenced(cur, claves)
+            # Aprovechar para reintentar borrados anteriores que ya tocan
+            try:
+                retry_pending(cur)
+            except Exception as e:
+                print(f"ADVERTENCIA: No se pudieron reintentar los borrados pendientes de R2: {e}")
+
+        resultados = []
+        for doc_id in ids:
+            if doc_id not in encontrados:
+                resultados.append({"id": doc_id, "ok": False, "error": "Documento no encontrado"})
+                continue
+            clave = encontrados[doc_id]
+            objeto = ("pendiente" if clave in fallidos else "compartido" if clave in en_uso
+                      else "borrado" if clave else None)
+            resultados.append({"id": doc_id, "ok": True, "objeto": objeto})
+        correctos = len(borrar)
+        status = 200 if correctos == len(ids) else (207 if correctos else 404)
+        return jsonify({"ok": correctos == len(ids), "total": len(ids), "borrados": correctos,
+                        "objetos_pendientes": len(fallidos), "resultados": resultados}), status
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+    finally:
+        if conn and conn.open:
+            conn.close()
+
+
+# --- Extracción automática de códigos ---
+
+@documentos_bp.route("/extraccion/<int:doc_id>", methods=["GET", "POST"])
+def extraccion_documento(doc_id):
+    """
+    ``GET``: estado de la extracción del documento y códigos/páginas hallados.
+    ``POST``: vuelve a encolarla (p. ej. tras un error o con la cola llena).
+    """
+    if not extraction_enabled(g.tenant_config):
+        return jsonify({"error": "La extracción automática no está configurada para este cliente"}), 404
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, path, extraction_status, extraction_error FROM documents WHERE id=%s",
+                (doc_id,),
+            )
+            row = cur.fetchone()
+            if not row:
+                return jsonify({"error": "Documento no encontrado"}), 404
+            if request.method == "POST":
+                cur.execute(
+                    "UPDATE documents SET extraction_status=%s, extraction_error=NULL WHERE id=%s",
+                    (EXTRACCION_PENDIENTE, doc_id),
+                )
+                _encolar_extraccion([(doc_id, row["path"])])
+                return jsonify({"ok": True, "id": doc_id, "estado": EXTRACCION_PENDIENTE}), 202
+            cur.execute(
+                "SELECT COUNT(DISTINCT code_norm) AS codigos, COUNT(*) AS apariciones "
+                "FROM code_pages WHERE document_id=%s",
+                (doc_id,),
+            )
+            totales = cur.fetchone()
+            respuesta = {
+                "id": doc_id,
+                "estado": row["extraction_status"],
+                "error": row["extraction_error"],
+                "codigos": totales["codigos"],
+                "apariciones": totales["apariciones"],
+            }
+            if content_search_enabled(g.tenant_config):
+                cur.execute("SELECT COUNT(*) AS paginas FROM document_texts WHERE document_id=%s", (doc_id,))
+                respuesta["paginas_con_texto"] = cur.fetchone()["paginas"]
+        return jsonify(respuesta)
+    finally:
+        if conn and conn.open:
+            conn.close()
+
+
+def _ids_por_codigo(cur, codigo: str, exacto: bool) -> list:
+    """Ids (de mayor a menor) cuyo nombre o algún código coincide con ``codigo`` (ya en mayúsculas)."""
+    # Sin escapar, un ``_`` o ``%`` del código haría de comodín y devolvería
+    # más que el índice en memoria
+    cond = "= %s" if exacto else "LIKE %s ESCAPE '\\\\'"
+    termino = codigo if exacto else f"%{_like_escape(codigo)}%"
+
+    cur.execute(f"SELECT id FROM documents WHERE name {cond}", (termino,))
+    ids_from_name = {row["id"] for row in cur.fetchall()}
+
+    cur.execute(f"SELECT document_id AS id FROM codes WHERE code_norm {cond}", (termino,))
+    ids_from_code = {row["id"] for row in cur.fetchall()}
+
+    return sorted(ids_from_name | ids_from_code, reverse=True)
+
+
 @documentos_bp.route("/search_by_code", methods=["POST"])
+@cached_read
 def buscar_por_codigo():
     data = request.get_json(silent=True) or {}
     codigo_buscado = (data.get("codigo") or "").strip().upper()
@@ -372,45 +1219,40 @@ def buscar_por_codigo():
     if not codigo_buscado:
         return jsonify([])
 
+    # Índice en memoria del cliente; ``None`` si está desactivado o excede su presupuesto
+    with phase("code_index"):
+        index = code_index.get_index(g.tenant_id, get_db_connection, data_version(g.tenant_id))
+    if index is not None:
+        if modo in ("prefijo", "prefix"):
+            return jsonify(index.prefix(codigo_buscado, 50))
+        return jsonify(index.search(codigo_buscado, exact=modo in ("exacto", "exact")))
+
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
+            # Predicados sobre columnas sin funciones: usan los índices de
+            # code_norm y name (la colación de name ya ignora mayúsculas)
             if modo in ("prefijo", "prefix"):
                 cur.execute(
-                    "SELECT DISTINCT c.code FROM codes c WHERE UPPER(c.code) LIKE %s ORDER BY c.code LIMIT 50",
-                    (codigo_buscado + "%",),
+                    "SELECT DISTINCT c.code_norm AS code FROM codes c WHERE c.code_norm LIKE %s ESCAPE '\\\\' ORDER BY c.code_norm LIMIT 50",
+                    (_like_prefix(codigo_buscado),),
                 )
                 return jsonify([r["code"] for r in cur.fetchall()])
 
-            op = "=" if modo in ("exacto", "exact") else "LIKE"
-            termino = codigo_buscado if op == "=" else f"%{codigo_buscado}%"
-
-            cur.execute(f"SELECT id FROM documents WHERE UPPER(name) {op} %s", (termino,))
-            ids_from_name = {row["id"] for row in cur.fetchall()}
-
-            cur.execute(f"SELECT document_id AS id FROM codes WHERE UPPER(code) {op} %s", (termino,))
-            ids_from_code = {row["id"] for row in cur.fetchall()}
-
-            ids_documentos = list(ids_from_name | ids_from_code)
-
+            ids_documentos = _ids_por_codigo(cur, codigo_buscado, modo in ("exacto", "exact"))
             if not ids_documentos:
                 return jsonify([])
 
             placeholders = ",".join(["%s"] * len(ids_documentos))
             cur.execute(
-                f"""
-                SELECT 
-                    d.id, d.name, d.date, d.path,
-                    COALESCE(GROUP_CONCAT(c.code ORDER BY c.code), 'N/A') AS codigos_extraidos
-                FROM documents d
-                LEFT JOIN codes c ON d.id = c.document_id
-                WHERE d.id IN ({placeholders})
-                GROUP BY d.id
-                ORDER BY d.id DESC
-                """,
+                f"SELECT d.id, d.name, d.date, d.path FROM documents d WHERE d.id IN ({placeholders}) ORDER BY d.id DESC",
                 tuple(ids_documentos),
             )
             rows = cur.fetchall()
+            codigos = _codigos_por_documento(cur, ids_documentos)
+        for row in rows:
+            lista = codigos.get(row["id"])
+            row["codigos_extraidos"] = ",".join(lista) if lista else "N/A"
         return jsonify(rows)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -419,100 +1261,686 @@ def buscar_por_codigo():
             conn.close()
 
 
+@documentos_bp.route("/search_content", methods=["POST"])
+@cached_read
+def buscar_por_contenido():
+    """
+    Búsqueda por el texto de los PDF: ``{"texto", "limit", "offset"}``.
+    Frases entre comillas, ``-palabra`` para excluir y ``palabra*`` para
+    prefijos; resultados por relevancia con las páginas que coinciden.
+    """
+    if not content_search_enabled(g.tenant_config):
+        return jsonify({"error": "La búsqueda por contenido no está activada para este cliente"}), 404
+    data = request.get_json(silent=True) or {}
+    texto = (data.get("texto") or data.get("q") or "").strip()
+    try:
+        limit = min(max(int(data.get("limit") or CONTENT_SEARCH_PAGE_SIZE), 1), LIST_MAX_PAGE_SIZE)
+        offset = max(int(data.get("offset") or 0), 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "'limit' y 'offset' deben ser enteros"}), 400
+    if offset > CONTENT_SEARCH_MAX_OFFSET:
+        return jsonify({"error": f"'offset' no puede superar {CONTENT_SEARCH_MAX_OFFSET}; afine la búsqueda"}), 400
+    if not texto:
+        return jsonify({"items": [], "next_offset": None})
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            filas, hay_mas = text_search.search(cur, texto, limit, offset)
+        return jsonify({"items": filas, "next_offset": offset + limit if hay_mas else None})
+    except pymysql.err.ProgrammingError as e:
+        # Consulta que el analizador de FULLTEXT no acepta
+        return jsonify({"error": f"Consulta no válida: {e}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn and conn.open:
+            conn.close()
+
+
+def _documentos_por_codigos(cur, pedidos: list):
+    """
+    Documentos que contienen alguno de los códigos pedidos, del más reciente
+    al más antiguo, y el conjunto de códigos pedidos que contiene cada uno.
+
+    Una fila por (documento, código) en lugar de ``GROUP_CONCAT``, que se
+    trunca en ``group_concat_max_len``; ``code_norm IN (...)`` usa el índice.
+    Con muchos códigos el ``IN`` se parte en bloques de ``OPTIMA_IN_CHUNK``
+    y el orden se rehace en Python.
+    """
+    por_id = {}
+    for inicio in range(0, len(pedidos), OPTIMA_IN_CHUNK):
+        bloque = pedidos[inicio:inicio + OPTIMA_IN_CHUNK]
+        cur.execute(
+            f"""
+            SELECT d.*, c.code_norm AS codigo
+            FROM documents d
+            JOIN codes c ON c.document_id = d.id
+            WHERE c.code_norm IN ({",".join(["%s"] * len(bloque))})
+            """,
+            bloque,
+        )
+        for row in cur.fetchall():
+            codigo = row.pop("codigo")
+            entrada = por_id.get(row["id"])
+            if entrada is None:
+                entrada = por_id[row["id"]] = (row, set())
+            entrada[1].add(codigo)
+    # Del más reciente al más antiguo: decide los empates de la cobertura
+    ordenados = sorted(por_id.values(), key=lambda e: (e[0]["date"], e[0]["id"]), reverse=True)
+    docs = [doc for doc, _ in ordenados]
+    docs_codes = [codes for _, codes in ordenados]
+    for doc, codes in zip(docs, docs_codes):
+        doc["codigos_encontrados"] = ",".join(sorted(codes))
+    return docs, docs_codes
+
+
+def _codigos_pedidos(texto) -> list:
+    """Códigos de una lista (texto separado por comas/espacios o arreglo), normalizados y sin repetir."""
+    if isinstance(texto, list):
+        texto = " ".join(str(c) for c in texto)
+    texto = (texto or "").replace(",", " ").replace("\n", " ")
+    return list({c.strip().upper() for c in texto.split() if c.strip()})
+
+
+def _modo_cobertura(data: dict):
+    """
+    ``modo`` y ``tiempo_max`` de las búsquedas óptimas (el tiempo, acotado a
+    ``COVER_EXACT_BUDGET``).  Devuelve ``(exacto, presupuesto, error)``.
+    """
+    exacto = str(data.get("modo") or "").lower() in ("exacto", "exact")
+    raw = data.get("tiempo_max")
+    if raw in (None, ""):
+        return exacto, COVER_EXACT_BUDGET, None
+    try:
+        presupuesto = float(raw)
+    except (TypeError, ValueError):
+        presupuesto = None
+    if isinstance(raw, bool) or presupuesto is None or not 0 < presupuesto < float("inf"):
+        return None, None, "'tiempo_max' debe ser un número de segundos mayor que 0"
+    return exacto, min(presupuesto, COVER_EXACT_BUDGET), None
+
+
 @documentos_bp.route("/search_optima", methods=["POST"])
+@cached_read
 def busqueda_optima():
     data = request.get_json(silent=True) or {}
-    texto = (data.get("codigos") or data.get("texto") or "").strip()
-    if not texto:
+    # Como en ``search_optima/batch``: texto separado por comas/espacios o arreglo
+    texto = data.get("codigos") or data.get("texto") or ""
+    if not isinstance(texto, (str, list)):
+        return jsonify({"error": "'codigos' debe ser un texto o una lista de códigos"}), 400
+    if not (texto.strip() if isinstance(texto, str) else texto):
         return jsonify({"error": "No se proporcionaron códigos"}), 400
+    # Modo "exacto": mínimo real de documentos dentro de un presupuesto de tiempo
+    exacto, presupuesto, error = _modo_cobertura(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-    pedidos = list({c.strip().upper() for c in texto.replace(",", " ").replace("\n", " ").split() if c.strip()})
+    pedidos = _codigos_pedidos(texto)
     if not pedidos:
         return jsonify({"error": "No se detectaron códigos válidos"}), 400
 
-    fmt = ",".join(["%s"] * len(pedidos))
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            docs, docs_codes = _documentos_por_codigos(cur, pedidos)
+    finally:
+        if conn and conn.open:
+            conn.close()
+
+    resultado = solve_cover(pedidos, docs_codes, exact=exacto, time_budget=presupuesto)
+
+    seleccionados = [{"documento": docs[i], "codigos_cubre": cubre} for i, cubre in resultado.selected]
+    respuesta = {"documentos": seleccionados, "codigos_faltantes": resultado.missing}
+    if exacto:
+        respuesta["optimo"] = resultado.optimal
+    return jsonify(respuesta)
+
+
+def _resolver_coberturas(listas: list, docs: list, docs_codes: list, exacto: bool, presupuesto: float) -> list:
+    """
+    Cobertura de cada lista sobre los documentos de la unión.  Cada lista
+    solo ve sus candidatos (en el orden de la unión, así que los empates se
+    deciden igual que en ``search_optima``).  Con lotes grandes se resuelven
+    en paralelo en el pool de procesos.
+    """
+    por_codigo = {}
+    for i, codes in enumerate(docs_codes):
+        for code in codes:
+            por_codigo.setdefault(code, []).append(i)
+    problemas = []
+    for pedidos in listas:
+        candidatos = sorted({i for code in pedidos for i in por_codigo.get(code, ())})
+        problemas.append((pedidos, candidatos))
+
+    trabajo = sum(len(c) for _, c in problemas)
+    paralelo = (OPTIMA_PARALLEL_MIN_LISTS and len(problemas) >= OPTIMA_PARALLEL_MIN_LISTS
+                and (exacto or trabajo >= OPTIMA_PARALLEL_MIN_CANDIDATES))
+    argumentos = [(pedidos, [docs_codes[i] for i in candidatos], exacto, presupuesto)
+                  for pedidos, candidatos in problemas]
+    resultados = None
+    if paralelo:
+        try:
+            with phase("cover_pool"):
+                resultados = map_in_pool(solve_cover, argumentos, timeout=presupuesto + 30)
+        except Exception as e:
+            print(f"ADVERTENCIA: search_optima por lotes sin pool de procesos ({e}); se resuelve en el worker")
+    if resultados is None:
+        resultados = [solve_cover(*args) for args in argumentos]
+
+    respuestas = []
+    for (pedidos, candidatos), resultado in zip(problemas, resultados):
+        pedidos_set = set(pedidos)
+        seleccionados = [
+            {
+                "documento": dict(docs[candidatos[i]],
+                                  codigos_encontrados=",".join(sorted(docs_codes[candidatos[i]] & pedidos_set))),
+                "codigos_cubre": cubre,
+            }
+            for i, cubre in resultado.selected
+        ]
+        respuesta = {"documentos": seleccionados, "codigos_faltantes": resultado.missing}
+        if exacto:
+            respuesta["optimo"] = resultado.optimal
+        respuestas.append(respuesta)
+    return respuestas
+
+
+@documentos_bp.route("/search_optima/batch", methods=["POST"])
+@cached_read
+def busqueda_optima_lote():
+    """
+    Varias listas de códigos a la vez (p. ej. una por pedido):
+    ``{"listas": ["A1,B2", ["C3", "D4"], ...], "modo", "tiempo_max"}``.
+    Una sola consulta para la unión de los códigos y una cobertura por
+    lista; ``resultados`` tiene la forma de ``search_optima`` en el mismo
+    orden que ``listas``.
+    """
+    data = request.get_json(silent=True) or {}
+    listas = data.get("listas")
+    if not isinstance(listas, list) or not listas:
+        return jsonify({"error": "'listas' debe ser una lista de listas de códigos"}), 400
+    if not all(isinstance(lista, (str, list)) for lista in listas):
+        return jsonify({"error": "Cada elemento de 'listas' debe ser un texto o una lista de códigos"}), 400
+    if len(listas) > OPTIMA_BATCH_MAX_LISTS:
+        return jsonify({"error": f"Máximo {OPTIMA_BATCH_MAX_LISTS} listas por petición"}), 400
+    exacto, presupuesto, error = _modo_cobertura(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    pedidos_por_lista = [_codigos_pedidos(lista) for lista in listas]
+    union = sorted({code for pedidos in pedidos_por_lista for code in pedidos})
+    if not union:
+        return jsonify({"error": "No se detectaron códigos válidos"}), 400
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            docs, docs_codes = _documentos_por_codigos(cur, union)
+    finally:
+        if conn and conn.open:
+            conn.close()
+
+    validas = [pedidos for pedidos in pedidos_por_lista if pedidos]
+    resueltas = iter(_resolver_coberturas(validas, docs, docs_codes, exacto, presupuesto))
+    resultados = [next(resueltas) if pedidos else {"error": "No se detectaron códigos válidos"}
+                  for pedidos in pedidos_por_lista]
+    return jsonify({"resultados": resultados})
+
+
+@documentos_bp.route("/export/zip", methods=["POST"])
+def exportar_zip():
+    """
+    ZIP con los PDF de ``{"ids": [...]}`` o de una búsqueda con el mismo
+    cuerpo que ``search_by_code`` (``codigo``, ``modo``) o ``search_optima``
+    (``codigos``, ``modo``, ``tiempo_max``: los documentos elegidos).
+    El archivo se genera mientras se envía; los documentos que fallan se
+    indican en ``manifiesto.json`` dentro del ZIP.
+    """
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids")
+    codigos = data.get("codigos") or data.get("texto")
+    codigo = (data.get("codigo") or "").strip().upper()
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            return jsonify({"error": "'ids' debe ser una lista de ids"}), 400
+        try:
+            ids = list(dict.fromkeys(int(i) for i in ids))
+        except (TypeError, ValueError):
+            return jsonify({"error": "'ids' debe contener números enteros"}), 400
+    elif codigos:
+        pedidos = _codigos_pedidos(codigos)
+        if not pedidos:
+            return jsonify({"error": "No se detectaron códigos válidos"}), 400
+        exacto, presupuesto, error = _modo_cobertura(data)
+        if error:
+            return jsonify({"error": error}), 400
+    elif not codigo:
+        return jsonify({"error": "Indique 'ids', 'codigos' o 'codigo'"}), 400
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            if ids is None and codigos:
+                docs, docs_codes = _documentos_por_codigos(cur, pedidos)
+            else:
+                if ids is None:
+                    ids = _ids_por_codigo(cur, codigo, str(data.get("modo") or "").lower() in ("exacto", "exact"))
+                if len(ids) > EXPORT_MAX_ITEMS:
+                    return jsonify({"error": f"Máximo {EXPORT_MAX_ITEMS} documentos por exportación"}), 400
+                por_id = {}
+                for bloque in _chunks(ids):
+                    cur.execute(
+                        f"SELECT id, name, date, path FROM documents WHERE id IN ({','.join(['%s'] * len(bloque))})",
+                        bloque,
+                    )
+                    por_id.update((row["id"], row) for row in cur.fetchall())
+                # En el orden pedido; los que no existen quedan en el manifiesto
+                docs = [por_id.get(i) or {"id": i, "error": "Documento no encontrado"} for i in ids]
+    finally:
+        if conn and conn.open:
+            conn.close()
+
+    if ids is None:
+        resultado = solve_cover(pedidos, docs_codes, exact=exacto, time_budget=presupuesto)
+        docs = [docs[i] for i, _ in resultado.selected]
+        if len(docs) > EXPORT_MAX_ITEMS:
+            return jsonify({"error": f"Máximo {EXPORT_MAX_ITEMS} documentos por exportación"}), 400
+    if not docs:
+        return jsonify({"error": "No hay documentos que exportar"}), 404
+
+    nombre = f"documentos-{datetime.datetime.now():%Y%m%d-%H%M%S}.zip"
+    return Response(
+        stream_zip(docs),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{nombre}"',
+            "Cache-Control": "no-store",
+        },
+    )
+
+
+class ErrorResaltado(Exception):
+    """Fallo del resaltado con el código HTTP que debe devolverse."""
+
+    def __init__(self, message: str, status: int = 500):
+        super().__init__(message)
+        self.status = status
+
+
+class _MultipartStream:
+    """
+    Cuerpo ``multipart/form-data`` generado al vuelo: los campos de texto y
+    luego el archivo, leído por bloques desde ``body`` (p. ej. el
+    ``StreamingBody`` de R2).  ``len()`` permite a ``requests`` enviar
+    ``Content-Length`` en lugar de ``Transfer-Encoding: chunked``, que
+    muchos servidores WSGI no aceptan en peticiones.
+    """
+
+    def __init__(self, fields: dict, file_field: str, filename: str, body,
+                 size: int, content_type: str = "application/pdf"):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        head = b"".join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+            for name, value in fields.items()
+        )
+        head += (
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+            f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'
+        ).encode()
+        self._head = head
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self._body = body
+        self._size = size
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        while True:
+            chunk = self._body.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        yield self._tail
+
+
+def _resaltar_remoto(pdf_path: str, codes_list: list, highlighter_url: str):
+    """
+    Envía el PDF de R2 al servicio de resaltado sin cargarlo en memoria y
+    devuelve la respuesta (en streaming) con el PDF resultante.
+    El llamador debe cerrarla.
+    """
+    highlighter = get_highlighter()
+    # Con el circuito abierto no tiene sentido ni abrir el original en R2
+    highlighter.ensure_available()
+    s3 = get_s3_client()
+    bucket_name = os.getenv("R2_BUCKET_NAME")
+    try:
+        pdf_object = s3.get_object(Bucket=bucket_name, Key=pdf_path)
+    except Exception as e:
+        print(f"Error descargando de R2 el objeto {pdf_path}: {e}")
+        raise ErrorResaltado(f"Archivo PDF no encontrado en el almacenamiento: {pdf_path}", 404)
+
+    form = _MultipartStream(
+        {"specific_codes": ",".join(codes_list)},
+        "pdf_file", os.path.basename(pdf_path),
+        pdf_object["Body"], pdf_object["ContentLength"],
+    )
+    try:
+        with phase("highlighter"):
+            r = highlighter.post(highlighter_url, data=form, headers={"Content-Type": form.content_type})
+    finally:
+        pdf_object["Body"].close()
+    r.raise_for_status()
+
+    html_content = r.text
+    match = re.search(r'href="(/descargar/[^\"]+)"', html_content)
+    if not match:
+        error_match = re.search(r'\s*(.+?)\s*', html_content, re.DOTALL)
+        error_message = (error_match.group(1).strip() if error_match else "No se pudo procesar el PDF.")
+        raise ErrorResaltado(error_message, 500)
+
+    download_path = match.group(1)
+    final_pdf_url = highlighter_url.rstrip("/") + download_path
+    with phase("highlighter"):
+        final_pdf_response = highlighter.get(final_pdf_url, stream=True)
+    try:
+        final_pdf_response.raise_for_status()
+    except Exception:
+        final_pdf_response.close()
+        raise
+    return final_pdf_response
+
+
+def _paginas_de_codigos(pdf_path: str, codigos: list) -> dict | None:
+    """
+    Páginas de cada código (``code_pages``, de la extracción automática) en
+    el documento guardado en ``pdf_path``, para que el motor local no tenga
+    que buscarlos en todo el PDF.  ``codigos`` ya normalizados.
+    """
+    if not local_enabled() or not codigos or not extraction_enabled(g.tenant_config):
+        return None
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
                 f"""
-                SELECT d.*, GROUP_CONCAT(DISTINCT UPPER(c.code)) AS codigos_encontrados
-                FROM documents d
-                JOIN codes c ON c.document_id = d.id
-                WHERE UPPER(c.code) IN ({fmt})
-                GROUP BY d.id
-                ORDER BY d.date DESC
+                SELECT cp.code_norm, cp.page
+                FROM code_pages cp
+                JOIN documents d ON d.id = cp.document_id
+                WHERE d.path = %s AND cp.code_norm IN ({", ".join(["%s"] * len(codigos))})
                 """,
-                pedidos,
+                (pdf_path, *codigos),
             )
-            docs = cur.fetchall()
+            paginas = {}
+            for row in cur.fetchall():
+                paginas.setdefault(row["code_norm"], []).append(row["page"])
+        return paginas
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudieron leer las páginas de los códigos de {pdf_path}: {e}")
+        return None
     finally:
         if conn and conn.open:
             conn.close()
 
-    docs_sets = [{"doc": d, "codes": {x.strip().upper() for x in (d.get("codigos_encontrados") or "").split(",") if x.strip()}} for d in docs]
-    
-    faltantes = set(pedidos)
-    seleccionados = []
-    while faltantes and docs_sets:
-        docs_sets.sort(key=lambda d: len(d["codes"] & faltantes), reverse=True)
-        best = docs_sets.pop(0)
-        cubre = best["codes"] & faltantes
-        if not cubre:
-            break
-        seleccionados.append({"documento": best["doc"], "codigos_cubre": sorted(list(cubre))})
-        faltantes -= cubre
 
-    return jsonify({"documentos": seleccionados, "codigos_faltantes": sorted(list(faltantes))})
+def _resaltar_local(pdf_path: str, codes_list: list, salida, paginas: dict | None = None):
+    """Resalta con el motor local (pool de procesos) y escribe el resultado en ``salida``."""
+    try:
+        with phase("highlighter_local"):
+            highlight_object(get_s3_client(), os.getenv("R2_BUCKET_NAME"), pdf_path, codes_list,
+                             salida, get_highlight_cache().directory, paginas)
+    except Exception as e:
+        raise ErrorResaltado(f"Error en el motor de resaltado local: {e}", 500) from e
 
 
-@documentos_bp.route("/resaltar", methods=["POST"])
-def resaltar_pdf_remoto():
-    data = request.get_json(silent=True) or {}
+def _resaltar_a_archivo(pdf_path: str, codes_list: list, highlighter_url: str, salida,
+                        paginas: dict | None = None):
+    """
+    Resalta el PDF y escribe el resultado por bloques en ``salida``: con el
+    motor local si está activo (y, en modo ``auto``, con el servicio externo
+    si el local falla), o con el servicio externo.  ``paginas`` solo lo usa
+    el motor local.
+    """
+    if local_enabled():
+        try:
+            _resaltar_local(pdf_path, codes_list, salida, paginas)
+            return
+        except ErrorResaltado as e:
+            if not remote_fallback():
+                raise
+            print(f"{e}; se usa el servicio externo para {pdf_path}")
+    with _resaltar_remoto(pdf_path, codes_list, highlighter_url) as resultado:
+        for chunk in resultado.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            salida.write(chunk)
+
+
+def _headers_pdf(filename: str, etag: str) -> dict:
+    return {
+        "Content-Disposition": f"inline; filename={filename}",
+        "ETag": f'"{etag}"',
+        "Cache-Control": f"private, max-age={HIGHLIGHT_CACHE_MAX_AGE}",
+    }
+
+
+def _enviar_pdf(f, filename: str, etag: str):
+    """Sirve un PDF ya abierto con ``ETag`` fuerte y caché privada del navegador."""
+    resp = Response(
+        wrap_file(request.environ, f, STREAM_CHUNK_SIZE),
+        mimetype="application/pdf",
+        direct_passthrough=True,
+        headers=_headers_pdf(filename, etag),
+    )
+    resp.content_length = os.fstat(f.fileno()).st_size
+    return resp.make_conditional(request)
+
+
+def _preparar_resaltado(data: dict):
+    """
+    Valida una petición de resaltado y consulta el original en R2.
+    Devuelve ``(pdf_path, codes_list, highlighter_url, head, clave)`` o lanza
+    ``ErrorResaltado``.
+    """
     pdf_path = data.get("pdf_path")
     codes_list = data.get("codes")
 
     if not pdf_path or not codes_list:
-        return jsonify({"error": "Faltan datos (pdf_path, codes)"}), 400
+        raise ErrorResaltado("Faltan datos (pdf_path, codes)", 400)
 
     highlighter_url = os.getenv("HIGHLIGHTER_URL")
-    if not highlighter_url:
-        return jsonify({"error": "El servicio de resaltado no está configurado"}), 500
+    if not highlighter_url and not local_enabled():
+        raise ErrorResaltado("El servicio de resaltado no está configurado", 500)
 
+    # El ETag del original forma parte de la clave: si el PDF cambia, la caché también
     s3 = get_s3_client()
-    bucket_name = os.getenv("R2_BUCKET_NAME")
     try:
-        pdf_object = s3.get_object(Bucket=bucket_name, Key=pdf_path)
-        pdf_content = pdf_object['Body'].read()
+        head = s3.head_object(Bucket=os.getenv("R2_BUCKET_NAME"), Key=pdf_path)
     except Exception as e:
-        print(f"Error descargando de R2 el objeto {pdf_path}: {e}")
-        return jsonify({"error": f"Archivo PDF no encontrado en el almacenamiento: {pdf_path}"}), 404
+        print(f"Error consultando en R2 el objeto {pdf_path}: {e}")
+        raise ErrorResaltado(f"Archivo PDF no encontrado en el almacenamiento: {pdf_path}", 404)
+
+    key = cache_key(g.tenant_id, pdf_path, head.get("ETag"), codes_list)
+    return pdf_path, codes_list, highlighter_url, head, key
+
+
+def _encolar_resaltado(pdf_path: str, codes_list: list, highlighter_url: str, key: str):
+    """Crea (o reutiliza) el trabajo de resaltado y devuelve la respuesta 202."""
+    tenant_id = g.tenant_id
+    cola = get_job_queue()
+    cache = get_highlight_cache()
+    f = cache.lookup(key, tenant_id)
+    if f is not None:
+        f.close()
+        job = cola.completed(key, tenant_id, pdf_path)
+    else:
+        codigos = normalize_codes(codes_list)
+        # Se consulta aquí: el hilo del trabajo no tiene contexto de petición
+        paginas = _paginas_de_codigos(pdf_path, codigos)
+
+        def run():
+            f, _ = cache.get_or_create(
+                key, tenant_id,
+                lambda salida: _resaltar_a_archivo(pdf_path, codigos, highlighter_url, salida, paginas),
+            )
+            f.close()
 
+        try:
+            job = cola.submit(key, tenant_id, pdf_path, run)
+        except QueueFull as e:
+            resp = jsonify({"error": str(e)})
+            resp.status_code = 429
+            resp.headers["Retry-After"] = "30"
+            return resp
+
+    status_url = url_for("documentos.estado_resaltado", job_id=job.id, _external=True)
+    resp = jsonify(dict(
+        job.to_dict(),
+        status_url=status_url,
+        result_url=url_for("documentos.resultado_resaltado", job_id=job.id, _external=True),
+    ))
+    resp.status_code = 202
+    resp.headers["Location"] = status_url
+    return resp
+
+
+@documentos_bp.route("/resaltar", methods=["POST"])
+def resaltar_pdf_remoto():
+    data = request.get_json(silent=True) or {}
     try:
-        files = {"pdf_file": (os.path.basename(pdf_path), pdf_content, "application/pdf")}
-        payload = {"specific_codes": ",".join(codes_list)}
-        
-        r = requests.post(highlighter_url, files=files, data=payload, timeout=180)
-        r.raise_for_status()
+        pdf_path, codes_list, highlighter_url, head, key = _preparar_resaltado(data)
+    except ErrorResaltado as e:
+        return jsonify({"error": str(e)}), e.status
 
-        html_content = r.text
-        match = re.search(r'href="(/descargar/[^\"]+)"', html_content)
-        if not match:
-            error_match = re.search(r'\s*(.+?)\s*', html_content, re.DOTALL)
-            error_message = (error_match.group(1).strip() if error_match else "No se pudo procesar el PDF.")
-            return jsonify({"error": error_message}), 500
+    if request.if_none_match.contains(key):
+        resp = Response(status=304)
+        resp.set_etag(key)
+        return resp
 
-        download_path = match.group(1)
-        final_pdf_url = highlighter_url.rstrip("/") + download_path
-        final_pdf_response = requests.get(final_pdf_url, stream=True, timeout=180)
-        final_pdf_response.raise_for_status()
+    # Los PDF grandes no se resaltan dentro de la petición: se encolan como trabajo
+    if RESALTAR_SYNC_MAX_BYTES and (head.get("ContentLength") or 0) > RESALTAR_SYNC_MAX_BYTES:
+        return _encolar_resaltado(pdf_path, codes_list, highlighter_url, key)
 
-        return Response(
-            final_pdf_response.content,
-            mimetype="application/pdf",
-            headers={"Content-Disposition": f"inline; filename=resaltado_{os.path.basename(pdf_path)}"},
-        )
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Error de comunicación con el servicio de resaltado: {e}"}), 502
+    filename = f"resaltado_{os.path.basename(pdf_path)}"
+    try:
+        f, fill = get_highlight_cache().open_or_lock(key, g.tenant_id)
+    except CacheBusy as e:
+        # Otra petición idéntica sigue generándolo: no se ocupa el hilo esperando
+        resp = jsonify({"error": str(e)})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(e.retry_after)
+        return resp
+    if f is not None:
+        return _enviar_pdf(f, filename, key)
+
+    # Fallo de caché.  Motor local: el resultado se genera entero en la caché
+    # y se sirve desde allí.  Servicio externo: se envía al cliente a medida
+    # que llega, escribiéndolo a la vez en la caché.
+    codigos = normalize_codes(codes_list)
+    try:
+        if local_enabled():
+            _resaltar_a_archivo(pdf_path, codigos, highlighter_url, fill,
+                                _paginas_de_codigos(pdf_path, codigos))
+            return _enviar_pdf(fill.commit(), filename, key)
+        resultado = _resaltar_remoto(pdf_path, codigos, highlighter_url)
+    except ErrorResaltado as e:
+        fill.abort()
+        return jsonify({"error": str(e)}), e.status
+    except HighlighterUnavailable as e:
+        fill.abort()
+        resp = jsonify({"error": str(e)})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(e.retry_after)
+        return resp
     except Exception as e:
-        return jsonify({"error": f"Error inesperado: {str(e)}"}), 500
\ No newline at end of file
+        fill.abort()
+        if is_request_error(e):
+            return jsonify({"error": f"Error de comunicación con el servicio de resaltado: {e}"}), 502
+        return jsonify({"error": f"Error inesperado: {str(e)}"}), 500
+
+    def generar():
+        completo = False
+        try:
+            for chunk in resultado.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                fill.write(chunk)
+                yield chunk
+            completo = True
+        finally:
+            resultado.close()
+            if completo:
+                f = fill.commit()
+                if f is not None:
+                    f.close()
+            else:
+                fill.abort()
+
+    resp = Response(generar(), mimetype="application/pdf", headers=_headers_pdf(filename, key))
+    # Solo se puede reenviar Content-Length si el cuerpo no viene comprimido
+    if resultado.headers.get("Content-Length") and not resultado.headers.get("Content-Encoding"):
+        resp.headers["Content-Length"] = resultado.headers["Content-Length"]
+    # Liberar el candado y la conexión aunque el generador nunca llegue a ejecutarse
+    resp.call_on_close(fill.abort)
+    resp.call_on_close(resultado.close)
+    return resp
+
+
+# --- Trabajos de resaltado asíncronos ---
+
+_JOB_ID_RE = re.compile(r"[0-9a-f]{64}")
+
+
+@documentos_bp.route("/resaltar/jobs", methods=["POST"])
+def crear_resaltado():
+    """Encola un resaltado y devuelve ``202`` con las URLs de estado y resultado."""
+    data = request.get_json(silent=True) or {}
+    try:
+        pdf_path, codes_list, highlighter_url, _, key = _preparar_resaltado(data)
+    except ErrorResaltado as e:
+        return jsonify({"error": str(e)}), e.status
+    return _encolar_resaltado(pdf_path, codes_list, highlighter_url, key)
+
+
+def _buscar_trabajo(job_id: str):
+    """
+    Devuelve ``(trabajo, archivo)``.  Si el trabajo no está en este worker
+    (o ya expiró) pero su resultado sigue en la caché, el archivo basta.
+    """
+    if not _JOB_ID_RE.fullmatch(job_id):
+        return None, None
+    job = get_job_queue().get(job_id, g.tenant_id)
+    if job is not None and job.status != DONE:
+        return job, None
+    return job, get_highlight_cache().lookup(job_id, g.tenant_id)
+
+
+@documentos_bp.route("/resaltar/jobs/<job_id>", methods=["GET"])
+def estado_resaltado(job_id):
+    job, f = _buscar_trabajo(job_id)
+    if f is not None:
+        f.close()
+        estado = job.to_dict() if job is not None else {"job_id": job_id}
+        estado["estado"] = DONE
+    elif job is not None and job.status != DONE:
+        estado = job.to_dict()
+    else:
+        return jsonify({"error": "Trabajo no encontrado o expirado"}), 404
+    estado["result_url"] = url_for("documentos.resultado_resaltado", job_id=job_id, _external=True)
+    return jsonify(estado)
+
+
+@documentos_bp.route("/resaltar/jobs/<job_id>/result", methods=["GET"])
+def resultado_resaltado(job_id):
+    job, f = _buscar_trabajo(job_id)
+    if f is None:
+        if job is None or job.status == DONE:
+            return jsonify({"error": "Trabajo no encontrado o expirado"}), 404
+        if job.status == FAILED:
+            return jsonify({"error": job.error, "estado": job.status}), job.error_status or 502
+        resp = jsonify(job.to_dict())
+        resp.status_code = 409
+        resp.headers["Retry-After"] = "5"
+        return resp
+    filename = f"resaltado_{os.path.basename(job.pdf_path)}" if job is not None else "resaltado.pdf"
+    return _enviar_pdf(f, filename, job_id)
@@ -1,3 +1,8 @@
-INSERT INTO documentos (nombre, codigo) VALUES
-('Manual de Usuario', 'ABC123'),
-('Factura Proveedor', 'XYZ987');
+-- Datos de ejemplo (esquema de utils/migrations.py; aplicar antes las migraciones)
+INSERT INTO documents (id, name, date, path) VALUES
+(1, 'Manual de Usuario', '2025-01-15', 'Cliente-Kino/manual_de_usuario.pdf'),
+(2, 'Factura Proveedor', '2025-02-03', 'Cliente-Kino/factura_proveedor.pdf');
+
+INSERT INTO codes (document_id, code, code_norm) VALUES
+(1, 'ABC123', 'ABC123'),
+(2, 'XYZ987', 'XYZ987');
@@ -0,0 +1,35 @@
+# conftest.py — Configuración común de las pruebas
+#
+# Ejecutar desde la raíz del repositorio:  python -m pytest -q
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TENANT = "Cliente-Prueba"
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    """Cliente de pruebas de Flask con un único cliente y sin BD: cada prueba sustituye lo que use."""
+    from utils import response_cache, tenants
+
+    monkeypatch.setenv("TENANTS_JSON", json.dumps({
+        TENANT: {"db_host": "127.0.0.1", "db_user": "u", "db_pass": "p", "db_name": "prueba"},
+    }))
+    monkeypatch.setenv("DB_PREWARM", "0")
+    monkeypatch.setenv("ADMISSION_ENABLED", "0")
+    monkeypatch.setenv("RESPONSE_CACHE_DIR", str(tmp_path / "respuestas"))
+    monkeypatch.setattr(tenants, "_REGISTRY", None)
+    monkeypatch.setattr(response_cache, "_CACHE", None)
+
+    from app import create_app
+
+    app = create_app()
+    app.testing = True
+    test_client = app.test_client()
+    test_client.environ_base["HTTP_X_TENANT_ID"] = TENANT
+    return test_client
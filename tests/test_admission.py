@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+
+from utils import admission
+from utils.admission import AdmissionRejected, TokenBucket, _Slot
+
+
+def _limits(**overrides):
+    limits = dict(rate=0, burst=1, concurrency=0, queue=0, max_wait_ms=0)
+    limits.update(overrides)
+    return limits
+
+
+def test_bucket_allows_burst_then_reports_wait(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take() == pytest.approx(0.5)
+    now[0] += 0.5
+    assert bucket.take() == 0.0
+
+
+def test_bucket_refund_is_capped_at_burst():
+    bucket = TokenBucket(rate=1, burst=2)
+    bucket.refund()
+    assert bucket.tokens == 2
+    bucket.take()
+    bucket.refund()
+    assert bucket.tokens == pytest.approx(2, abs=0.01)
+
+
+def test_queue_full_does_not_consume_a_token():
+    slot = _Slot(_limits(rate=1, burst=5, concurrency=1, queue=0))
+    assert slot.acquire() is False
+    tokens = slot.bucket.tokens
+    for _ in range(3):
+        with pytest.raises(AdmissionRejected) as err:
+            slot.acquire()
+        assert err.value.reason == "queue_full"
+    assert slot.bucket.tokens == pytest.approx(tokens, abs=0.01)
+    slot.release()
+    assert slot.acquire() is False
+
+
+def test_timeout_refunds_the_token():
+    slot = _Slot(_limits(rate=0.001, burst=2, concurrency=1, queue=1, max_wait_ms=20))
+    slot.acquire()
+    with pytest.raises(AdmissionRejected) as err:
+        slot.acquire()
+    assert err.value.reason == "timeout"
+    assert slot.bucket.tokens == pytest.approx(1, abs=0.01)
+    assert slot.waiting == 0
+
+
+def test_queued_request_is_admitted_on_release():
+    slot = _Slot(_limits(concurrency=1, queue=1, max_wait_ms=5000))
+    slot.acquire()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(slot.acquire()))
+    waiter.start()
+    while slot.waiting == 0:
+        pass
+    slot.release()
+    waiter.join(5)
+    assert result == [True]
+    assert slot.active == 1
+
+
+def test_write_routes_have_their_own_limited_class():
+    for endpoint in ("subir_lote", "eliminar_lote", "iniciar_subida", "editar_documento", "eliminar_documento"):
+        assert admission.ROUTE_CLASSES[f"documentos.{endpoint}"] == admission.WRITE
+    assert admission.ROUTE_CLASSES[("documentos.extraccion_documento", "POST")] == admission.WRITE
+    assert "documentos.extraccion_documento" not in admission.ROUTE_CLASSES  # el GET es una lectura
+    limits = admission.DEFAULTS[admission.WRITE]
+    assert limits["rate"] > 0 and limits["concurrency"] > 0
+
+
+def test_waiting_is_capped_across_slots(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_WAITING", 1)
+    a = _Slot(_limits(concurrency=1, queue=5, max_wait_ms=5000))
+    b = _Slot(_limits(concurrency=1, queue=5, max_wait_ms=5000))
+    a.acquire()
+    b.acquire()
+    waiter = threading.Thread(target=a.acquire)
+    waiter.start()
+    while a.waiting == 0:
+        pass
+    # La otra clase tiene cola libre, pero ya hay un hilo esperando en el proceso
+    with pytest.raises(AdmissionRejected) as err:
+        b.acquire()
+    assert err.value.reason == "queue_full"
+    a.release()
+    waiter.join(5)
+    assert admission._waiting_total == 0
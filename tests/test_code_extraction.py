@@ -0,0 +1,116 @@
+import threading
+
+import pytest
+
+from utils import code_extraction
+from utils.code_extraction import DONE, FAILED, ExtractionPipeline, _save, process_document, tenant_patterns
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._row = None
+
+    def execute(self, sql, params=()):
+        self.conn.log.append((sql, params))
+        if sql.startswith("SELECT path FROM documents"):
+            self._row = {"path": self.conn.path} if self.conn.path is not None else None
+
+    def executemany(self, sql, rows):
+        self.conn.log.append((sql, list(rows)))
+
+    def fetchone(self):
+        return self._row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    def __init__(self, path="t/objetos/aa"):
+        self.path = path
+        self.log = []
+        self.events = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def begin(self):
+        self.events.append("begin")
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+    def statements(self, prefix):
+        return [params for sql, params in self.log if sql.startswith(prefix)]
+
+
+@pytest.fixture
+def bumps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(code_extraction, "bump_version", lambda t: calls.append(t) or len(calls))
+    monkeypatch.setattr(code_extraction.code_index, "is_loaded", lambda t: False)
+    return calls
+
+
+def test_save_stores_codes_pages_and_text(bumps):
+    conn = FakeConn()
+    found = [("ab-1", 1), ("AB-1", 3), ("c-2", 2)]
+    assert _save(conn, "t", 7, "t/objetos/aa", found, [(1, "uno"), (2, "dos")])
+    assert conn.events == ["begin", "commit"]
+    assert conn.statements("INSERT IGNORE INTO codes") == [[(7, "ab-1", "AB-1"), (7, "c-2", "C-2")]]
+    assert conn.statements("INSERT IGNORE INTO code_pages") == [[(7, "AB-1", 1), (7, "AB-1", 3), (7, "C-2", 2)]]
+    assert conn.statements("INSERT INTO document_texts") == [[(7, 1, "uno"), (7, 2, "dos")]]
+    assert conn.statements("UPDATE documents SET extraction_status") == [(DONE, 7)]
+    assert bumps == ["t"]
+
+
+@pytest.mark.parametrize("path", ["t/objetos/otro", None])
+def test_save_drops_stale_extraction(bumps, path):
+    conn = FakeConn(path=path)  # editado con otro archivo, o borrado
+    assert not _save(conn, "t", 7, "t/objetos/aa", [("AB-1", 1)], None)
+    assert conn.events == ["begin", "rollback"]
+    assert not conn.statements("INSERT")
+    assert bumps == []
+
+
+def test_failed_extraction_is_recorded(bumps, monkeypatch):
+    def broken(*args):
+        raise RuntimeError("PDF dañado")
+
+    monkeypatch.setattr(code_extraction, "_extract", broken)
+    conn = FakeConn()
+    with pytest.raises(RuntimeError):
+        process_document(conn, "t", {"code_patterns": ["X"]}, 7, "t/objetos/aa")
+    assert conn.statements("UPDATE documents SET extraction_status")[-1] == (FAILED, "PDF dañado", 7)
+
+
+def test_tenant_patterns(monkeypatch):
+    monkeypatch.setenv("CODE_EXTRACT_PATTERN", r"REF-\d+")
+    assert tenant_patterns({}) == [r"REF-\d+"]
+    assert tenant_patterns({"code_patterns": r"(\d{6})"}) == [r"(\d{6})"]
+    assert tenant_patterns({"code_patterns": ["A", ""]}) == ["A"]
+    assert tenant_patterns({"code_patterns": []}) == []
+
+
+def test_full_queue_rejects_without_blocking(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def run(self, *job):
+        started.set()
+        release.wait(5)
+
+    monkeypatch.setattr(ExtractionPipeline, "_run", run)
+    pipeline = ExtractionPipeline(workers=1, max_queued=1)
+    assert pipeline.submit("t", {}, 1, "k1")
+    started.wait(5)
+    assert pipeline.submit("t", {}, 2, "k2")  # en cola
+    assert not pipeline.submit("t", {}, 3, "k3")
+    assert pipeline.stats()["rejected"] == 1
+    release.set()
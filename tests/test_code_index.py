@@ -0,0 +1,117 @@
+import re
+import time
+import datetime
+
+import pytest
+
+from routes.documentos import _ids_por_codigo
+from utils.code_index import CodeIndex, _TermIndex
+
+
+def test_term_index_add_remove_keeps_ids_sorted_and_unique():
+    index = _TermIndex()
+    for doc_id in (5, 1, 3, 3, 9):
+        index.add("ABC123", doc_id)
+    assert list(index.postings["ABC123"]) == [1, 3, 5, 9]
+
+    index.remove("ABC123", 3)
+    index.remove("ABC123", 42)  # no está: no hace nada
+    assert list(index.postings["ABC123"]) == [1, 5, 9]
+
+    for doc_id in (1, 5, 9):
+        index.remove("ABC123", doc_id)
+    assert "ABC123" not in index.postings
+    assert index.sorted_terms == []
+    assert index.grams == {}
+
+
+def test_term_index_queries():
+    index = _TermIndex()
+    index.add("ABC123", 1)
+    index.add("ABD999", 2)
+    index.add("XABC", 3)
+    assert index.exact("ABC123") == {1}
+    assert index.prefix("AB", 10) == ["ABC123", "ABD999"]
+    assert index.contains("ABC") == {1, 3}
+    assert index.contains("B") == {1, 2, 3}
+    assert index.contains("ZZZ") == set()
+
+
+def test_term_index_shared_term_is_not_quadratic():
+    index = _TermIndex()
+    started = time.perf_counter()
+    for doc_id in range(40000):
+        index.add("COMPARTIDO", doc_id)
+    for doc_id in range(0, 40000, 2):
+        index.remove("COMPARTIDO", doc_id)
+    assert time.perf_counter() - started < 2
+    assert len(index.postings["COMPARTIDO"]) == 20000
+
+
+def test_code_index_search_and_replace():
+    index = CodeIndex(budget_bytes=10 * 1024 * 1024)
+    fecha = datetime.date(2024, 1, 1)
+    index.put_document({"id": 1, "name": "Factura enero", "date": fecha, "path": "t/1"}, ["A-100", "B-200"])
+    index.put_document({"id": 2, "name": "Otra", "date": fecha, "path": "t/2"}, ["A-100"])
+
+    assert [r["id"] for r in index.search("A-100", exact=True)] == [2, 1]
+    assert index.search("B-2")[0]["codigos_extraidos"] == "A-100,B-200"
+    assert [r["id"] for r in index.search("FACTURA")] == [1]
+
+    index.put_document({"id": 1, "name": "Factura enero", "date": fecha, "path": "t/1"}, ["C-300"])
+    assert [r["id"] for r in index.search("A-100", exact=True)] == [2]
+    index.remove_document(2)
+    assert index.search("A-100", exact=True) == []
+    assert index.prefix("C") == ["C-300"]
+
+
+def _like(pattern: str, value: str) -> bool:
+    """``value LIKE pattern ESCAPE '\\'`` sin distinguir mayúsculas, como MySQL."""
+    regex, chars = "", iter(pattern)
+    for ch in chars:
+        if ch == "\\":
+            regex += re.escape(next(chars))
+        elif ch == "%":
+            regex += ".*"
+        elif ch == "_":
+            regex += "."
+        else:
+            regex += re.escape(ch)
+    return re.fullmatch(regex, value, re.IGNORECASE | re.DOTALL) is not None
+
+
+class FakeCursor:
+    """Ejecuta sobre listas las dos consultas de ``_ids_por_codigo``."""
+
+    def __init__(self, docs, codes):
+        self.docs, self.codes = docs, codes
+
+    def execute(self, sql, params):
+        assert "ESCAPE '\\\\'" in sql or "= %s" in sql
+        match = (lambda v: _like(params[0], v)) if "LIKE" in sql else (lambda v: v.upper() == params[0])
+        if "FROM documents" in sql:
+            self.rows = [{"id": d["id"]} for d in self.docs if match(d["name"])]
+        else:
+            self.rows = [{"id": doc_id} for doc_id, code in self.codes if match(code.upper())]
+
+    def fetchall(self):
+        return self.rows
+
+
+@pytest.mark.parametrize("term", ["A_1", "A%1", "A\\1", "_", "%", "AX1", "a_1", "FACTURA_"])
+@pytest.mark.parametrize("exact", [False, True])
+def test_sql_fallback_matches_index(term, exact):
+    docs = [
+        {"id": 1, "name": "Factura_2024", "date": None, "path": "t/1"},
+        {"id": 2, "name": "Factura 2024", "date": None, "path": "t/2"},
+        {"id": 3, "name": "100% revisado", "date": None, "path": "t/3"},
+        {"id": 4, "name": "Ruta C:\\A\\1", "date": None, "path": "t/4"},
+        {"id": 5, "name": "Otro", "date": None, "path": "t/5"},
+    ]
+    codes = [(1, "A_1"), (2, "AX1"), (3, "A%1"), (4, "AB1"), (5, "A\\1")]
+    index = CodeIndex(budget_bytes=10 * 1024 * 1024)
+    for doc in docs:
+        index.put_document(doc, [code for doc_id, code in codes if doc_id == doc["id"]])
+
+    expected = [row["id"] for row in index.search(term, exact=exact)]
+    assert _ids_por_codigo(FakeCursor(docs, codes), term.upper(), exact) == expected
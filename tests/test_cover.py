@@ -0,0 +1,65 @@
+import sys
+import random
+from itertools import combinations
+
+from utils.cover import solve_cover
+
+
+def _covered(result):
+    return {code for _, codes in result.selected for code in codes}
+
+
+def test_greedy_covers_everything_coverable_and_reports_missing():
+    result = solve_cover(["A", "B", "C", "Z"], [{"A"}, {"B", "C"}, {"A", "B"}])
+    assert _covered(result) == {"A", "B", "C"}
+    assert result.missing == ["Z"]
+    # Cada código se atribuye a un solo documento
+    assert sum(len(codes) for _, codes in result.selected) == 3
+
+
+def test_ties_prefer_earlier_document():
+    result = solve_cover(["A", "B"], [{"A", "B"}, {"A", "B"}])
+    assert [i for i, _ in result.selected] == [0]
+    result = solve_cover(["A", "B"], [{"C"}, {"A"}, {"B"}, {"A"}], exact=True)
+    assert sorted(i for i, _ in result.selected) == [1, 2]
+
+
+def test_exact_beats_greedy_on_classic_trap():
+    docs = [{"1", "2", "3", "4"}, {"1", "2", "5"}, {"3", "4", "6"}]
+    pedidos = ["1", "2", "3", "4", "5", "6"]
+    assert len(solve_cover(pedidos, docs).selected) == 3
+    exacto = solve_cover(pedidos, docs, exact=True)
+    assert sorted(i for i, _ in exacto.selected) == [1, 2]
+    assert exacto.optimal
+
+
+def test_exact_matches_brute_force():
+    rng = random.Random(7)
+    codes = [f"C{i}" for i in range(10)]
+    for _ in range(50):
+        docs = [set(rng.sample(codes, rng.randint(1, 4))) for _ in range(rng.randint(2, 8))]
+        coverable = set().union(*docs)
+        best = next(
+            n for n in range(1, len(docs) + 1)
+            if any(set().union(*combo) == coverable for combo in combinations(docs, n))
+        )
+        result = solve_cover(codes, docs, exact=True)
+        assert result.optimal
+        assert len(result.selected) == best
+        assert _covered(result) == coverable
+
+
+def test_empty_input():
+    result = solve_cover(["A"], [])
+    assert result.selected == []
+    assert result.missing == ["A"]
+
+
+def test_exact_search_deeper_than_recursion_limit():
+    # La voraz elige 1499 documentos y la búsqueda baja casi hasta esa profundidad
+    n = sys.getrecursionlimit() + 500
+    codes = [f"C{i}" for i in range(n)]
+    docs = [["C0", "C1"]] + [[c] for c in codes]
+    result = solve_cover(codes, docs, exact=True, time_budget=30)
+    assert result.optimal
+    assert len(result.selected) == n - 1
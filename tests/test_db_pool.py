@@ -0,0 +1,62 @@
+from pymysql.constants import SERVER_STATUS
+
+from utils.db import ConnectionPool
+
+IN_TRANS = SERVER_STATUS.SERVER_STATUS_IN_TRANS | SERVER_STATUS.SERVER_STATUS_AUTOCOMMIT
+IDLE = SERVER_STATUS.SERVER_STATUS_AUTOCOMMIT
+
+
+class FakeRaw:
+    def __init__(self, fail_rollback=False, server_status=IN_TRANS):
+        self.open = True
+        self.rollbacks = 0
+        self.fail_rollback = fail_rollback
+        self.server_status = server_status
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.fail_rollback:
+            raise OSError("conexión rota")
+        self.server_status &= ~SERVER_STATUS.SERVER_STATUS_IN_TRANS
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+def _pool(raws, **kwargs):
+    pool = ConnectionPool({"autocommit": True}, size=1, max_overflow=0, **kwargs)
+    pool._connect = lambda: (raws.pop(0), 0.0)
+    return pool
+
+
+def test_release_rolls_back_open_transaction_even_with_autocommit():
+    raw = FakeRaw()
+    pool = _pool([raw], max_lifetime=float("inf"))
+    pool.connection().close()
+    assert raw.rollbacks == 1
+    assert pool.stats()["idle"] == 1
+    conn = pool.connection()
+    assert conn._raw is raw
+    conn.close()
+
+
+def test_release_discards_connection_when_rollback_fails():
+    broken, fresh = FakeRaw(fail_rollback=True), FakeRaw()
+    pool = _pool([broken, fresh], max_lifetime=float("inf"))
+    pool.connection().close()
+    assert not broken.open
+    assert pool.stats()["idle"] == 0
+    conn = pool.connection()
+    assert conn._raw is fresh
+    conn.close()
+
+
+def test_release_skips_rollback_without_transaction():
+    raw = FakeRaw(server_status=IDLE)
+    pool = _pool([raw], max_lifetime=float("inf"))
+    pool.connection().close()
+    assert raw.rollbacks == 0
+    assert pool.stats()["idle"] == 1
@@ -0,0 +1,87 @@
+import os
+import time
+import fcntl
+
+import pytest
+
+from utils.highlight_cache import CacheBusy, HighlightCache
+
+
+def _age(path, seconds=7200):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_evict_keeps_held_locks_and_removes_stale_ones(tmp_path):
+    cache = HighlightCache(str(tmp_path), max_bytes=1024 * 1024)
+    held = cache._lock_key("ocupada")
+    free = tmp_path / "libre.lock"
+    free.touch()
+    tmp = tmp_path / "resto.tmp"
+    tmp.touch()
+    for path in (tmp_path / "ocupada.lock", free, tmp):
+        _age(path)
+
+    cache._evict()
+
+    assert (tmp_path / "ocupada.lock").exists()
+    assert not free.exists()
+    assert not tmp.exists()
+    fcntl.flock(held, fcntl.LOCK_UN)
+    held.close()
+
+
+def test_lock_reopens_when_file_was_replaced(tmp_path):
+    cache = HighlightCache(str(tmp_path), max_bytes=1024 * 1024)
+    first = cache._lock_key("k")
+    fcntl.flock(first, fcntl.LOCK_UN)
+    first.close()
+    os.unlink(tmp_path / "k.lock")
+    second = cache._lock_key("k")
+    assert os.fstat(second.fileno()).st_ino == os.stat(tmp_path / "k.lock").st_ino
+    second.close()
+
+
+def test_busy_key_times_out_instead_of_blocking(tmp_path):
+    cache = HighlightCache(str(tmp_path), max_bytes=1024 * 1024)
+    held = cache._lock_key("k")
+    start = time.monotonic()
+    with pytest.raises(CacheBusy):
+        cache.open_or_lock("k", "t", wait=0.2)
+    assert time.monotonic() - start < 2
+    assert cache.stats()["lock_timeouts"] == 1
+
+    # Los trabajos en segundo plano generan su resultado sin publicarlo
+    def create(out):
+        out.write(b"%PDF-privado")
+
+    f, cached = cache.get_or_create("k", "t", create, wait=0.2)
+    assert (f.read(), cached) == (b"%PDF-privado", False)
+    f.close()
+    assert not (tmp_path / "k.pdf").exists()
+    assert [p.name for p in tmp_path.iterdir()] == ["k.lock"]
+    fcntl.flock(held, fcntl.LOCK_UN)
+    held.close()
+
+
+def test_store_tracks_size_without_rescanning(tmp_path, monkeypatch):
+    cache = HighlightCache(str(tmp_path), max_bytes=3000)
+    scans = []
+    real_evict = cache._evict
+    monkeypatch.setattr(cache, "_evict", lambda: scans.append(1) or real_evict())
+
+    def fill(key):
+        f, fill = cache.open_or_lock(key, "t")
+        fill.write(b"x" * 1000)
+        fill.commit().close()
+
+    fill("a")
+    assert len(scans) == 1  # la primera escritura mide el directorio
+    fill("b")
+    fill("c")
+    assert len(scans) == 1
+    assert cache.stats()["bytes"] == 3000
+    fill("d")  # pasa del tope: se recorre y se expulsa lo más antiguo
+    assert len(scans) == 2
+    assert cache.stats()["bytes"] <= 3000
+    assert len(list(tmp_path.glob("*.pdf"))) == 3
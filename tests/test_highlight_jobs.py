@@ -0,0 +1,102 @@
+import time
+import threading
+
+import pytest
+
+from utils.highlight_jobs import DONE, FAILED, HighlightJobQueue, QueueFull
+
+
+def _wait(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "tiempo de espera agotado"
+        time.sleep(0.01)
+
+
+class Gate:
+    """Trabajos que esperan a ``open()`` y registran la concurrencia máxima."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.order = []
+
+    def job(self, name):
+        def run():
+            with self.lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+                self.order.append(name)
+            self.event.wait(5)
+            with self.lock:
+                self.running -= 1
+        return run
+
+
+def test_concurrency_is_bounded_by_workers():
+    queue, gate = HighlightJobQueue(workers=2), Gate()
+    jobs = [queue.submit(f"j{n}", "t", "p", gate.job(n)) for n in range(6)]
+    _wait(lambda: gate.running == 2)
+    time.sleep(0.05)
+    assert gate.peak == 2
+    gate.event.set()
+    _wait(lambda: all(job.status == DONE for job in jobs))
+    assert gate.peak == 2
+
+
+def test_queue_is_bounded_per_tenant_and_deduplicates():
+    queue, gate = HighlightJobQueue(workers=1, max_queued_per_tenant=2), Gate()
+    first = queue.submit("en-curso", "t", "p", gate.job("en-curso"))
+    _wait(lambda: gate.running == 1)
+    queue.submit("a", "t", "p", gate.job("a"))
+    queue.submit("b", "t", "p", gate.job("b"))
+    assert queue.submit("a", "t", "p", gate.job("a")).id == "a"  # mismo trabajo, no cuenta
+    with pytest.raises(QueueFull):
+        queue.submit("c", "t", "p", gate.job("c"))
+    queue.submit("c", "otro", "p", gate.job("c"))  # otro cliente tiene su propia cola
+    assert queue.stats()["rejected"] == 1
+    assert queue.stats()["deduplicated"] == 1
+    gate.event.set()
+    _wait(lambda: queue.stats()["completed"] == 4)
+    assert first.status == DONE
+
+
+def test_tenants_take_turns():
+    queue, gate = HighlightJobQueue(workers=1), Gate()
+    queue.submit("bloqueo", "x", "p", gate.job("bloqueo"))
+    _wait(lambda: gate.running == 1)
+    for n in range(3):
+        queue.submit(f"a{n}", "a", "p", gate.job(f"a{n}"))
+    queue.submit("b0", "b", "p", gate.job("b0"))
+    gate.event.set()
+    _wait(lambda: len(gate.order) == 5)
+    assert gate.order.index("b0") < gate.order.index("a2")
+
+
+def test_failed_job_reports_error_and_can_be_resubmitted():
+    queue = HighlightJobQueue(workers=1)
+
+    def fails():
+        error = RuntimeError("PDF dañado")
+        error.status = 422
+        raise error
+
+    job = queue.submit("k", "t", "p", fails)
+    _wait(lambda: job.status == FAILED)
+    assert (job.error, job.error_status) == ("PDF dañado", 422)
+    assert queue.get("k", "otro") is None  # no se ve desde otro cliente
+
+    again = queue.submit("k", "t", "p", lambda: None)
+    assert again is not job
+    _wait(lambda: again.status == DONE)
+
+
+def test_finished_jobs_expire():
+    queue = HighlightJobQueue(workers=1, result_ttl=0.05)
+    job = queue.submit("k", "t", "p", lambda: None)
+    _wait(lambda: job.status == DONE)
+    assert queue.get("k", "t") is job
+    time.sleep(0.1)
+    assert queue.get("k", "t") is None
@@ -0,0 +1,120 @@
+import os
+import time
+
+import pytest
+
+from utils.highlighter import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, HighlighterClient, HighlighterUnavailable,
+)
+
+
+def _breaker(**kwargs):
+    return CircuitBreaker(**dict(dict(window=10, min_calls=4, failure_ratio=0.5, open_seconds=0.1), **kwargs))
+
+
+def test_opens_when_failure_ratio_is_reached():
+    breaker = _breaker()
+    for failed in (True, False, True):
+        breaker.before_call()
+        breaker.record(failed)
+    assert breaker.stats()["state"] == CLOSED  # aún sin el mínimo de llamadas
+    breaker.record(False)
+    assert breaker.stats()["state"] == OPEN  # 2 fallos de 4
+
+def test_stays_closed_below_min_calls_and_ratio():
+    breaker = _breaker(failure_ratio=0.8)
+    for failed in (True, True, False, True, False):
+        breaker.before_call()
+        breaker.record(failed)
+    assert breaker.stats()["state"] == CLOSED
+
+
+def test_open_rejects_then_probes_once_and_closes():
+    breaker = _breaker(open_seconds=0.2)
+    for _ in range(4):
+        breaker.record(True)
+    assert breaker.stats()["state"] == OPEN
+    with pytest.raises(HighlighterUnavailable) as err:
+        breaker.before_call()
+    assert err.value.retry_after == 1
+
+    time.sleep(0.25)
+    assert breaker.stats()["state"] == HALF_OPEN
+    breaker.before_call()  # la prueba
+    with pytest.raises(HighlighterUnavailable):
+        breaker.before_call()  # solo una a la vez
+    breaker.record(False)
+    assert breaker.stats()["state"] == CLOSED
+    breaker.before_call()
+    assert breaker.stats()["rejected"] == 2
+
+
+def test_failed_probe_reopens():
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.record(True)
+    time.sleep(0.15)
+    breaker.before_call()
+    breaker.record(True)
+    assert breaker.stats()["state"] == OPEN
+    assert breaker.stats()["opened"] == 2
+    with pytest.raises(HighlighterUnavailable):
+        breaker.before_call()
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeSession:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, kwargs["timeout"]))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+def _client(outcomes):
+    client = HighlighterClient(connect_timeout=2, read_timeout=9, breaker=_breaker())
+    client._session, client._session_pid = FakeSession(outcomes), os.getpid()
+    return client
+
+
+def test_client_counts_5xx_and_errors_and_fails_fast():
+    client = _client([200, 500, ConnectionError("rechazada"), 503, 502])
+    client.post("http://h/")
+    client.post("http://h/")
+    with pytest.raises(ConnectionError):
+        client.get("http://h/")
+    client.get("http://h/")
+    assert client.stats()["state"] == OPEN  # 3 fallos de 4
+    with pytest.raises(HighlighterUnavailable):
+        client.ensure_available()
+    with pytest.raises(HighlighterUnavailable):
+        client.post("http://h/")
+    assert len(client.session.calls) == 4
+    assert client.session.calls[0] == ("POST", (2, 9))
+
+
+def test_ensure_available_does_not_use_the_probe():
+    client = _client([200])
+    for _ in range(4):
+        client.breaker.record(True)
+    time.sleep(0.15)
+    client.ensure_available()
+    client.get("http://h/")  # la prueba sigue disponible
+    assert client.stats()["state"] == CLOSED
+
+
+def test_session_retries_only_get():
+    client = HighlighterClient(get_retries=3)
+    retry = client.session.get_adapter("https://h/").max_retries
+    assert retry.total == 3
+    assert retry.allowed_methods == frozenset({"GET"})
+    assert client.session.get_adapter("https://h/")._pool_maxsize == client.pool_size
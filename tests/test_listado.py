@@ -0,0 +1,114 @@
+import json
+import datetime
+
+import pytest
+
+from routes import documentos
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, sql, params=()):
+        params = list(params)
+        if sql.startswith("SELECT document_id, code FROM codes"):
+            self.rows = [{"document_id": i, "code": c} for i in params for c in sorted(self.db.codes.get(i, ()))]
+            return
+        if "LEFT JOIN codes" in sql:  # exportación completa
+            self.rows = [dict(doc, code=code)
+                         for doc in sorted(self.db.docs.values(), key=lambda d: -d["id"])
+                         for code in sorted(self.db.codes.get(doc["id"], ())) or [None]]
+            return
+        limit = params.pop()
+        docs = sorted(self.db.docs.values(), key=lambda d: -d["id"])
+        if "d.id < %s" in sql:
+            after_id = params.pop()
+            docs = [d for d in docs if d["id"] < after_id]
+        self.db.page_queries.append(sql)
+        self.rows = [dict(d) for d in docs[:limit]]
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeDB:
+    open = True
+
+    def __init__(self, n):
+        fecha = datetime.date(2024, 1, 1)
+        self.docs = {i: {"id": i, "name": f"Doc {i}", "date": fecha, "path": f"t/{i}"} for i in range(1, n + 1)}
+        self.codes = {i: {f"C{i}", f"X{i}"} for i in range(1, n + 1)}
+        self.page_queries = []
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(client, monkeypatch):
+    fake = FakeDB(25)
+    monkeypatch.setattr(documentos, "get_db_connection", lambda: fake)
+    return fake
+
+
+def _page(client, **args):
+    resp = client.get("/api/documentos/", query_string=args)
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def test_cursor_pages_are_stable_under_inserts_and_deletes(client, db):
+    seen = []
+    page = _page(client, limit=10)
+    seen += [d["id"] for d in page["items"]]
+
+    # Entre páginas llegan documentos nuevos y se borra uno ya visto y otro pendiente
+    for i in (26, 27):
+        db.docs[i] = dict(db.docs[1], id=i, name=f"Doc {i}")
+    del db.docs[25], db.docs[12]
+
+    while page["next_after_id"] is not None:
+        page = _page(client, limit=10, after_id=page["next_after_id"])
+        seen += [d["id"] for d in page["items"]]
+
+    # Sin repetidos ni saltos: los nuevos no desplazan las páginas siguientes
+    assert seen == [i for i in range(25, 0, -1) if i != 12]
+    assert all("ORDER BY d.id DESC" in sql for sql in db.page_queries)
+
+
+def test_page_includes_codes_and_last_page_has_no_cursor(client, db):
+    page = _page(client, limit=5, after_id=3)
+    assert [d["id"] for d in page["items"]] == [2, 1]
+    assert page["items"][0]["codigos_extraidos"] == "C2,X2"
+    assert page["next_after_id"] is None
+    assert _page(client, limit=2)["next_after_id"] == 24
+
+
+@pytest.mark.parametrize("args", [{"limit": "diez"}, {"after_id": "x"}, {"limit": 5, "desde": "ayer"}])
+def test_invalid_page_arguments(client, db, args):
+    assert client.get("/api/documentos/", query_string=args).status_code == 400
+
+
+def test_full_export_streams_every_document(client, db):
+    resp = client.get("/api/documentos/", query_string={"formato": "ndjson"})
+    rows = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert [r["id"] for r in rows] == list(range(25, 0, -1))
+    assert rows[0]["codigos_extraidos"] == "C25,X25"
+    assert json.loads(client.get("/api/documentos/").get_data()) == rows
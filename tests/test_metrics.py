@@ -0,0 +1,83 @@
+import json
+
+import pytest
+from flask import Flask, stream_with_context
+
+from utils import metrics
+from utils.metrics import finish_request, phase, start_request
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path))
+    monkeypatch.setenv("METRICS_SLOW_MS", "100000")
+    for name in ("_requests", "_phases", "_admission"):
+        monkeypatch.setattr(metrics, name, {})
+    monkeypatch.setattr(metrics, "_dir_pid", None)
+
+    app = Flask(__name__)
+    app.json = metrics.TimedJSONProvider(app)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+
+    @app.route("/items/<int:n>")
+    def items(n):
+        for _ in range(n):
+            with phase("db"):
+                with phase("db"):  # anidada: cuenta una vez
+                    pass
+        return {"n": n}
+
+    @app.route("/stream")
+    def stream():
+        def body():
+            with phase("s3"):
+                yield b"x"
+        return app.response_class(stream_with_context(body()))
+
+    return app
+
+
+def _timing(header: str) -> dict:
+    parts = {}
+    for item in header.split(", "):
+        name, *params = item.split(";")
+        parts[name] = dict(p.split("=", 1) for p in params)
+    return parts
+
+
+def test_server_timing_lists_phases(app):
+    resp = app.test_client().get("/items/3")
+    timing = _timing(resp.headers["Server-Timing"])
+    assert timing["db"]["desc"] == '"3x"'
+    assert "json" in timing and "app" in timing
+    assert float(timing["app"]["dur"]) >= float(timing["db"]["dur"])
+
+
+def test_histogram_is_observed_after_the_body_is_sent(app):
+    resp = app.test_client().get("/stream")
+    assert metrics._requests.get(("-", "/stream", "GET", "200")) is None  # todavía sin enviar
+    resp.get_data()
+    resp.close()
+    series = metrics._requests[("-", "/stream", "GET", "200")]
+    assert series[-1] == 1
+    assert series[:len(metrics.BUCKETS)] == sorted(series[:len(metrics.BUCKETS)])  # acumulativos
+    assert metrics._phases[("-", "/stream", "s3")][1] == 1
+
+
+def test_prometheus_sums_all_workers(app, tmp_path):
+    app.test_client().get("/items/2").close()  # el servidor WSGI cierra la respuesta
+    labels = ["-", "/items/<int:n>", "GET", "200"]
+    other = [0] * len(metrics.BUCKETS) + [0.5, 4]
+    (tmp_path / "metrics-999999.json").write_text(json.dumps({
+        "requests": [labels + [other]],
+        "phases": [["-", "/items/<int:n>", "db", [1.0, 8]]],
+        "admission": [["t", "search", "rejected", 3]],
+    }))
+    text = metrics.render_prometheus()
+    assert 'gestor_request_duration_seconds_count{tenant="-",route="/items/<int:n>",method="GET",status="200"} 5' in text
+    assert 'gestor_phase_calls_total{tenant="-",route="/items/<int:n>",phase="db"} 10' in text
+    assert 'gestor_admission_total{tenant="t",route_class="search",outcome="rejected"} 3' in text
+
+    metrics.flush()
+    assert json.loads((tmp_path / f"metrics-{metrics.os.getpid()}.json").read_text())["requests"]
@@ -0,0 +1,69 @@
+from utils import migrations
+
+
+class FakeCursor:
+    def __init__(self, applied=()):
+        self.applied = list(applied)
+        self._row = None
+
+    def execute(self, sql, params=()):
+        if "MAX(version)" in sql:
+            self._row = {"version": max(self.applied, default=0)}
+        elif sql.startswith("INSERT INTO schema_migrations"):
+            self.applied.append(params[0])
+
+    def fetchone(self):
+        return self._row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    def __init__(self, cur):
+        self._cur = cur
+
+    def cursor(self):
+        return self._cur
+
+
+def _fake_migrations(monkeypatch, ran, fail_at=None):
+    def step(n):
+        def migrate(cur):
+            if n == fail_at:
+                raise RuntimeError(f"falla {n}")
+            ran.append(n)
+        return migrate
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", [(n, f"paso {n}", step(n)) for n in (1, 2, 3)])
+
+
+def test_upgrade_applies_only_pending_in_order(monkeypatch):
+    ran = []
+    _fake_migrations(monkeypatch, ran)
+    cur = FakeCursor(applied=[1])
+    assert migrations.upgrade(FakeConn(cur), log=lambda *_: None) == 3
+    assert ran == [2, 3]
+    assert cur.applied == [1, 2, 3]
+
+
+def test_failed_migration_is_not_recorded_and_resumes(monkeypatch):
+    ran = []
+    _fake_migrations(monkeypatch, ran, fail_at=3)
+    cur = FakeCursor()
+    try:
+        migrations.upgrade(FakeConn(cur), log=lambda *_: None)
+    except RuntimeError:
+        pass
+    assert cur.applied == [1, 2]
+
+    _fake_migrations(monkeypatch, ran)
+    assert migrations.upgrade(FakeConn(cur), log=lambda *_: None) == 3
+    assert ran == [1, 2, 3]
+
+
+def test_migration_numbers_are_consecutive():
+    assert [n for n, _, _ in migrations.MIGRATIONS] == list(range(1, migrations.LATEST + 1))
@@ -0,0 +1,231 @@
+import io
+import hashlib
+
+import pytest
+
+from utils import object_store, r2_cleanup
+
+
+class FakeConn:
+    def __init__(self):
+        self.in_transaction = False
+        self.log = []
+
+    def begin(self):
+        self.in_transaction = True
+        self.log.append("begin")
+
+    def commit(self):
+        self.in_transaction = False
+        self.log.append("commit")
+
+    def rollback(self):
+        self.in_transaction = False
+        self.log.append("rollback")
+
+
+class FakeCursor:
+    """Lo justo de ``object_refs``/``documents``/``pending_object_deletes`` para estos módulos."""
+
+    def __init__(self, refs=None, paths=()):
+        self.connection = FakeConn()
+        self.refs = dict(refs or {})   # clave → [refcount, marcada]
+        self.paths = set(paths)
+        self.pending = {}              # clave → {"attempts", "delay", "due"}
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        sql = " ".join(sql.split())
+        params = list(params)
+        self._rows = []
+        if sql.startswith("SELECT object_key, refcount FROM object_refs"):
+            self._rows = [{"object_key": k, "refcount": self.refs[k][0]} for k in params if k in self.refs]
+        elif sql.startswith("SELECT DISTINCT path FROM documents"):
+            self._rows = [{"path": k} for k in params if k in self.paths]
+        elif sql.startswith("SELECT object_key FROM object_refs"):
+            self._rows = [{"object_key": k} for k in params[:-1] if k in self.refs and self.refs[k][1]]
+        elif sql.startswith("DELETE FROM object_refs WHERE refcount = 0"):
+            for k in params:
+                if k in self.refs and self.refs[k][0] == 0:
+                    del self.refs[k]
+        elif sql.startswith("UPDATE object_refs SET deleting_since = NULL"):
+            for k in params:
+                if k in self.refs:
+                    self.refs[k][1] = False
+        elif sql.startswith("SELECT object_key, attempts FROM pending_object_deletes"):
+            self._rows = [{"object_key": k, "attempts": self.pending[k]["attempts"]}
+                          for k in params if k in self.pending]
+        elif sql.startswith("SELECT object_key FROM pending_object_deletes WHERE next_attempt_at <= NOW()"):
+            due = [k for k, row in self.pending.items() if row["due"]]
+            self._rows = [{"object_key": k} for k in due[:params[0]]]
+        elif sql.startswith("DELETE FROM pending_object_deletes"):
+            for k in params:
+                self.pending.pop(k, None)
+        else:
+            raise AssertionError(f"consulta inesperada: {sql}")
+
+    def executemany(self, sql, seq):
+        sql = " ".join(sql.split())
+        for params in seq:
+            if sql.startswith("INSERT INTO object_refs (object_key, sha256, size, refcount)"):
+                self.refs.setdefault(params[0], [0, False])[0] += 1
+            elif sql.startswith("UPDATE object_refs SET refcount = GREATEST"):
+                n, key = params
+                if key in self.refs:
+                    self.refs[key][0] = max(self.refs[key][0] - n, 0)
+            elif sql.startswith("INSERT INTO object_refs (object_key, refcount, deleting_since)"):
+                self.refs.setdefault(params[0], [0, False])[1] = True
+            elif sql.startswith("INSERT INTO pending_object_deletes"):
+                key, attempts, _, delay = params
+                self.pending[key] = {"attempts": attempts, "delay": delay, "due": False}
+                self.connection.log.append(("queued", key))
+            else:
+                raise AssertionError(f"consulta inesperada: {sql}")
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeS3:
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.calls = []
+
+    def head_object(self, Bucket, Key):
+        self.calls.append(("head", Key))
+        if Key not in self.objects:
+            raise KeyError(Key)
+        return {"ContentLength": len(self.objects[Key])}
+
+    def upload_fileobj(self, f, bucket, key, ExtraArgs=None, Config=None):
+        self.calls.append(("upload", key))
+        self.objects[key] = f.read()
+
+    def copy(self, source, bucket, key, ExtraArgs=None, Config=None):
+        self.calls.append(("copy", key))
+        self.objects[key] = self.objects[source["Key"]]
+
+    def delete_object(self, Bucket, Key):
+        self.calls.append(("delete", Key))
+        self.objects.pop(Key, None)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3()
+    monkeypatch.setattr(object_store, "get_s3_client", lambda: fake)
+    monkeypatch.setattr(object_store, "get_transfer_config", lambda: None)
+    return fake
+
+
+def test_hash_stream_reads_in_chunks_and_rewinds(monkeypatch):
+    monkeypatch.setattr(object_store, "HASH_CHUNK_SIZE", 3)
+    data = b"%PDF-1.7 contenido"
+    f = io.BytesIO(data)
+    f.read(4)
+    assert object_store.hash_stream(f) == (hashlib.sha256(data).hexdigest(), len(data))
+    assert f.tell() == 0
+
+
+def test_acquire_and_release_count_references():
+    cur = FakeCursor()
+    object_store.acquire(cur, [("k", "d", 1), ("k", "d", 1), ("otra", "e", 2)])
+    object_store.release(cur, ["k", None, "k", "k"])
+    assert cur.refs == {"k": [0, False], "otra": [1, False]}
+
+
+def test_ensure_object_skips_existing_and_uploads_missing(s3):
+    s3.objects["t/objetos/aa"] = b"abc"
+    assert object_store.ensure_object(io.BytesIO(b"abc"), "t/objetos/aa", "aa", 3, None) is False
+    assert object_store.ensure_object(io.BytesIO(b"xyz"), "t/objetos/bb", "bb", 3, None) is True
+    assert s3.objects["t/objetos/bb"] == b"xyz"
+    # Tamaño distinto del esperado: se vuelve a subir
+    assert object_store.ensure_object(io.BytesIO(b"abcd"), "t/objetos/aa", "aa", 4, None) is True
+
+
+def test_promote_staging_copies_once_and_removes_staging(s3):
+    first = object_store.staging_key("t", "a.pdf")
+    second = object_store.staging_key("t", "a.pdf")
+    assert first != second and object_store.is_staging_key("t", first)
+    assert not object_store.is_staging_key("otro", first)
+    s3.objects[first] = s3.objects[second] = b"pdf"
+
+    assert object_store.promote_staging(first, "t/objetos/cc", "cc", 3, None) is True
+    assert object_store.promote_staging(second, "t/objetos/cc", "cc", 3, None) is False
+    assert s3.objects == {"t/objetos/cc": b"pdf"}
+
+
+def test_delete_unreferenced_calls_r2_outside_transactions(monkeypatch):
+    cur = FakeCursor(refs={"libre": [0, False], "usada": [2, False], "falla": [0, False]},
+                     paths={"antigua-en-uso"})
+    seen = {}
+
+    def delete_keys(keys):
+        seen["keys"] = sorted(keys)
+        seen["in_transaction"] = cur.connection.in_transaction
+        seen["marked"] = sorted(k for k, (_, marked) in cur.refs.items() if marked)
+        return {"falla": "InternalError: boom"}
+
+    monkeypatch.setattr(r2_cleanup, "delete_keys", delete_keys)
+    failed, in_use = r2_cleanup.delete_unreferenced(
+        cur, ["libre", "usada", "falla", "antigua-en-uso", "antigua-libre"])
+
+    assert seen == {"keys": ["antigua-libre", "falla", "libre"], "in_transaction": False,
+                    "marked": ["antigua-libre", "falla", "libre"]}
+    assert failed == {"falla": "InternalError: boom"}
+    assert in_use == {"usada", "antigua-en-uso"}
+    # Las borradas pierden su fila; la fallida sigue a cero, desmarcada y en la cola
+    assert cur.refs == {"usada": [2, False], "falla": [0, False]}
+    assert cur.connection.log == ["begin", "commit", "begin", ("queued", "falla"), "commit"]
+
+
+def test_delete_unreferenced_keeps_rows_pinned_during_the_delete(monkeypatch):
+    cur = FakeCursor(refs={"k": [0, False]})
+
+    def delete_keys(keys):
+        object_store.acquire(cur, [("k", "d", 1)])  # una subida fija la clave a mitad del borrado
+        return {}
+
+    monkeypatch.setattr(r2_cleanup, "delete_keys", delete_keys)
+    r2_cleanup.delete_unreferenced(cur, ["k"])
+    assert cur.refs == {"k": [1, False]}
+
+
+def test_wait_for_deletes_polls_until_the_mark_is_cleared(monkeypatch):
+    cur = FakeCursor(refs={"k": [1, True], "otra": [1, False]})
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        cur.refs["k"][1] = False
+
+    monkeypatch.setattr(object_store.time, "sleep", sleep)
+    object_store.wait_for_deletes(cur, ["k", "otra"])
+    assert len(sleeps) == 1
+
+
+def test_retry_delay_grows_and_is_capped():
+    assert [r2_cleanup.retry_delay(n) for n in (1, 2, 3, 10)] == [60, 240, 540, 6000]
+    assert r2_cleanup.retry_delay(1000) == r2_cleanup.RETRY_MAX_SECONDS
+
+
+def test_retry_pending_backs_off_until_the_delete_succeeds(monkeypatch):
+    cur = FakeCursor(refs={"k": [0, False], "usada": [1, False]})
+    outcomes = iter([{"k": "SlowDown"}, {"k": "SlowDown"}, {}])
+    monkeypatch.setattr(r2_cleanup, "delete_keys", lambda keys: next(outcomes))
+
+    r2_cleanup.delete_unreferenced(cur, ["k"])
+    assert cur.pending["k"]["attempts"] == 1 and cur.pending["k"]["delay"] == 60
+
+    # Antes de plazo no se reintenta nada
+    assert r2_cleanup.retry_pending(cur)["retried"] == 0
+
+    cur.pending["k"]["due"] = True
+    assert r2_cleanup.retry_pending(cur) == {"retried": 1, "deleted": 0, "failed": 1, "in_use": 0}
+    assert cur.pending["k"] == {"attempts": 2, "delay": 240, "due": False}
+
+    cur.pending["k"]["due"] = True
+    cur.pending["usada"] = {"attempts": 3, "delay": 540, "due": True}  # se volvió a subir
+    assert r2_cleanup.retry_pending(cur) == {"retried": 2, "deleted": 1, "failed": 0, "in_use": 1}
+    assert cur.pending == {}
+    assert "k" not in cur.refs and cur.refs["usada"] == [1, False]
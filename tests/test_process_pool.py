@@ -0,0 +1,53 @@
+import time
+import threading
+from concurrent.futures import TimeoutError as FuturesTimeout
+
+import pytest
+
+from utils import pdf_highlight
+from utils.pdf_highlight import EXTRACTION_POOL, run_in_pool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setenv("CODE_EXTRACT_WORKERS", "2")
+    yield EXTRACTION_POOL
+    executor = pdf_highlight._POOLS.get(EXTRACTION_POOL)
+    if executor is not None:
+        pdf_highlight._reset_pool(EXTRACTION_POOL, executor, terminate=True)
+
+
+def test_timeout_terminates_the_running_task(pool):
+    assert run_in_pool(abs, -1, pool=pool) == 1  # arranca los procesos
+    executor = pdf_highlight._POOLS[pool]
+    processes = list(executor._processes.values())
+
+    with pytest.raises(FuturesTimeout):
+        run_in_pool(time.sleep, 30, timeout=0.5, pool=pool)
+
+    for process in processes:
+        process.join(5)
+        assert not process.is_alive()
+    assert pdf_highlight._POOLS.get(pool) is not executor
+    assert run_in_pool(abs, -3, pool=pool) == 3
+
+
+def test_tasks_killed_by_another_timeout_are_retried(pool):
+    run_in_pool(abs, -1, pool=pool)
+    results = []
+
+    def slow_task():
+        results.append(run_in_pool(time.sleep, 1, pool=pool))
+
+    other = threading.Thread(target=slow_task)
+    other.start()
+    time.sleep(0.2)
+    with pytest.raises(FuturesTimeout):
+        run_in_pool(time.sleep, 30, timeout=0.3, pool=pool)
+    other.join(30)
+    assert results == [None]  # terminó en el pool nuevo, sin error
+
+
+def test_highlight_pool_is_separate(pool):
+    assert pdf_highlight._pool(pool) is not pdf_highlight._pool(pdf_highlight.PDF_POOL)
+    pdf_highlight._reset_pool(pdf_highlight.PDF_POOL, pdf_highlight._pool(pdf_highlight.PDF_POOL))
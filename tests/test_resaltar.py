@@ -0,0 +1,122 @@
+import io
+
+import pytest
+
+from routes import documentos
+from utils.highlight_cache import HighlightCache
+
+ORIGINAL = b"%PDF-original" + b"o" * 300000
+RESULT = b"%PDF-resaltado" + b"r" * 200000
+
+
+class FakeBody(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+class FakeS3:
+    def __init__(self):
+        self.bodies = []
+
+    def head_object(self, Bucket, Key):
+        return {"ETag": '"v1"', "ContentLength": len(ORIGINAL)}
+
+    def get_object(self, Bucket, Key):
+        self.bodies.append(FakeBody(ORIGINAL))
+        return {"Body": self.bodies[-1], "ContentLength": len(ORIGINAL)}
+
+
+class FakeResponse:
+    def __init__(self, text="", content=b""):
+        self.text = text
+        self.content = content
+        self.headers = {"Content-Length": str(len(content))} if content else {}
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeHighlighter:
+    def __init__(self):
+        self.uploads = []
+        self.downloads = []
+
+    def ensure_available(self):
+        pass
+
+    def post(self, url, data, headers):
+        assert headers["Content-Type"] == data.content_type
+        sent = b"".join(data)
+        assert len(sent) == len(data)
+        self.uploads.append(sent)
+        return FakeResponse(text='<a href="/descargar/abc.pdf">PDF</a>')
+
+    def get(self, url, stream):
+        assert stream and url == "http://resaltador/descargar/abc.pdf"
+        self.downloads.append(FakeResponse(content=RESULT))
+        return self.downloads[-1]
+
+
+@pytest.fixture
+def remote(client, monkeypatch, tmp_path):
+    s3, highlighter = FakeS3(), FakeHighlighter()
+    cache = HighlightCache(str(tmp_path / "resaltados"), max_bytes=10 * 1024 * 1024)
+    monkeypatch.setenv("HIGHLIGHTER_URL", "http://resaltador")
+    monkeypatch.setenv("HIGHLIGHTER_BACKEND", "remote")
+    monkeypatch.setattr(documentos, "get_s3_client", lambda: s3)
+    monkeypatch.setattr(documentos, "get_highlighter", lambda: highlighter)
+    monkeypatch.setattr(documentos, "get_highlight_cache", lambda: cache)
+    monkeypatch.setattr(documentos, "_paginas_de_codigos", lambda *a: None)
+    return s3, highlighter
+
+
+def test_miss_streams_through_and_fills_cache(client, remote):
+    s3, highlighter = remote
+    body = {"pdf_path": "t/objetos/aa", "codes": ["b-1", "A-2"]}
+
+    resp = client.post("/api/documentos/resaltar", json=body)
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.headers["Content-Length"] == str(len(RESULT))
+    assert resp.get_data() == RESULT
+    etag = resp.headers["ETag"]
+
+    # El original se leyó por bloques, no entero
+    assert max(s3.bodies[0].reads) == documentos.STREAM_CHUNK_SIZE
+    assert ORIGINAL in highlighter.uploads[0]
+    assert b"A-2,B-1" in highlighter.uploads[0]
+    assert highlighter.downloads[0].closed
+
+    # Segunda petición (códigos en otro orden): sale de la caché
+    resp = client.post("/api/documentos/resaltar", json={"pdf_path": "t/objetos/aa", "codes": ["a-2", "B-1"]})
+    assert resp.get_data() == RESULT
+    assert resp.headers["ETag"] == etag
+    assert len(highlighter.uploads) == 1
+
+    resp = client.post("/api/documentos/resaltar", json=body, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+
+def test_interrupted_stream_is_not_cached(client, remote):
+    s3, highlighter = remote
+    body = {"pdf_path": "t/objetos/aa", "codes": ["A-1"]}
+    resp = client.post("/api/documentos/resaltar", json=body, buffered=False)
+    next(resp.response)  # el cliente corta tras el primer bloque
+    resp.close()
+    assert highlighter.downloads[0].closed
+
+    assert client.post("/api/documentos/resaltar", json=body).get_data() == RESULT
+    assert len(highlighter.uploads) == 2
@@ -0,0 +1,50 @@
+import os
+
+from utils.response_cache import ResponseCache
+
+
+def _resp_files(directory):
+    return [e for e in os.scandir(directory) if e.name.endswith(".resp")]
+
+
+def test_memory_only_by_default(tmp_path):
+    cache = ResponseCache(max_bytes=4096, directory=str(tmp_path))
+    for n in range(100):
+        cache.put("t", 0, f"k{n}", b"x" * 200, "application/json")
+    assert cache.stats()["bytes"] <= 4096
+    assert _resp_files(tmp_path) == []
+    assert cache.get("t", 0, "k99") == (b"x" * 200, "application/json")
+    assert cache.get("t", 0, "k0") is None
+
+
+def test_disk_store_stays_bounded(tmp_path):
+    cache = ResponseCache(max_bytes=1024, directory=str(tmp_path),
+                          disk_max_bytes=20 * 1024, disk_max_files=15)
+    for n in range(300):
+        cache.put("t", 0, f"k{n}", b"y" * 1000, "application/json")
+        files = _resp_files(tmp_path)
+        assert len(files) <= 15 + 1
+        assert sum(e.stat().st_size for e in files) <= 20 * 1024 + 1100
+    # Lo último escrito sigue en disco y lo lee otro worker
+    other = ResponseCache(max_bytes=1024, directory=str(tmp_path), disk_max_bytes=20 * 1024)
+    assert other.get("t", 0, "k299") == (b"y" * 1000, "application/json")
+
+
+def test_versions_are_shared_between_processes(tmp_path):
+    a = ResponseCache(max_bytes=1024, directory=str(tmp_path))
+    b = ResponseCache(max_bytes=1024, directory=str(tmp_path))
+    assert a.version("t") == 0
+    assert b.bump("t") == 1
+    assert a.version("t") == 1
+    # Dos subidas seguidas, del mismo tamaño de archivo, también se ven
+    for expected in range(2, 12):
+        assert b.bump("t") == expected
+        assert a.version("t") == expected
+    assert a.version("otro") == 0
+
+
+def test_bump_prunes_old_versions_on_disk(tmp_path):
+    cache = ResponseCache(max_bytes=1024, directory=str(tmp_path), disk_max_bytes=1024 * 1024)
+    cache.put("t", 0, "k", b"z", "application/json")
+    cache.bump("t")
+    assert _resp_files(tmp_path) == []
@@ -0,0 +1,128 @@
+import datetime
+
+import pytest
+
+from routes import documentos
+
+DOCS = {
+    1: ("Antiguo", datetime.date(2024, 1, 1), ["A", "B", "C"]),
+    2: ("Nuevo", datetime.date(2024, 6, 1), ["A", "B"]),
+    3: ("Suelto", datetime.date(2024, 3, 1), ["C", "D"]),
+    4: ("Otro", datetime.date(2024, 2, 1), ["E"]),
+}
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=()):
+        assert "code_norm IN" in sql
+        self.conn.queries.append(list(params))
+        self.rows = [
+            {"id": doc_id, "name": name, "date": date, "path": f"t/{doc_id}", "codigo": code}
+            for doc_id, (name, date, codes) in DOCS.items()
+            for code in codes if code in params
+        ]
+
+    def fetchall(self):
+        return self.rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    open = True
+
+    def __init__(self):
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def conn(client, monkeypatch):
+    fake = FakeConn()
+    monkeypatch.setattr(documentos, "get_db_connection", lambda: fake)
+    return fake
+
+
+def _resumen(resultado):
+    return ([d["documento"]["id"] for d in resultado["documentos"]], sorted(resultado["codigos_faltantes"]))
+
+
+LISTAS = ["a, b, c", ["D", "e"], "A Z", ["b"]]
+
+
+def test_batch_matches_single_searches_with_one_query(client, conn):
+    resp = client.post("/api/documentos/search_optima/batch", json={"listas": LISTAS})
+    assert resp.status_code == 200
+    lote = resp.get_json()["resultados"]
+    assert len(conn.queries) == 1
+    assert sorted(conn.queries[0]) == ["A", "B", "C", "D", "E", "Z"]
+
+    for lista, resultado in zip(LISTAS, lote):
+        individual = client.post("/api/documentos/search_optima", json={"codigos": lista}).get_json()
+        assert _resumen(resultado) == _resumen(individual)
+    assert _resumen(lote[0]) == ([1], [])
+    assert _resumen(lote[2]) == ([2], ["Z"])  # empate: el más reciente
+    assert lote[0]["documentos"][0]["documento"]["codigos_encontrados"] == "A,B,C"
+
+
+def test_batch_splits_large_in_lists(client, conn, monkeypatch):
+    monkeypatch.setattr(documentos, "OPTIMA_IN_CHUNK", 2)
+    lote = client.post("/api/documentos/search_optima/batch", json={"listas": LISTAS}).get_json()["resultados"]
+    assert len(conn.queries) == 3
+    assert [_resumen(r) for r in lote] == [([1], []), ([3, 4], []), ([2], ["Z"]), ([2], [])]
+
+
+def test_batch_in_process_pool_and_fallback(client, conn, monkeypatch):
+    monkeypatch.setattr(documentos, "OPTIMA_PARALLEL_MIN_LISTS", 1)
+    used = []
+
+    def pool(fn, args_list, timeout=None):
+        used.append(len(args_list))
+        return [fn(*args) for args in args_list]
+
+    monkeypatch.setattr(documentos, "map_in_pool", pool)
+    body = {"listas": LISTAS, "modo": "exacto"}
+    resultados = client.post("/api/documentos/search_optima/batch", json=body).get_json()["resultados"]
+    assert used == [4]
+    assert all(r["optimo"] for r in resultados)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("sin procesos")
+
+    monkeypatch.setattr(documentos, "map_in_pool", broken)
+    body["tiempo_max"] = 1  # otra clave de la caché de respuestas
+    assert client.post("/api/documentos/search_optima/batch", json=body).get_json()["resultados"] == resultados
+
+
+@pytest.mark.parametrize("body", [
+    {},
+    {"listas": "A,B"},
+    {"listas": [1, 2]},
+    {"listas": ["A"], "tiempo_max": "rápido"},
+    {"listas": [" ", []]},
+])
+def test_batch_rejects_invalid_bodies(client, conn, body):
+    assert client.post("/api/documentos/search_optima/batch", json=body).status_code == 400
+
+
+def test_batch_reports_empty_lists_in_place(client, conn):
+    resultados = client.post("/api/documentos/search_optima/batch", json={"listas": ["A", " "]}).get_json()["resultados"]
+    assert _resumen(resultados[0]) == ([2], [])
+    assert "error" in resultados[1]
+
+
+def test_batch_limits_lists(client, conn, monkeypatch):
+    monkeypatch.setattr(documentos, "OPTIMA_BATCH_MAX_LISTS", 2)
+    assert client.post("/api/documentos/search_optima/batch", json={"listas": ["A", "B", "C"]}).status_code == 400
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+from utils import storage
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    built = []
+
+    def build():
+        built.append(object())
+        return built[-1]
+
+    monkeypatch.setattr(storage, "_build_client", build)
+    monkeypatch.setattr(storage, "_CLIENT", None)
+    monkeypatch.setattr(storage, "_CLIENT_PID", None)
+    return built
+
+
+def test_client_is_built_once_per_process(builds):
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(storage.get_s3_client())) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert all(client is builds[0] for client in clients)
+
+
+def test_client_is_rebuilt_after_fork(builds, monkeypatch):
+    first = storage.get_s3_client()
+    monkeypatch.setattr(storage.os, "getpid", lambda: -1)  # como en un worker recién creado
+    second = storage.get_s3_client()
+    assert second is not first
+    assert storage.get_s3_client() is second
+    assert len(builds) == 2
+
+
+def test_real_client_uses_r2_settings(monkeypatch):
+    monkeypatch.setenv("R2_ENDPOINT_URL", "https://cuenta.r2.example.com")
+    monkeypatch.setenv("R2_MAX_POOL_CONNECTIONS", "7")
+    client = storage._build_client()
+    assert client.meta.endpoint_url == "https://cuenta.r2.example.com"
+    assert client.meta.config.max_pool_connections == 7
+    assert client.meta.config.s3["addressing_style"] == "virtual"
+
+
+def test_transfer_config_is_shared(monkeypatch):
+    monkeypatch.setattr(storage, "_TRANSFER_CONFIG", None)
+    monkeypatch.setenv("R2_MULTIPART_THRESHOLD_MB", "32")
+    config = storage.get_transfer_config()
+    assert config.multipart_threshold == 32 * storage.MB
+    assert storage.get_transfer_config() is config
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from utils import code_index, admission, warmup
+from utils.tenants import TenantRegistry
+
+BASE = {"db_host": "h", "db_user": "u", "db_pass": "p", "db_name": "d"}
+
+
+@pytest.fixture
+def released(monkeypatch):
+    calls = []
+    monkeypatch.setattr(warmup, "forget", lambda t: calls.append(("pool", t)))
+    monkeypatch.setattr(code_index, "drop", lambda t: calls.append(("índice", t)))
+    monkeypatch.setattr(admission, "forget", lambda t: calls.append(("admisión", t)))
+    return calls
+
+
+def _registry(tmp_path, config):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps({"t": config}))
+    registry = TenantRegistry(path=str(path))
+    registry.load()
+    return registry, path
+
+
+def _reload(registry, path, config):
+    path.write_text(json.dumps({"t": config}) if config is not None else "{}")
+    registry.reload()
+
+
+@pytest.mark.parametrize("change, expected", [
+    ({"admission": {"write": {"limit": 1}}}, [("admisión", "t")]),
+    ({"code_patterns": [r"\d+"]}, [("índice", "t")]),
+    ({"db_pass": "otra"}, [("pool", "t"), ("índice", "t")]),
+    ({"pool_size": 3}, [("pool", "t"), ("índice", "t")]),
+    ({"nombre": "solo informativo"}, []),
+])
+def test_reload_releases_only_what_depends_on_the_change(tmp_path, released, change, expected):
+    registry, path = _registry(tmp_path, BASE)
+    _reload(registry, path, dict(BASE, **change))
+    assert released == expected
+
+
+def test_removed_tenant_releases_everything(tmp_path, released):
+    registry, path = _registry(tmp_path, BASE)
+    _reload(registry, path, None)
+    assert released == [("pool", "t"), ("índice", "t"), ("admisión", "t")]
+
+
+def test_forget_never_leaves_readiness_on_a_closed_pool():
+    old = warmup.get_readiness("forget-t", BASE)
+    warmup.forget("forget-t")
+    new = warmup.get_readiness("forget-t", BASE)
+    assert new is not old
+    assert not new.pool._closed
+    assert old.pool._closed
+    warmup.forget("forget-t")
@@ -0,0 +1,30 @@
+import io
+
+import pytest
+
+from routes import documentos
+from utils.db import PoolTimeout
+from utils.warmup import DatabaseUnavailable
+
+
+@pytest.fixture
+def released(monkeypatch):
+    keys = []
+    monkeypatch.setattr(documentos, "_guardar_objeto", lambda f: ("t/objetos/aa", True))
+    monkeypatch.setattr(documentos, "_soltar_objetos", keys.extend)
+    return keys
+
+
+@pytest.mark.parametrize("error", [DatabaseUnavailable("dormida", 7), PoolTimeout("agotado")])
+def test_upload_releases_reference_when_no_connection(client, monkeypatch, released, error):
+    def no_connection():
+        raise error
+
+    monkeypatch.setattr(documentos, "get_db_connection", no_connection)
+    resp = client.post("/api/documentos/upload", data={
+        "file": (io.BytesIO(b"%PDF-1.7"), "a.pdf"),
+        "fecha": "2024-05-01",
+    })
+    assert resp.status_code == 503
+    assert "Retry-After" in resp.headers
+    assert released == ["t/objetos/aa"]
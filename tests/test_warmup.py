@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from utils.migrations import LATEST
+from utils.warmup import COLD, FAILED, READY, DatabaseUnavailable, TenantReadiness
+
+
+class FakeCursor:
+    def __init__(self, schema):
+        self.schema = schema
+
+    def execute(self, sql, params=()):
+        assert "schema_migrations" in sql
+
+    def fetchone(self):
+        return {"version": self.schema}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    def __init__(self, schema):
+        self.schema = schema
+
+    def cursor(self):
+        return FakeCursor(self.schema)
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    """Falla las ``failures`` primeras conexiones; el esquema está en ``schema``."""
+
+    def __init__(self, failures=0, schema=LATEST):
+        self.failures = failures
+        self.schema = schema
+        self.calls = 0
+
+    def connection(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise OSError("Connection refused")
+        return FakeConn(self.schema)
+
+
+def _readiness(pool, **kwargs):
+    kwargs = dict(dict(wait=2, base_delay=0.01, max_delay=0.02, max_warmup=1, cooldown=60), **kwargs)
+    return TenantReadiness("t", pool, **kwargs)
+
+
+def test_warms_up_after_retries(capsys):
+    pool = FakePool(failures=2)
+    readiness = _readiness(pool)
+    assert readiness.state == COLD
+    readiness.connection()
+    assert readiness.state == READY
+    assert readiness.status()["attempts"] == 3
+
+
+def test_fails_fast_during_cooldown(capsys):
+    pool = FakePool(failures=10 ** 6)
+    readiness = _readiness(pool, max_warmup=0.05)
+    with pytest.raises(DatabaseUnavailable):
+        readiness.ensure_ready(wait=2)
+    assert readiness.state == FAILED
+    calls = pool.calls
+    with pytest.raises(DatabaseUnavailable) as err:
+        readiness.ensure_ready(wait=2)
+    assert pool.calls == calls  # sin nuevo calentamiento hasta que pase el cooldown
+    assert err.value.retry_after > 1
+
+
+def test_mark_cold_rewarms():
+    readiness = _readiness(FakePool())
+    readiness.ensure_ready()
+    readiness.mark_cold(OSError("gone"))
+    readiness.ensure_ready()
+    assert readiness.state == READY
+
+
+def test_outdated_schema_fails_with_clear_message():
+    pool = FakePool(schema=LATEST - 1)
+    readiness = _readiness(pool, cooldown=0.05)
+    with pytest.raises(DatabaseUnavailable) as err:
+        readiness.ensure_ready()
+    assert readiness.state == FAILED
+    assert "migrations upgrade" in str(err.value)
+    assert readiness.status()["schema_version"] == LATEST - 1
+
+    # Tras migrar, el siguiente intento (pasado el cooldown) la deja lista
+    pool.schema = LATEST
+    time.sleep(0.1)
+    readiness.ensure_ready()
+    assert readiness.status()["schema_version"] == LATEST
@@ -0,0 +1,117 @@
+import io
+import json
+import time
+import zipfile
+import datetime
+
+import pytest
+
+from utils import zip_export
+
+
+class FakeBody:
+    def __init__(self, data):
+        self._data = data
+        self.closed = False
+
+    def read(self):
+        return self._data
+
+    def iter_chunks(self, size):
+        for start in range(0, len(self._data), size):
+            yield self._data[start:start + size]
+
+    def close(self):
+        self.closed = True
+
+
+class BrokenBody(FakeBody):
+    """Se corta tras el primer trozo, como una conexión con R2 que se cae."""
+
+    def iter_chunks(self, size):
+        yield self._data[:size]
+        raise ConnectionError("Connection reset by peer")
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+        self.broken = set()
+        self.bodies = []
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise KeyError(f"NoSuchKey: {Key}")
+        data = self.objects[Key]
+        self.bodies.append((BrokenBody if Key in self.broken else FakeBody)(data))
+        return {"Body": self.bodies[-1], "ContentLength": len(data)}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3({"t/a": b"%PDF-a", "t/b": b"%PDF-" + b"b" * 5000})
+    monkeypatch.setattr(zip_export, "get_s3_client", lambda: fake)
+    monkeypatch.setattr(zip_export, "EXPORT_PREFETCH_MAX_BYTES", 100)  # "t/b" se copia por trozos
+    return fake
+
+
+def _export(docs, workers=2):
+    data = b"".join(zip_export.stream_zip(docs, workers=workers))
+    return zipfile.ZipFile(io.BytesIO(data))
+
+
+def test_manifest_lists_included_and_failed_documents(s3):
+    docs = [
+        {"id": 1, "name": "Factura", "date": datetime.date(2024, 5, 1), "path": "t/a"},
+        {"id": 2, "name": "Factura", "date": None, "path": "t/b"},
+        {"id": 3, "name": "Perdido", "date": None, "path": "t/no-existe"},
+        {"id": 4, "name": "Sin archivo", "date": None, "path": None},
+    ]
+    zf = _export(docs)
+
+    assert zf.namelist() == ["Factura.pdf", "Factura (2).pdf", zip_export.MANIFEST_NAME]
+    assert zf.read("Factura.pdf") == b"%PDF-a"
+    assert zf.read("Factura (2).pdf") == s3.objects["t/b"]
+    assert zf.getinfo("Factura.pdf").date_time[:3] == (2024, 5, 1)
+
+    manifest = json.loads(zf.read(zip_export.MANIFEST_NAME))
+    assert (manifest["total"], manifest["incluidos"], manifest["errores"]) == (4, 2, 2)
+    estados = {e["id"]: e["estado"] for e in manifest["documentos"]}
+    assert estados == {1: "ok", 2: "ok", 3: "error", 4: "error"}
+    assert [e["id"] for e in manifest["documentos"]] == [1, 2, 3, 4]
+
+
+def test_empty_export_has_only_the_manifest(s3):
+    zf = _export([])
+    assert zf.namelist() == [zip_export.MANIFEST_NAME]
+    assert json.loads(zf.read(zip_export.MANIFEST_NAME))["total"] == 0
+
+
+def test_r2_failure_mid_entry_is_reported_and_export_continues(s3, monkeypatch):
+    monkeypatch.setattr(zip_export, "CHUNK_SIZE", 1000)
+    s3.broken.add("t/b")
+    docs = [
+        {"id": 1, "name": "Grande", "date": None, "path": "t/b"},
+        {"id": 2, "name": "Factura", "date": None, "path": "t/a"},
+    ]
+    zf = _export(docs)
+    assert zf.read("Factura.pdf") == b"%PDF-a"
+    manifest = json.loads(zf.read(zip_export.MANIFEST_NAME))
+    grande = manifest["documentos"][0]
+    assert (grande["estado"], grande["archivo"]) == ("incompleto", "Grande.pdf")
+    assert 0 < grande["bytes"] < len(s3.objects["t/b"])
+    assert "Connection reset" in grande["error"]
+    assert (manifest["incluidos"], manifest["errores"]) == (1, 1)
+    assert all(body.closed for body in s3.bodies)
+
+
+def test_client_disconnect_closes_open_downloads(s3, monkeypatch):
+    monkeypatch.setattr(zip_export, "CHUNK_SIZE", 1000)
+    docs = [{"id": n, "name": f"D{n}", "date": None, "path": "t/b"} for n in range(4)]
+    stream = zip_export.stream_zip(docs, workers=2)
+    next(stream)
+    stream.close()  # el cliente se va a mitad del primer documento
+    deadline = time.monotonic() + 5
+    while not all(body.closed for body in s3.bodies) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert s3.bodies and all(body.closed for body in s3.bodies)
@@ -0,0 +1,266 @@
+# admission.py — Control de admisión por cliente y tipo de ruta
+#
+# Todos los clientes comparten los mismos workers: sin límites, uno que lance
+# muchas ``search_optima`` o ``/resaltar`` deja sin servicio a los demás.
+# Antes de atender una petición de ``documentos_bp`` se comprueba, para su
+# (cliente, clase de ruta):
+#   1. un token bucket (``rate`` peticiones/s con ráfagas de ``burst``): si
+#      no hay token, ``429`` con el ``Retry-After`` hasta el siguiente;
+#   2. un tope de peticiones simultáneas (``concurrency``): si está lleno la
+#      petición espera en una cola acotada (``queue``) como mucho
+#      ``max_wait_ms``; si la cola está llena o vence el plazo, ``429``.
+# Una petición rechazada por la cola no gasta token: no cuenta contra la
+# tasa del cliente lo que no se llegó a atender.
+#
+# Clases: ``read`` (listados, documento, ``search_by_code``...), ``write``
+# (subidas, sueltas, por lotes y prefirmadas, y borrado por lotes), ``search`` (``search_optima`` y su variante por lotes, ``search_content``),
+# ``highlight`` (``/resaltar`` y sus trabajos) y ``export`` (ZIP de
+# documentos: ocupa su hueco mientras dura la descarga).  Valores por defecto con
+# ``ADMISSION_<CLASE>_<PARÁMETRO>`` (p. ej. ``ADMISSION_SEARCH_RATE``) y, por
+# cliente, con ``"admission": {"search": {"rate": 2, "concurrency": 1}}`` en
+# ``tenants.json``.  ``0`` desactiva el límite.
+#
+# El estado es de cada proceso: el ``Procfile`` arranca un único worker
+# ``gthread`` con ``GUNICORN_THREADS`` (8) hilos, de modo que los límites son
+# los de toda la instancia (con ``WEB_CONCURRENCY`` > 1 se multiplican por
+# el número de workers).  Una petición en cola ocupa un hilo mientras
+# espera, así que entre todas las clases solo pueden esperar a la vez
+# ``ADMISSION_MAX_WAITING`` (la mitad de los hilos); el resto recibe ``429``.
+import os
+import math
+import time
+import threading
+
+from flask import g, jsonify, request
+
+from utils.metrics import count_admission
+
+MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING") or max(1, int(os.getenv("GUNICORN_THREADS", "8")) // 2))
+
+READ = "read"
+WRITE = "write"
+SEARCH = "search"
+HIGHLIGHT = "highlight"
+EXPORT = "export"
+
+# Por endpoint o, si depende del método, por ``(endpoint, método)``
+ROUTE_CLASSES = {
+    "documentos.upload_document": WRITE,
+    "documentos.editar_documento": WRITE,
+    "documentos.eliminar_documento": WRITE,
+    ("documentos.extraccion_documento", "POST"): WRITE,
+    "documentos.subir_lote": WRITE,
+    "documentos.iniciar_subida": WRITE,
+    "documentos.completar_subida": WRITE,
+    "documentos.eliminar_lote": WRITE,
+    "documentos.busqueda_optima": SEARCH,
+    "documentos.busqueda_optima_lote": SEARCH,
+    "documentos.buscar_por_contenido": SEARCH,
+    "documentos.resaltar_pdf_remoto": HIGHLIGHT,
+    "documentos.crear_resaltado": HIGHLIGHT,
+    "documentos.resultado_resaltado": HIGHLIGHT,
+    "documentos.exportar_zip": EXPORT,
+}
+
+DEFAULTS = {
+    READ: dict(rate=50, burst=100, concurrency=0, queue=0, max_wait_ms=0),
+    WRITE: dict(rate=5, burst=20, concurrency=4, queue=8, max_wait_ms=10000),
+    SEARCH: dict(rate=5, burst=10, concurrency=2, queue=8, max_wait_ms=5000),
+    HIGHLIGHT: dict(rate=2, burst=5, concurrency=2, queue=4, max_wait_ms=10000),
+    EXPORT: dict(rate=1, burst=3, concurrency=2, queue=2, max_wait_ms=5000),
+}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, retry_after: int, reason: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason  # rate | queue_full | timeout
+
+
+def _limits(config: dict, route_class: str) -> dict:
+    limits = {}
+    for name, default in DEFAULTS[route_class].items():
+        env = os.getenv(f"ADMISSION_{route_class.upper()}_{name.upper()}")
+        limits[name] = float(env) if env is not None else default
+    limits.update((config.get("admission") or {}).get(route_class) or {})
+    return limits
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consume un token; si no hay, devuelve los segundos hasta el siguiente."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        """Devuelve el token de una petición que al final no se atendió."""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+_waiting_total = 0
+_waiting_lock = threading.Lock()
+
+
+def _reserve_waiter() -> bool:
+    """Reserva un hueco en la espera global del proceso (ver ``MAX_WAITING``)."""
+    global _waiting_total
+    with _waiting_lock:
+        if _waiting_total >= MAX_WAITING:
+            return False
+        _waiting_total += 1
+        return True
+
+
+def _free_waiter():
+    global _waiting_total
+    with _waiting_lock:
+        _waiting_total -= 1
+
+
+class _Slot:
+    """Estado de un (cliente, clase) en este worker."""
+
+    def __init__(self, limits: dict):
+        self.limits = limits
+        self.bucket = TokenBucket(limits["rate"], limits["burst"]) if limits["rate"] > 0 else None
+        self.cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+
+    def acquire(self):
+        with self.cond:
+            limit = int(self.limits["concurrency"])
+            busy = bool(limit) and self.active >= limit
+            # La cola se mira antes que el token: un rechazo por cola llena no gasta tasa
+            if busy and (self.waiting >= int(self.limits["queue"]) or not _reserve_waiter()):
+                raise AdmissionRejected("Servidor ocupado con peticiones de este cliente; intente de nuevo.",
+                                        1, "queue_full")
+            if self.bucket is not None:
+                wait = self.bucket.take()
+                if wait:
+                    if busy:
+                        _free_waiter()
+                    raise AdmissionRejected("Demasiadas peticiones; intente de nuevo en unos segundos.",
+                                            max(1, math.ceil(wait)), "rate")
+            if not busy:
+                self.active += 1
+                return False
+            self.waiting += 1
+            deadline = time.monotonic() + self.limits["max_wait_ms"] / 1000
+            try:
+                while self.active >= limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        if self.bucket is not None:
+                            self.bucket.refund()
+                        raise AdmissionRejected("Tiempo de espera agotado en la cola del cliente.",
+                                                max(1, math.ceil(self.limits["max_wait_ms"] / 1000)), "timeout")
+                    self.cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+                _free_waiter()
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+
+class _Ticket:
+    def __init__(self, slot: _Slot):
+        self._slot = slot
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._slot.release()
+
+
+_slots: dict[tuple, _Slot] = {}
+_slots_lock = threading.Lock()
+
+
+def _slot(tenant_id: str, config: dict, route_class: str) -> _Slot:
+    key = (tenant_id, route_class)
+    slot = _slots.get(key)
+    if slot is None:
+        with _slots_lock:
+            slot = _slots.get(key)
+            if slot is None:
+                slot = _slots[key] = _Slot(_limits(config, route_class))
+    return slot
+
+
+def forget(tenant_id: str):
+    """Descarta los límites del cliente; las peticiones en curso liberan su hueco igual."""
+    with _slots_lock:
+        for key in [k for k in _slots if k[0] == tenant_id]:
+            del _slots[key]
+
+
+def _enabled() -> bool:
+    return os.getenv("ADMISSION_ENABLED", "1") != "0"
+
+
+# --- Hooks de ``documentos_bp`` ---
+
+def admit():
+    """``before_request`` (después de identificar al cliente)."""
+    if request.method == "OPTIONS" or "tenant_id" not in g or not _enabled():
+        return None
+    route_class = ROUTE_CLASSES.get((request.endpoint, request.method)) or ROUTE_CLASSES.get(request.endpoint, READ)
+    slot = _slot(g.tenant_id, g.tenant_config, route_class)
+    try:
+        queued = slot.acquire()
+    except AdmissionRejected as e:
+        count_admission(g.tenant_id, route_class, f"rejected_{e.reason}")
+        resp = jsonify({"error": str(e)})
+        resp.status_code = 429
+        resp.headers["Retry-After"] = str(e.retry_after)
+        return resp
+    count_admission(g.tenant_id, route_class, "queued" if queued else "admitted")
+    g._admission = _Ticket(slot)
+    return None
+
+
+def release_on_close(response):
+    """``after_request``: el hueco se libera al terminar de enviar el cuerpo (streaming incluido)."""
+    ticket = g.pop("_admission", None)
+    if ticket is not None:
+        response.call_on_close(ticket.release)
+    return response
+
+
+def release_on_teardown(exc=None):
+    """``teardown_request``: por si la respuesta no llegó a ``after_request``."""
+    ticket = g.pop("_admission", None)
+    if ticket is not None:
+        ticket.release()
+
+
+def admission_stats() -> dict:
+    with _slots_lock:
+        slots = dict(_slots)
+    return {
+        f"{tenant}/{route_class}": dict(
+            active=slot.active, waiting=slot.waiting,
+            tokens=round(slot.bucket.tokens, 2) if slot.bucket else None,
+            **slot.limits,
+        )
+        for (tenant, route_class), slot in sorted(slots.items())
+    }
@@ -0,0 +1,272 @@
+# code_extraction.py — Extracción automática de códigos de los PDF subidos
+#
+# Tras cada alta (si el cliente tiene expresiones configuradas) el documento
+# queda con ``extraction_status = 'pendiente'`` y se encola aquí.  Unos pocos
+# hilos atienden la cola fuera de las peticiones: descargan el PDF de R2 a
+# un temporal, un proceso del pool ``extraction`` de ``utils.pdf_highlight``
+# (aparte del de resaltado) recorre el texto página a página (PyMuPDF carga
+# cada página al pedirla, no el documento entero) aplicando las expresiones
+# del cliente, y los códigos encontrados se insertan por lotes en ``codes``
+# y, con su página, en ``code_pages``.  El motor de resaltado local usa esas páginas para no
+# buscar cada código en todo el PDF.
+#
+# Expresiones: ``code_patterns`` (lista) en la entrada del cliente de
+# ``tenants.json`` o, para todos, ``CODE_EXTRACT_PATTERN``.  Si la expresión
+# tiene un grupo, el código es el grupo 1; si no, la coincidencia entera.
+#
+# Con la búsqueda por contenido activa (``content_search``, ver
+# ``utils/text_search.py``) el mismo recorrido guarda además el texto de
+# cada página en ``document_texts``.
+import os
+import re
+import queue
+import tempfile
+import threading
+
+from utils import code_index
+from utils.pdf_highlight import EXTRACTION_POOL, pymupdf_installed, run_in_pool
+from utils.response_cache import bump_version
+from utils.storage import get_s3_client
+from utils.warmup import get_readiness
+
+PENDING = "pendiente"
+RUNNING = "en_proceso"
+DONE = "completado"
+FAILED = "error"
+
+# Páginas de texto por sentencia ``INSERT`` (cada una puede ser larga)
+TEXT_BATCH_PAGES = 50
+
+
+def tenant_patterns(config: dict) -> list[str]:
+    patterns = config.get("code_patterns")
+    if patterns is None:
+        default = os.getenv("CODE_EXTRACT_PATTERN")
+        patterns = [default] if default else []
+    elif isinstance(patterns, str):
+        patterns = [patterns]
+    return [p for p in patterns if p]
+
+
+def content_search_enabled(config: dict) -> bool:
+    """Búsqueda por contenido: ``content_search`` del cliente o ``CONTENT_SEARCH_ENABLED``."""
+    enabled = config.get("content_search")
+    if enabled is None:
+        enabled = os.getenv("CONTENT_SEARCH_ENABLED", "0") == "1"
+    return bool(enabled) and pymupdf_installed()
+
+
+def extraction_enabled(config: dict) -> bool:
+    return pymupdf_installed() and (bool(tenant_patterns(config)) or content_search_enabled(config))
+
+
+# --- Trabajo en el proceso del pool ---
+
+def extract_file(path: str, patterns: list[str], with_text: bool = False) -> dict:
+    """
+    ``{"codes": [(código, página desde 1)], "texts": [(página, texto)]}``;
+    códigos sin repetidos en orden de aparición y texto solo si ``with_text``.
+    """
+    import fitz  # PyMuPDF; solo se importa en los procesos del pool
+
+    regexes = [re.compile(p) for p in patterns]
+    found = {}
+    texts = []
+    with fitz.open(path) as doc:
+        for page in doc:
+            text = page.get_text("text")
+            for regex in regexes:
+                for match in regex.finditer(text):
+                    code = ((match.group(1) if regex.groups else match.group(0)) or "").strip()
+                    if code and len(code) <= 191:
+                        found.setdefault((code, page.number + 1), None)
+            text = text.replace("\x00", "").strip()
+            if with_text and text:
+                texts.append((page.number + 1, text))
+    return {"codes": list(found), "texts": texts}
+
+
+# --- Proceso de un documento (cola y ``python -m utils.text_search rebuild``) ---
+
+def process_document(conn, tenant_id: str, config: dict, doc_id: int, object_key: str,
+                     timeout: float | None = None) -> dict:
+    """
+    Extrae y guarda códigos (y texto) de un documento con la conexión
+    ``conn`` (autocommit).  Deja el estado en ``completado`` o ``error``;
+    devuelve ``{"codes": n, "pages": n}``.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE documents SET extraction_status=%s, extraction_error=NULL WHERE id=%s",
+            (RUNNING, doc_id),
+        )
+    with_text = content_search_enabled(config)
+    try:
+        result = _extract(object_key, tenant_patterns(config), with_text, timeout)
+    except Exception as e:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE documents SET extraction_status=%s, extraction_error=%s WHERE id=%s",
+                (FAILED, (str(e) or e.__class__.__name__)[:255], doc_id),
+            )
+        raise
+    if not _save(conn, tenant_id, doc_id, object_key, result["codes"], result["texts"] if with_text else None):
+        print(f"Extracción del documento {doc_id} descartada: su archivo cambió o se borró durante la extracción")
+        return {"codes": 0, "pages": 0}
+    return {"codes": len(result["codes"]), "pages": len(result["texts"])}
+
+
+def _extract(object_key: str, patterns: list[str], with_text: bool, timeout: float | None) -> dict:
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        get_s3_client().download_file(os.getenv("R2_BUCKET_NAME"), object_key, path)
+        return run_in_pool(extract_file, path, patterns, with_text, timeout=timeout, pool=EXTRACTION_POOL)
+    finally:
+        os.unlink(path)
+
+
+def _save(conn, tenant_id: str, doc_id: int, object_key: str, found: list[tuple[str, int]],
+          texts: list[tuple[int, str]] | None) -> bool:
+    """
+    Inserta códigos, páginas y texto en una transacción y refresca lecturas e
+    índice.  Devuelve ``False`` sin guardar nada si el documento ya no apunta
+    a ``object_key`` (editado con otro archivo o borrado mientras tanto): la
+    extracción del archivo nuevo la hace su propio trabajo.
+    """
+    conn.begin()
+    try:
+        with conn.cursor() as cur:
+            # El bloqueo ordena este guardado con la edición que cambie el archivo
+            cur.execute("SELECT path FROM documents WHERE id=%s FOR UPDATE", (doc_id,))
+            row = cur.fetchone()
+            if row is None or row["path"] != object_key:
+                conn.rollback()
+                return False
+            codes = {}
+            for code, _ in found:
+                codes.setdefault(code.upper(), code)
+            if codes:
+                # La unicidad (code_norm, document_id) descarta los que ya estaban
+                cur.executemany(
+                    "INSERT IGNORE INTO codes (document_id, code, code_norm) VALUES (%s, %s, %s)",
+                    [(doc_id, code, norm) for norm, code in codes.items()],
+                )
+                cur.executemany(
+                    "INSERT IGNORE INTO code_pages (document_id, code_norm, page) VALUES (%s, %s, %s)",
+                    [(doc_id, code.upper(), page) for code, page in found],
+                )
+            if texts is not None:
+                cur.execute("DELETE FROM document_texts WHERE document_id=%s", (doc_id,))
+                for start in range(0, len(texts), TEXT_BATCH_PAGES):
+                    cur.executemany(
+                        "INSERT INTO document_texts (document_id, page, content) VALUES (%s, %s, %s)",
+                        [(doc_id, page, text) for page, text in texts[start:start + TEXT_BATCH_PAGES]],
+                    )
+            cur.execute(
+                "UPDATE documents SET extraction_status=%s, extraction_error=NULL WHERE id=%s",
+                (DONE, doc_id),
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    version = bump_version(tenant_id)
+    if code_index.is_loaded(tenant_id):
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, name, date, path FROM documents WHERE id=%s", (doc_id,))
+            row = cur.fetchone()
+            if row:
+                cur.execute("SELECT code FROM codes WHERE document_id=%s", (doc_id,))
+                code_index.document_saved(tenant_id, row, [r["code"] for r in cur.fetchall()], version)
+    return True
+
+
+# --- Cola ---
+
+class ExtractionPipeline:
+    def __init__(self, workers: int = 2, max_queued: int = 1000, timeout: float = 300):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = dict(queued=0, rejected=0, completed=0, failed=0, codes_found=0)
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    def _ensure_workers(self):
+        # Los hilos no sobreviven al fork de gunicorn: arrancarlos en cada worker
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            for n in range(self.workers):
+                threading.Thread(target=self._worker, name=f"extraccion-{n}", daemon=True).start()
+
+    def submit(self, tenant_id: str, config: dict, doc_id: int, object_key: str) -> bool:
+        """
+        Encola la extracción de un documento ya marcado como pendiente.
+        Devuelve ``False`` si la cola está llena (el documento sigue
+        pendiente y puede reencolarse más tarde).
+        """
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((tenant_id, config, doc_id, object_key))
+        except queue.Full:
+            self._count("rejected")
+            return False
+        self._count("queued")
+        return True
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(*job)
+            except Exception as e:
+                print(f"Error en la extracción de códigos del documento {job[2]} ({job[0]}): {e}")
+            finally:
+                self._queue.task_done()
+
+    def _run(self, tenant_id: str, config: dict, doc_id: int, object_key: str):
+        conn = get_readiness(tenant_id, config).connection(wait=30)
+        try:
+            result = process_document(conn, tenant_id, config, doc_id, object_key, self.timeout)
+        except Exception:
+            self._count("failed")
+            raise
+        finally:
+            if conn and conn.open:
+                conn.close()
+        self._count("completed")
+        self._count("codes_found", result["codes"])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, workers=self.workers, pending=self._queue.qsize())
+
+
+_PIPELINE = None
+_PIPELINE_LOCK = threading.Lock()
+
+
+def get_pipeline() -> ExtractionPipeline:
+    global _PIPELINE
+    if _PIPELINE is None:
+        with _PIPELINE_LOCK:
+            if _PIPELINE is None:
+                _PIPELINE = ExtractionPipeline(
+                    workers=int(os.getenv("CODE_EXTRACT_WORKERS", "2")),
+                    max_queued=int(os.getenv("CODE_EXTRACT_MAX_QUEUED", "1000")),
+                    timeout=float(os.getenv("CODE_EXTRACT_TIMEOUT", "300")),
+                )
+    return _PIPELINE
+
+
+def extraction_stats() -> dict | None:
+    return _PIPELINE.stats() if _PIPELINE is not None else None
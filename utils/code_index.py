@@ -0,0 +1,406 @@
+# code_index.py — Índice en memoria de códigos y nombres por cliente
+#
+# ``search_by_code`` hacía ``UPPER(code) LIKE '%X%'`` sobre ``codes`` y
+# ``documents`` (recorridos completos) y una tercera consulta ``IN (...)``.
+# Este índice responde las tres modalidades sin tocar MySQL:
+#
+#   - exacto:  diccionario término → array ordenado de ids de documento
+#   - prefijo: lista ordenada de términos + ``bisect``
+#   - like:    índice de trigramas término → candidatos, verificados con ``in``
+#
+# Se construye la primera vez que se usa, se actualiza en cada alta, edición
+# y baja de documentos y se descarta si supera su presupuesto de memoria (en
+# ese caso la búsqueda vuelve a SQL).  Cada índice recuerda la versión de
+# datos del cliente (``utils.response_cache``) que refleja: si otra escritura
+# la adelantó sin pasar por este proceso, se reconstruye.
+import os
+import sys
+import time
+import bisect
+import threading
+from array import array
+
+import pymysql
+
+NGRAM = 3
+
+# Costes aproximados (CPython 64 bits) para estimar la memoria del índice
+_ENTRY_OVERHEAD = 100   # entrada de dict + array vacío
+_GRAM_OVERHEAD = 90     # entrada en el set de cada trigrama
+_DOC_OVERHEAD = 400     # dict de la fila del documento
+
+
+class IndexBudgetExceeded(Exception):
+    """El índice superaría el presupuesto de memoria configurado."""
+
+
+def normalize(term: str) -> str:
+    return (term or "").strip().upper()
+
+
+def _grams(term: str):
+    return {term[i:i + NGRAM] for i in range(len(term) - NGRAM + 1)}
+
+
+class _TermIndex:
+    """Términos normalizados → ids, con búsqueda exacta, por prefijo y por subcadena."""
+
+    def __init__(self):
+        self.postings: dict[str, array] = {}
+        self.grams: dict[str, set] = {}
+        self.sorted_terms: list[str] = []
+        self.approx_bytes = 0
+
+    def add(self, term: str, doc_id: int) -> int:
+        """Añade ``doc_id`` a ``term``; devuelve los bytes estimados añadidos."""
+        ids = self.postings.get(term)
+        if ids is not None:
+            # Arrays ordenados: ``bisect`` en lugar de ``in``/``remove`` lineales.
+            # En la carga inicial los ids llegan en orden y esto es un ``append``.
+            pos = bisect.bisect_left(ids, doc_id)
+            if pos < len(ids) and ids[pos] == doc_id:
+                return 0
+            ids.insert(pos, doc_id)
+            self.approx_bytes += 8
+            return 8
+        self.postings[term] = array("q", (doc_id,))
+        bisect.insort(self.sorted_terms, term)
+        grams = _grams(term)
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(term)
+        added = _ENTRY_OVERHEAD + sys.getsizeof(term) + 8 + len(grams) * _GRAM_OVERHEAD
+        self.approx_bytes += added
+        return added
+
+    def remove(self, term: str, doc_id: int):
+        ids = self.postings.get(term)
+        if ids is None:
+            return
+        pos = bisect.bisect_left(ids, doc_id)
+        if pos == len(ids) or ids[pos] != doc_id:
+            return
+        del ids[pos]
+        self.approx_bytes -= 8
+        if ids:
+            return
+        del self.postings[term]
+        pos = bisect.bisect_left(self.sorted_terms, term)
+        if pos < len(self.sorted_terms) and self.sorted_terms[pos] == term:
+            del self.sorted_terms[pos]
+        grams = _grams(term)
+        for gram in grams:
+            terms = self.grams.get(gram)
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del self.grams[gram]
+        self.approx_bytes -= _ENTRY_OVERHEAD + sys.getsizeof(term) + len(grams) * _GRAM_OVERHEAD
+
+    def exact(self, term: str) -> set:
+        return set(self.postings.get(term, ()))
+
+    def prefix(self, prefix: str, limit: int) -> list[str]:
+        pos = bisect.bisect_left(self.sorted_terms, prefix)
+        found = []
+        for term in self.sorted_terms[pos:pos + limit]:
+            if not term.startswith(prefix):
+                break
+            found.append(term)
+        return found
+
+    def contains(self, sub: str) -> set:
+        if len(sub) < NGRAM:
+            # Subcadenas cortas: recorrer los términos (sigue siendo en memoria)
+            candidates = self.postings.keys()
+        else:
+            sets = []
+            for gram in _grams(sub):
+                terms = self.grams.get(gram)
+                if not terms:
+                    return set()
+                sets.append(terms)
+            sets.sort(key=len)
+            candidates = set(sets[0])
+            for terms in sets[1:]:
+                candidates &= terms
+                if not candidates:
+                    return set()
+        ids = set()
+        for term in candidates:
+            if sub in term:
+                ids.update(self.postings[term])
+        return ids
+
+
+class CodeIndex:
+    """Índice de un cliente: documentos, códigos y nombres normalizados."""
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.docs: dict[int, dict] = {}
+        self.doc_codes: dict[int, list[str]] = {}
+        self.codes = _TermIndex()
+        self.names = _TermIndex()
+        self._docs_bytes = 0
+        # Las consultas duran microsegundos: un lock simple basta para
+        # protegerlas de las actualizaciones concurrentes.
+        self._lock = threading.RLock()
+
+    @property
+    def approx_bytes(self) -> int:
+        return self.codes.approx_bytes + self.names.approx_bytes + self._docs_bytes
+
+    def _check_budget(self):
+        if self.approx_bytes > self.budget_bytes:
+            raise IndexBudgetExceeded(
+                f"Índice de códigos ~{self.approx_bytes // 1024} KiB supera el presupuesto"
+            )
+
+    # --- mantenimiento ---
+
+    def add_code(self, doc_id: int, code: str):
+        if not code:
+            return
+        self.doc_codes.setdefault(doc_id, []).append(code)
+        self.codes.add(normalize(code), doc_id)
+        self._docs_bytes += sys.getsizeof(code) + 8
+
+    def put_document(self, row: dict, codes: list[str] | None = None):
+        """Inserta o reemplaza un documento (fila de ``documents``) y sus códigos."""
+        doc_id = row["id"]
+        with self._lock:
+            self.remove_document(doc_id)
+            doc = {"id": doc_id, "name": row.get("name"), "date": row.get("date"), "path": row.get("path")}
+            self.docs[doc_id] = doc
+            self._docs_bytes += _DOC_OVERHEAD + sum(sys.getsizeof(v) for v in doc.values())
+            if doc["name"]:
+                self.names.add(normalize(doc["name"]), doc_id)
+            for code in codes or ():
+                self.add_code(doc_id, code)
+            self._check_budget()
+
+    def remove_document(self, doc_id: int):
+        with self._lock:
+            doc = self.docs.pop(doc_id, None)
+            if doc is None:
+                return
+            self._docs_bytes -= _DOC_OVERHEAD + sum(sys.getsizeof(v) for v in doc.values())
+            if doc["name"]:
+                self.names.remove(normalize(doc["name"]), doc_id)
+            for code in self.doc_codes.pop(doc_id, ()):
+                self.codes.remove(normalize(code), doc_id)
+                self._docs_bytes -= sys.getsizeof(code) + 8
+
+    # --- consultas ---
+
+    def prefix(self, prefix: str, limit: int = 50) -> list[str]:
+        with self._lock:
+            return self.codes.prefix(normalize(prefix), limit)
+
+    def search(self, term: str, exact: bool = False) -> list[dict]:
+        """
+        Documentos cuyo nombre o algún código coincide con ``term`` (igual o
+        contiene), en el mismo formato y orden que la consulta SQL original.
+        """
+        term = normalize(term)
+        with self._lock:
+            if exact:
+                ids = self.names.exact(term) | self.codes.exact(term)
+            else:
+                ids = self.names.contains(term) | self.codes.contains(term)
+            rows = []
+            for doc_id in sorted(ids, reverse=True):
+                doc = self.docs.get(doc_id)
+                if doc is None:
+                    continue
+                codes = sorted(self.doc_codes.get(doc_id, ()))
+                rows.append(dict(doc, codigos_extraidos=",".join(codes) if codes else "N/A"))
+        return rows
+
+
+def build_index(conn, budget_bytes: int) -> CodeIndex:
+    """Carga todo el índice de un cliente con cursores sin buffer."""
+    index = CodeIndex(budget_bytes)
+    cur = conn.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        # En orden de id: cada lista de ids se llena con ``append``
+        cur.execute("SELECT id, name, date, path FROM documents ORDER BY id")
+        for row in cur:
+            index.put_document(row)
+    finally:
+        cur.close()
+    cur = conn.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        cur.execute("SELECT document_id, code FROM codes ORDER BY document_id")
+        for n, row in enumerate(cur):
+            if row["document_id"] in index.docs:
+                index.add_code(row["document_id"], row["code"])
+            if n % 10000 == 0:
+                index._check_budget()
+    finally:
+        cur.close()
+    index._check_budget()
+    return index
+
+
+# --- Registro por cliente ---
+
+class _Entry:
+    def __init__(self):
+        self.lock = threading.Lock()  # serializa la construcción
+        self.index: CodeIndex | None = None
+        self.built_at = 0.0
+        self.version = None           # versión de datos que refleja el índice
+        self.building = False
+        self.pending: list = []       # cambios recibidos durante la construcción
+        self.disabled_until = 0.0     # presupuesto superado: usar SQL un tiempo
+
+
+_ENTRIES: dict[str, _Entry] = {}
+_ENTRIES_LOCK = threading.Lock()
+
+
+def _enabled() -> bool:
+    return os.getenv("CODE_INDEX_ENABLED", "1") != "0"
+
+
+def _budget_bytes() -> int:
+    return int(float(os.getenv("CODE_INDEX_MAX_MB", "64")) * 1024 * 1024)
+
+
+def _ttl() -> float:
+    # Con varios workers cada uno tiene su índice y no ve las escrituras de
+    # los demás; el TTL acota ese desfase.
+    return float(os.getenv("CODE_INDEX_TTL", "300"))
+
+
+def _entry(tenant_id: str) -> _Entry:
+    with _ENTRIES_LOCK:
+        entry = _ENTRIES.get(tenant_id)
+        if entry is None:
+            entry = _ENTRIES[tenant_id] = _Entry()
+        return entry
+
+
+def _fresh(entry: _Entry, version) -> bool:
+    return (
+        entry.index is not None
+        and time.monotonic() - entry.built_at < _ttl()
+        and (version is None or entry.version == version)
+    )
+
+
+def get_index(tenant_id: str, connect, version: int | None = None) -> CodeIndex | None:
+    """
+    Devuelve el índice del cliente, construyéndolo con una conexión de
+    ``connect()`` si no existe, caducó o no refleja la versión de datos
+    ``version``.  ``None`` significa "usar SQL".
+    """
+    if not _enabled():
+        return None
+    entry = _entry(tenant_id)
+    if _fresh(entry, version):
+        return entry.index
+    if time.monotonic() < entry.disabled_until:
+        return None
+
+    with entry.lock:
+        if _fresh(entry, version):
+            return entry.index
+        with _ENTRIES_LOCK:
+            entry.building = True
+            entry.pending = []
+        conn = connect()
+        try:
+            index = build_index(conn, _budget_bytes())
+        except IndexBudgetExceeded as e:
+            print(f"Índice de códigos de '{tenant_id}' desactivado: {e}")
+            with _ENTRIES_LOCK:
+                entry.index = None
+                entry.building = False
+                entry.disabled_until = time.monotonic() + _ttl()
+            return None
+        except Exception:
+            with _ENTRIES_LOCK:
+                entry.building = False
+            raise
+        finally:
+            if conn and conn.open:
+                conn.close()
+
+        with _ENTRIES_LOCK:
+            entry.version = version
+            try:
+                for op, args, op_version in sorted(entry.pending, key=lambda p: p[2] or 0):
+                    getattr(index, op)(*args)
+                    _advance(entry, op_version)
+            except IndexBudgetExceeded:
+                index = None
+            entry.pending = []
+            entry.building = False
+            entry.index = index
+            entry.built_at = time.monotonic()
+        return index
+
+
+def _advance(entry: _Entry, version):
+    # Solo se avanza si no falta ninguna escritura intermedia; si falta (la
+    # hizo otro worker), la versión queda atrás y el índice se reconstruye.
+    if version is not None and entry.version is not None and version == entry.version + 1:
+        entry.version = version
+
+
+def _apply(tenant_id: str, version, op: str, *args):
+    entry = _entry(tenant_id)
+    with _ENTRIES_LOCK:
+        if entry.building:
+            entry.pending.append((op, args, version))
+            return
+        if entry.index is None:
+            return  # se construirá con los datos actuales cuando se use
+        try:
+            getattr(entry.index, op)(*args)
+        except IndexBudgetExceeded as e:
+            print(f"Índice de códigos de '{tenant_id}' descartado: {e}")
+            entry.index = None
+            return
+        _advance(entry, version)
+
+
+def document_saved(tenant_id: str, row: dict, codes: list[str], version: int | None = None):
+    """
+    Alta o edición de un documento: ``row`` es la fila completa de
+    ``documents`` y ``version`` la versión de datos que dejó la escritura.
+    """
+    _apply(tenant_id, version, "put_document", row, list(codes))
+
+
+def document_deleted(tenant_id: str, doc_id: int, version: int | None = None):
+    _apply(tenant_id, version, "remove_document", doc_id)
+
+
+def is_loaded(tenant_id: str) -> bool:
+    entry = _entry(tenant_id)
+    return entry.index is not None or entry.building
+
+
+def drop(tenant_id: str):
+    with _ENTRIES_LOCK:
+        _ENTRIES.pop(tenant_id, None)
+
+
+def index_stats() -> dict:
+    with _ENTRIES_LOCK:
+        entries = dict(_ENTRIES)
+    stats = {}
+    for tenant_id, entry in entries.items():
+        index = entry.index
+        stats[tenant_id] = {
+            "loaded": index is not None,
+            "documents": len(index.docs) if index else 0,
+            "codes": len(index.codes.postings) if index else 0,
+            "approx_kib": index.approx_bytes // 1024 if index else 0,
+            "age_seconds": round(time.monotonic() - entry.built_at, 1) if index else None,
+            "data_version": entry.version,
+        }
+    return stats
@@ -0,0 +1,192 @@
+# cover.py — Motor de cobertura de conjuntos para ``search_optima``
+#
+# Dado un conjunto de códigos pedidos y los documentos que contienen alguno,
+# elige pocos documentos que cubran todos los códigos posibles.
+#
+# - Los códigos pedidos se mapean a enteros y cada documento se representa
+#   como un bitset (``int`` de Python); intersecciones y conteos son
+#   operaciones ``&`` y ``int.bit_count()``.
+# - ``greedy``: voraz perezoso con un max-heap de ganancias desactualizadas.
+#   Como la ganancia de un documento solo puede bajar, basta recalcular la
+#   del tope del heap; si sigue siendo la mayor, es la elección voraz.
+# - ``exacto``: ramificación y poda para el mínimo real de documentos,
+#   acotado por tiempo y partiendo de la solución voraz.
+#
+# En ambos modos el empate se resuelve a favor del documento que aparece
+# antes en la entrada (la consulta los ordena por fecha descendente).
+import heapq
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class CoverResult:
+    # (índice del documento en la entrada, códigos que aporta), en orden de elección
+    selected: list = field(default_factory=list)
+    missing: list = field(default_factory=list)
+    optimal: bool = False
+
+
+class _Problem:
+    """Códigos ↔ bits y documentos como bitsets."""
+
+    def __init__(self, requested, doc_codes):
+        self.codes = sorted(set(requested))
+        self.bit_of = {code: i for i, code in enumerate(self.codes)}
+        self.masks = []
+        for codes in doc_codes:
+            mask = 0
+            for code in codes:
+                bit = self.bit_of.get(code)
+                if bit is not None:
+                    mask |= 1 << bit
+            self.masks.append(mask)
+        self.full = (1 << len(self.codes)) - 1
+        coverable = 0
+        for mask in self.masks:
+            coverable |= mask
+        self.coverable = coverable
+
+    def decode(self, mask: int) -> list[str]:
+        found = []
+        while mask:
+            low = mask & -mask
+            found.append(self.codes[low.bit_length() - 1])
+            mask ^= low
+        return found
+
+
+def _lazy_greedy(masks: list[int], target: int, candidates=None) -> list[tuple[int, int]]:
+    """Devuelve ``[(índice, bits cubiertos)]`` en orden de elección."""
+    indices = range(len(masks)) if candidates is None else candidates
+    heap = [(-(masks[i] & target).bit_count(), i) for i in indices]
+    heap = [item for item in heap if item[0]]
+    heapq.heapify(heap)
+    remaining = target
+    chosen = []
+    while remaining and heap:
+        neg_gain, i = heapq.heappop(heap)
+        gain = (masks[i] & remaining).bit_count()
+        if gain == -neg_gain:
+            covered = masks[i] & remaining
+            chosen.append((i, covered))
+            remaining &= ~covered
+        elif gain:
+            heapq.heappush(heap, (-gain, i))
+    return chosen
+
+
+def _branch_and_bound(masks: list[int], target: int, incumbent: list[int],
+                      deadline: float) -> tuple[list[int], bool]:
+    """
+    Busca la cobertura mínima de ``target``.  Devuelve (índices, óptimo) donde
+    ``óptimo`` es ``False`` si se agotó el tiempo antes de probarlo.
+    """
+    # Quitar documentos vacíos y duplicados (se conserva el primero = más reciente)
+    seen = set()
+    docs = []
+    for i, mask in enumerate(masks):
+        mask &= target
+        if mask and mask not in seen:
+            seen.add(mask)
+            docs.append(i)
+
+    # Para cada bit, documentos que lo contienen (por ganancia y luego por orden)
+    covering: dict[int, list[int]] = {}
+    for i in docs:
+        mask = masks[i] & target
+        while mask:
+            low = mask & -mask
+            covering.setdefault(low.bit_length() - 1, []).append(i)
+            mask ^= low
+    for bit_docs in covering.values():
+        bit_docs.sort(key=lambda i: (-(masks[i] & target).bit_count(), i))
+
+    best = list(incumbent)
+
+    def expand(remaining: int, active: list[int], depth: int):
+        """Nodo de la búsqueda: ``None`` si es hoja o se poda; si no, ``[remaining, activos, ramas, siguiente]``."""
+        if not remaining:
+            if depth < len(best):
+                best[:] = chosen
+            return None
+        # Cota inferior: elementos restantes / mayor ganancia posible
+        max_gain = 0
+        still_active = []
+        for i in active:
+            gain = (masks[i] & remaining).bit_count()
+            if gain:
+                still_active.append(i)
+                if gain > max_gain:
+                    max_gain = gain
+        if not max_gain:
+            return None
+        bound = depth + -(-remaining.bit_count() // max_gain)
+        if bound >= len(best):
+            return None
+        # Ramificar sobre el elemento con menos documentos que lo cubren
+        pick, pick_count = None, None
+        rest = remaining
+        while rest:
+            low = rest & -rest
+            bit = low.bit_length() - 1
+            count = len(covering[bit])
+            if pick is None or count < pick_count:
+                pick, pick_count = bit, count
+                if count == 1:
+                    break
+            rest ^= low
+        return [remaining, still_active, covering[pick], 0]
+
+    # Búsqueda en profundidad con pila explícita: la profundidad llega al
+    # tamaño de la solución voraz, que puede superar el límite de recursión
+    chosen: list[int] = []
+    root = expand(target, docs, 0)
+    stack = [root] if root is not None else []
+    while stack:
+        if time.monotonic() > deadline:
+            return best, False
+        node = stack[-1]
+        remaining, active, branches, pos = node
+        if pos == len(branches):
+            stack.pop()
+            if stack:  # la raíz no tiene documento elegido
+                chosen.pop()
+            continue
+        node[3] = pos + 1
+        i = branches[pos]
+        chosen.append(i)
+        child = expand(remaining & ~masks[i], active, len(chosen))
+        if child is None:
+            chosen.pop()
+        else:
+            stack.append(child)
+    return best, True
+
+
+def solve_cover(requested, doc_codes, exact: bool = False,
+                time_budget: float = 2.0) -> CoverResult:
+    """
+    Resuelve la cobertura de ``requested`` con los conjuntos ``doc_codes``
+    (uno por documento, en orden de preferencia).  En modo exacto
+    ``time_budget`` acota el tiempo total; al agotarse se devuelve la mejor
+    solución encontrada con ``optimal=False``.
+    """
+    deadline = time.monotonic() + time_budget
+    problem = _Problem(requested, doc_codes)
+    target = problem.coverable
+    chosen = _lazy_greedy(problem.masks, target)
+    optimal = len(chosen) <= 1
+
+    if exact and not optimal:
+        indices, optimal = _branch_and_bound(
+            problem.masks, target, [i for i, _ in chosen], deadline,
+        )
+        # Reordenar la selección de forma voraz para repartir los códigos
+        chosen = _lazy_greedy(problem.masks, target, indices)
+
+    return CoverResult(
+        selected=[(i, problem.decode(bits)) for i, bits in chosen],
+        missing=problem.decode(problem.full & ~target),
+        optimal=optimal,
+    )
@@ -1,10 +1,33 @@
-# db.py — Conexión MySQL (compat: DB_* y MYSQL*)
+# db.py — Pool de conexiones MySQL por cliente (compat: DB_* y MYSQL*)
 import os
+import time
+import threading
+from collections import deque
+
 import pymysql
+from pymysql.constants import SERVER_STATUS
 from pymysql.cursors import DictCursor
 
-# Conexión única (suficiente para apps pequeñas en Railway)
-_CONN = None
+from utils.metrics import phase
+
+
+def _in_transaction(raw) -> bool:
+    """Si el servidor indicó en su última respuesta que hay una transacción abierta."""
+    status = getattr(raw, "server_status", None)
+    return status is None or bool(status & SERVER_STATUS.SERVER_STATUS_IN_TRANS)
+
+
+class PoolTimeout(Exception):
+    """No se liberó ninguna conexión del pool dentro del tiempo de espera."""
+
+
+class TimedDictCursor(DictCursor):
+    """``DictCursor`` que cuenta cada consulta como fase ``db`` de la petición."""
+
+    def execute(self, query, args=None):
+        with phase("db"):
+            return super().execute(query, args)
+
 
 def _env(name: str, fallback_name: str = None, default=None):
     """
@@ -15,6 +38,7 @@ def _env(name: str, fallback_name: str = None, default=None):
         val = os.getenv(fallback_name, default)
     return val if val not in ("", None) else default
 
+
 def _get_params():
     """
     Arma los parámetros de conexión aceptando:
@@ -37,7 +61,7 @@ def _get_params():
         user=user,
         password=password,
         database=database,
-        cursorclass=DictCursor,
+        cursorclass=TimedDictCursor,
         charset="utf8mb4",
         autocommit=False,
     )
@@ -45,17 +69,292 @@ def _get_params():
         params["ssl"] = ssl
     return params
 
+
+def tenant_params(config: dict) -> dict:
+    """
+    Traduce una entrada de ``tenants.json`` a parámetros de ``pymysql.connect``.
+    """
+    return dict(
+        host=config["db_host"],
+        user=config["db_user"],
+        password=config["db_pass"],
+        database=config["db_name"],
+        port=config.get("db_port", 3306),
+        charset="utf8mb4",
+        cursorclass=TimedDictCursor,
+        autocommit=True,
+        connect_timeout=15,
+    )
+
+
+def _pool_options(config: dict | None = None) -> dict:
+    """
+    Opciones del pool: primero la entrada del cliente, luego variables de entorno.
+    """
+    config = config or {}
+
+    def opt(key, env_name, default, cast):
+        val = config.get(key)
+        if val is None:
+            val = _env(env_name, default=default)
+        return cast(val)
+
+    return dict(
+        size=opt("pool_size", "DB_POOL_SIZE", 5, int),
+        max_overflow=opt("pool_max_overflow", "DB_POOL_MAX_OVERFLOW", 5, int),
+        timeout=opt("pool_timeout", "DB_POOL_TIMEOUT", 10, float),
+        max_idle=opt("pool_max_idle", "DB_POOL_MAX_IDLE", 300, float),
+        max_lifetime=opt("pool_recycle", "DB_POOL_RECYCLE", 3600, float),
+        ping_after=opt("pool_ping_after", "DB_POOL_PING_AFTER", 5, float),
+    )
+
+
+class PooledConnection:
+    """
+    Envoltorio de una conexión prestada por el pool.
+
+    Se comporta como la conexión de PyMySQL, pero ``close()`` la devuelve al
+    pool en lugar de cerrar el socket.  ``open`` indica si el préstamo sigue
+    vigente, de modo que el patrón ``if conn and conn.open: conn.close()`` de
+    los handlers siempre devuelve la conexión aunque el socket se haya roto.
+    """
+
+    def __init__(self, pool: "ConnectionPool", raw, created_at: float):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise pymysql.err.InterfaceError(0, "Conexión ya devuelta al pool")
+        return getattr(raw, name)
+
+    @property
+    def open(self) -> bool:
+        return self._raw is not None
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._release(raw, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Pool acotado y seguro entre hilos de conexiones PyMySQL.
+
+    - ``size`` conexiones se conservan ociosas; hasta ``max_overflow`` más se
+      crean bajo demanda y se cierran al devolverse.
+    - Al prestar una conexión ociosa desde hace más de ``ping_after`` segundos
+      se verifica con ``ping``; si falla, se reemplaza por una nueva.
+    - Las conexiones ociosas más de ``max_idle`` segundos o con más de
+      ``max_lifetime`` segundos de vida se descartan (MySQL las cierra por
+      ``wait_timeout`` y los proxies de Railway cortan conexiones largas).
+    """
+
+    def __init__(self, params: dict, size: int = 5, max_overflow: int = 5,
+                 timeout: float = 10, max_idle: float = 300,
+                 max_lifetime: float = 3600, ping_after: float = 5):
+        self.params = params
+        self.size = max(1, size)
+        self.max_overflow = max(0, max_overflow)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conexión, creada_en, devuelta_en)
+        self._checked_out = 0
+        self._closed = False
+        self._stats = dict(created=0, recycled=0, failed_pings=0,
+                           checkouts=0, waits=0, timeouts=0)
+
+    # --- préstamo y devolución ---
+
+    def connection(self, timeout: float | None = None) -> PooledConnection:
+        """
+        Presta una conexión. Lanza ``PoolTimeout`` si el pool está agotado.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise pymysql.err.InterfaceError(0, "El pool está cerrado")
+                item = self._pop_idle()
+                if item is not None:
+                    self._checked_out += 1
+                    self._stats["checkouts"] += 1
+                    break
+                if self._checked_out + len(self._idle) < self.size + self.max_overflow:
+                    self._checked_out += 1
+                    self._stats["checkouts"] += 1
+                    item = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"Pool agotado: {self._checked_out} conexiones en uso"
+                    )
+                self._stats["waits"] += 1
+                self._cond.wait(remaining)
+
+        # Fuera del lock: ping o conexión nueva (ambos hablan con la red)
+        try:
+            if item is not None:
+                raw, created_at, returned_at = item
+                if time.monotonic() - returned_at >= self.ping_after:
+                    try:
+                        raw.ping(reconnect=False)
+                    except Exception:
+                        with self._cond:
+                            self._stats["failed_pings"] += 1
+                        self._close_raw(raw)
+                        raw, created_at = self._connect()
+            else:
+                raw, created_at = self._connect()
+        except BaseException:
+            with self._cond:
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw, created_at)
+
+    def _pop_idle(self):
+        """Saca la conexión ociosa más reciente, descartando las caducadas."""
+        now = time.monotonic()
+        while self._idle:
+            raw, created_at, returned_at = self._idle.pop()
+            if (now - returned_at > self.max_idle
+                    or now - created_at > self.max_lifetime
+                    or not raw.open):
+                self._stats["recycled"] += 1
+                self._close_raw(raw)
+                continue
+            return raw, created_at, returned_at
+        return None
+
+    def _connect(self):
+        raw = pymysql.connect(**self.params)
+        with self._cond:
+            self._stats["created"] += 1
+        return raw, time.monotonic()
+
+    def _release(self, raw, created_at: float):
+        keep = raw.open
+        # Nunca devolver una transacción a medias (ni sus bloqueos): también
+        # con autocommit, porque los handlers abren transacciones con
+        # ``begin()``.  El estado lo trae cada respuesta del servidor, así que
+        # sin transacción abierta no se gasta otra ida y vuelta.
+        if keep and _in_transaction(raw):
+            try:
+                raw.rollback()
+            except Exception:
+                keep = False
+        with self._cond:
+            self._checked_out -= 1
+            if (keep and not self._closed and len(self._idle) < self.size
+                    and time.monotonic() - created_at <= self.max_lifetime):
+                self._idle.append((raw, created_at, time.monotonic()))
+                raw = None
+            self._cond.notify()
+        if raw is not None:
+            self._close_raw(raw)
+
+    @staticmethod
+    def _close_raw(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    # --- administración ---
+
+    def dispose(self):
+        """Cierra las conexiones ociosas y rechaza préstamos futuros."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._cond.notify_all()
+        for raw, _, _ in idle:
+            self._close_raw(raw)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return dict(
+                self._stats,
+                size=self.size,
+                max_overflow=self.max_overflow,
+                idle=len(self._idle),
+                checked_out=self._checked_out,
+            )
+
+
+# --- Registro de pools por cliente ---
+
+_POOLS: dict[str, ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+_POOLS_PID = os.getpid()
+
+
+def _pools() -> dict[str, ConnectionPool]:
+    """
+    Devuelve el registro de pools del proceso actual.
+
+    Tras un ``fork`` de gunicorn los sockets heredados pertenecen al padre:
+    se olvidan (sin cerrarlos, para no enviar COM_QUIT por un socket ajeno)
+    y cada worker crea sus propios pools.
+    """
+    global _POOLS, _POOLS_PID
+    if _POOLS_PID != os.getpid():
+        _POOLS = {}
+        _POOLS_PID = os.getpid()
+    return _POOLS
+
+
+def get_pool(key: str, params: dict, config: dict | None = None) -> ConnectionPool:
+    """
+    Devuelve (creándolo si hace falta) el pool identificado por ``key``.
+    """
+    with _POOLS_LOCK:
+        pools = _pools()
+        pool = pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(params, **_pool_options(config))
+            pools[key] = pool
+        return pool
+
+
+def get_tenant_pool(tenant_id: str, config: dict) -> ConnectionPool:
+    """Pool de la base de datos de un cliente de ``tenants.json``."""
+    return get_pool(tenant_id, tenant_params(config), config)
+
+
+def close_pool(key: str):
+    with _POOLS_LOCK:
+        pool = _pools().pop(key, None)
+    if pool is not None:
+        pool.dispose()
+
+
+def pool_stats() -> dict:
+    with _POOLS_LOCK:
+        pools = dict(_pools())
+    return {key: pool.stats() for key, pool in pools.items()}
+
+
 def get_conn():
     """
-    Devuelve una conexión viva a MySQL. Si estaba cerrada, la reabre.
-    """
-    global __CONN
-    if _CONN is None:
-        _CONN = pymysql.connect(**_get_params())
-        return _CONN
-    # Mantener viva la conexión si Railway la deja idle
-    try:
-        _CONN.ping(reconnect=True)
-    except Exception:
-        _CONN = pymysql.connect(**_get_params())
-    return _CONN
+    Presta una conexión a la base de datos configurada por variables de entorno.
+    ``close()`` la devuelve al pool.
+    """
+    return get_pool("__default__", _get_params()).connection()
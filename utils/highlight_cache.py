@@ -0,0 +1,360 @@
+# highlight_cache.py — Caché de PDFs resaltados
+#
+# Dos niveles:
+#   1. Disco local (LRU acotado por tamaño; la fecha de modificación de cada
+#      archivo marca su último uso).
+#   2. Opcionalmente un prefijo en R2, compartido entre instancias.
+#
+# La clave combina cliente, ``pdf_path``, el ETag del objeto original y los
+# códigos normalizados, de modo que editar el PDF o cambiar los códigos
+# genera otra entrada.  Un ``flock`` por clave hace de "single-flight": entre
+# hilos y entre workers del mismo equipo solo uno llama al resaltador (y
+# puede ir enviando el resultado al cliente mientras lo escribe en la caché)
+# y los demás esperan y leen su resultado.  La espera está acotada
+# (``HIGHLIGHT_CACHE_LOCK_WAIT``, 10 s): pasado el plazo la petición responde
+# ``503`` y un trabajo en segundo plano genera su resultado sin la caché.
+#
+# El tamaño ocupado se estima con lo que escribe cada proceso; el directorio
+# solo se recorre cuando la estimación pasa del tope o cada
+# ``SWEEP_INTERVAL`` (para recoger candados y temporales huérfanos).
+import os
+import time
+import fcntl
+import hashlib
+import tempfile
+import threading
+
+from utils.storage import get_s3_client
+
+LOCK_WAIT = float(os.getenv("HIGHLIGHT_CACHE_LOCK_WAIT", "10"))
+SWEEP_INTERVAL = 600
+
+
+class CacheBusy(Exception):
+    """Otra petición está generando la misma entrada y no terminó a tiempo."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("El mismo resaltado se está generando; intente de nuevo en unos segundos.")
+        self.retry_after = retry_after
+
+
+def normalize_codes(codes) -> list[str]:
+    return sorted({str(c).strip().upper() for c in codes or () if str(c).strip()})
+
+
+def cache_key(tenant_id: str, pdf_path: str, etag: str, codes) -> str:
+    raw = "\0".join([tenant_id, pdf_path, (etag or "").strip('"'), ",".join(normalize_codes(codes))])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class HighlightCache:
+    def __init__(self, directory: str, max_bytes: int, r2_prefix: str = "",
+                 bucket: str | None = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.r2_prefix = r2_prefix
+        self.bucket = bucket
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._bytes = None  # estimación de lo ocupado (None: sin medir)
+        self._next_sweep = 0.0
+        self._stats = dict(hits_local=0, hits_remote=0, misses=0, deduplicated=0,
+                           evictions=0, remote_errors=0, lock_timeouts=0, uncached=0)
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def _remote_key(self, key: str, tenant_id: str) -> str:
+        return f"{self.r2_prefix.rstrip('/')}/{tenant_id}/{key}.pdf"
+
+    # --- lectura ---
+
+    def _open_local(self, key: str):
+        """Abre la entrada local (y la marca como usada) o devuelve ``None``."""
+        path = self._path(key)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return f
+
+    def _fetch_remote(self, key: str, tenant_id: str):
+        if not self.r2_prefix:
+            return None
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        os.close(fd)
+        try:
+            get_s3_client().download_file(self.bucket, self._remote_key(key, tenant_id), tmp)
+        except Exception as e:
+            os.unlink(tmp)
+            if "404" not in str(e) and "NoSuchKey" not in str(e):
+                self._count("remote_errors")
+                print(f"Caché de resaltados: error leyendo de R2: {e}")
+            return None
+        self._store_local(key, tmp)
+        return self._open_local(key)
+
+    def lookup(self, key: str, tenant_id: str):
+        """Devuelve la entrada abierta (local o traída de R2) o ``None``."""
+        f = self._open_local(key)
+        if f is not None:
+            self._count("hits_local")
+            return f
+        f = self._fetch_remote(key, tenant_id)
+        if f is not None:
+            self._count("hits_remote")
+        return f
+
+    # --- escritura ---
+
+    def _store_local(self, key: str, tmp_path: str):
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += size
+            due = self._bytes is None or self._bytes > self.max_bytes or time.monotonic() >= self._next_sweep
+        if due:
+            self._evict()
+
+    def _store_remote(self, key: str, tenant_id: str):
+        if not self.r2_prefix:
+            return
+        try:
+            get_s3_client().upload_file(
+                self._path(key), self.bucket, self._remote_key(key, tenant_id),
+                ExtraArgs={"ContentType": "application/pdf"},
+            )
+        except Exception as e:
+            self._count("remote_errors")
+            print(f"Caché de resaltados: no se pudo guardar en R2: {e}")
+
+    def _evict(self):
+        entries = []
+        total = 0
+        stale = time.time() - 3600
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if not entry.name.endswith(".pdf"):
+                    # Candados y temporales huérfanos (ninguna generación dura una hora)
+                    if st.st_mtime < stale:
+                        self._remove_stale(entry.path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                    self._count("evictions")
+                except FileNotFoundError:
+                    pass
+                total -= size
+        with self._lock:
+            self._bytes = total
+            self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    @staticmethod
+    def _remove_stale(path: str):
+        """Borra un temporal o candado viejo; un candado que alguien tiene no se toca."""
+        if not path.endswith(".lock"):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return
+        try:
+            lock_file = open(path, "r")  # sin crearlo si ya no existe
+        except FileNotFoundError:
+            return
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return
+        try:
+            # Con el candado tomado: quien lo abra después verá que ya no es el
+            # archivo de la ruta y lo volverá a abrir (``_lock_key``)
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def _lock_key(self, key: str, wait: float | None = None):
+        """
+        Candado exclusivo de la clave.  Si lo tiene otro, reintenta hasta
+        ``wait`` segundos (``None``: sin límite) y después devuelve ``None``.
+        """
+        path = os.path.join(self.directory, f"{key}.lock")
+        deadline = None if wait is None else time.monotonic() + wait
+        delay = 0.05
+        while True:
+            lock_file = open(path, "a")
+            try:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lock_file.close()
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    time.sleep(delay if remaining is None else min(delay, remaining))
+                    delay = min(delay * 2, 0.5)
+                    continue
+                try:
+                    same = os.fstat(lock_file.fileno()).st_ino == os.stat(path).st_ino
+                except FileNotFoundError:
+                    same = False
+            except BaseException:
+                lock_file.close()
+                raise
+            if same:
+                return lock_file
+            # ``_evict`` lo borró mientras esperábamos: este inodo ya no sirve
+            lock_file.close()
+
+    def open_or_lock(self, key: str, tenant_id: str, wait: float = LOCK_WAIT):
+        """
+        Devuelve ``(archivo abierto, None)`` en un acierto o ``(None, CacheFill)``
+        en un fallo.  El ``CacheFill`` tiene el candado de la clave: las
+        peticiones idénticas concurrentes esperan hasta su ``commit()`` o
+        ``abort()`` (como mucho ``wait`` segundos; después ``CacheBusy``) y
+        entonces leen el resultado.
+        """
+        f = self.lookup(key, tenant_id)
+        if f is not None:
+            return f, None
+        lock_file = self._lock_key(key, wait)
+        if lock_file is None:
+            self._count("lock_timeouts")
+            raise CacheBusy(max(1, int(wait)))
+        try:
+            # Otro hilo o worker pudo generarla mientras esperábamos el candado
+            f = self._open_local(key)
+        except BaseException:
+            lock_file.close()
+            raise
+        if f is not None:
+            lock_file.close()
+            self._count("deduplicated")
+            return f, None
+        self._count("misses")
+        return None, CacheFill(self, key, tenant_id, lock_file)
+
+    def get_or_create(self, key: str, tenant_id: str, create, wait: float = LOCK_WAIT):
+        """
+        Devuelve ``(archivo abierto, hit)``.  En un fallo llama a
+        ``create(salida)``, que debe escribir el PDF resaltado en el archivo
+        binario ``salida``.  Si otro lleva demasiado generando la misma
+        entrada, el resultado se genera aparte, sin guardarlo.
+        """
+        try:
+            f, fill = self.open_or_lock(key, tenant_id, wait)
+        except CacheBusy:
+            self._count("uncached")
+            fill = CacheFill(self, key, tenant_id, None)
+        if fill is None:
+            return f, True
+        try:
+            create(fill)
+        except BaseException:
+            fill.abort()
+            raise
+        return fill.commit(), False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, directory=self.directory, max_bytes=self.max_bytes, bytes=self._bytes,
+                        r2_prefix=self.r2_prefix or None)
+
+
+class CacheFill:
+    """
+    Entrada en construcción: archivo temporal + candado de la clave.  Sin
+    candado (``lock_file=None``) es un resultado privado que no se publica.
+    """
+
+    def __init__(self, cache: HighlightCache, key: str, tenant_id: str, lock_file):
+        self.cache = cache
+        self.key = key
+        self.tenant_id = tenant_id
+        self._lock_file = lock_file
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.directory, suffix=".part")
+        self._out = os.fdopen(fd, "wb")
+        self._done = False
+
+    def write(self, chunk: bytes):
+        self._out.write(chunk)
+
+    def _release(self):
+        self._done = True
+        self._out.close()
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+
+    def commit(self):
+        """Publica la entrada y devuelve un archivo abierto para leerla."""
+        if self._done:
+            return None
+        try:
+            self._out.close()
+            # Abrir antes de publicar: la entrada podría desalojarse enseguida
+            f = open(self.tmp_path, "rb")
+            if self._lock_file is None:
+                os.unlink(self.tmp_path)  # el archivo abierto sigue legible
+            else:
+                self.cache._store_local(self.key, self.tmp_path)
+                self.cache._store_remote(self.key, self.tenant_id)
+        finally:
+            self._release()
+        return f
+
+    def abort(self):
+        if self._done:
+            return
+        self._release()
+        try:
+            os.unlink(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_highlight_cache() -> HighlightCache:
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = HighlightCache(
+                    directory=os.getenv("HIGHLIGHT_CACHE_DIR")
+                    or os.path.join(tempfile.gettempdir(), "gestor-doc-resaltados"),
+                    max_bytes=int(float(os.getenv("HIGHLIGHT_CACHE_MAX_MB", "512")) * 1024 * 1024),
+                    r2_prefix=os.getenv("HIGHLIGHT_CACHE_R2_PREFIX", ""),
+                    bucket=os.getenv("R2_BUCKET_NAME"),
+                )
+    return _CACHE
+
+
+def cache_stats() -> dict | None:
+    return _CACHE.stats() if _CACHE is not None else None
@@ -0,0 +1,191 @@
+# highlight_jobs.py — Cola de trabajos de resaltado en segundo plano
+#
+# Un resaltado puede tardar hasta 180 s; hacerlo dentro de la petición deja
+# un worker de gunicorn bloqueado todo ese tiempo.  Aquí los trabajos se
+# encolan por cliente y un número fijo de hilos (el tope de concurrencia
+# hacia el resaltador) los atiende por turnos entre clientes, de modo que
+# uno con muchos trabajos no retrasa indefinidamente a los demás.
+#
+# El id del trabajo es la clave de la caché de resaltados: dos peticiones
+# idénticas comparten trabajo, y el resultado se sirve desde la caché.
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+
+PENDING = "pendiente"
+RUNNING = "en_proceso"
+DONE = "completado"
+FAILED = "error"
+
+
+class QueueFull(Exception):
+    """El cliente ya tiene demasiados trabajos en cola."""
+
+
+class Job:
+    def __init__(self, job_id: str, tenant_id: str, pdf_path: str, run):
+        self.id = job_id
+        self.tenant_id = tenant_id
+        self.pdf_path = pdf_path
+        self.status = PENDING
+        self.error = None
+        self.error_status = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._run = run
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "estado": self.status,
+            "pdf_path": self.pdf_path,
+            "error": self.error,
+            "creado": self.created_at,
+            "iniciado": self.started_at,
+            "terminado": self.finished_at,
+        }
+
+
+class HighlightJobQueue:
+    def __init__(self, workers: int = 2, max_queued_per_tenant: int = 20,
+                 result_ttl: float = 3600):
+        self.workers = max(1, workers)
+        self.max_queued_per_tenant = max_queued_per_tenant
+        self.result_ttl = result_ttl
+        self._cond = threading.Condition()
+        self._jobs: dict[str, Job] = {}
+        self._queues: OrderedDict[str, deque] = OrderedDict()  # turno rotatorio por cliente
+        self._threads: list[threading.Thread] = []
+        self._pid = None
+        self._stats = dict(submitted=0, deduplicated=0, rejected=0, completed=0, failed=0)
+
+    def _ensure_workers(self):
+        # Los hilos no sobreviven al fork de gunicorn: arrancarlos en cada worker
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._threads = []
+        for n in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"resaltado-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, job_id: str, tenant_id: str, pdf_path: str, run) -> Job:
+        """
+        Encola ``run()`` (o devuelve el trabajo idéntico ya existente).
+        ``run`` debe dejar el resultado en la caché de resaltados.
+        """
+        with self._cond:
+            self._ensure_workers()
+            self._expire_locked()
+            job = self._jobs.get(job_id)
+            if job is not None and job.status != FAILED:
+                self._stats["deduplicated"] += 1
+                return job
+            queue = self._queues.get(tenant_id)
+            if queue is not None and len(queue) >= self.max_queued_per_tenant:
+                self._stats["rejected"] += 1
+                raise QueueFull(f"Demasiados resaltados en cola para '{tenant_id}'")
+            job = Job(job_id, tenant_id, pdf_path, run)
+            self._jobs[job_id] = job
+            self._queues.setdefault(tenant_id, deque()).append(job)
+            self._stats["submitted"] += 1
+            self._cond.notify()
+            return job
+
+    def completed(self, job_id: str, tenant_id: str, pdf_path: str) -> Job:
+        """Registra como terminado un trabajo cuyo resultado ya estaba en caché."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.status == FAILED:
+                job = Job(job_id, tenant_id, pdf_path, None)
+                job.status = DONE
+                job.finished_at = job.created_at
+                self._jobs[job_id] = job
+            return job
+
+    def get(self, job_id: str, tenant_id: str) -> Job | None:
+        with self._cond:
+            self._expire_locked()
+            job = self._jobs.get(job_id)
+            if job is None or job.tenant_id != tenant_id:
+                return None
+            return job
+
+    def _expire_locked(self):
+        limit = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < limit]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _next_locked(self) -> Job | None:
+        for tenant_id in list(self._queues):
+            queue = self._queues.pop(tenant_id)
+            job = queue.popleft() if queue else None
+            if queue:
+                self._queues[tenant_id] = queue  # al final: turno para el siguiente cliente
+            if job is not None:
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_locked()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_locked()
+                job.status = RUNNING
+                job.started_at = time.time()
+            try:
+                job._run()
+            except Exception as e:
+                print(f"Error en el trabajo de resaltado {job.id}: {e}")
+                with self._cond:
+                    job.status = FAILED
+                    job.error = str(e) or e.__class__.__name__
+                    job.error_status = getattr(e, "status", None)
+                    job.finished_at = time.time()
+                    self._stats["failed"] += 1
+            else:
+                with self._cond:
+                    job.status = DONE
+                    job.finished_at = time.time()
+                    self._stats["completed"] += 1
+            job._run = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            by_status = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            return dict(
+                self._stats,
+                workers=self.workers,
+                queued={tenant_id: len(q) for tenant_id, q in self._queues.items() if q},
+                jobs=by_status,
+            )
+
+
+_QUEUE = None
+_QUEUE_LOCK = threading.Lock()
+
+
+def get_job_queue() -> HighlightJobQueue:
+    global _QUEUE
+    if _QUEUE is None:
+        with _QUEUE_LOCK:
+            if _QUEUE is None:
+                _QUEUE = HighlightJobQueue(
+                    workers=int(os.getenv("HIGHLIGHT_JOB_WORKERS", "2")),
+                    max_queued_per_tenant=int(os.getenv("HIGHLIGHT_JOB_MAX_QUEUED", "20")),
+                    result_ttl=float(os.getenv("HIGHLIGHT_JOB_TTL", "3600")),
+                )
+    return _QUEUE
+
+
+def job_stats() -> dict | None:
+    return _QUEUE.stats() if _QUEUE is not None else None
@@ -0,0 +1,204 @@
+# highlighter.py — Cliente HTTP del servicio de resaltado con circuit breaker
+#
+# ``requests.post``/``requests.get`` a nivel de módulo abren una conexión
+# nueva (TCP + TLS) en cada llamada.  Aquí una ``requests.Session`` por
+# proceso mantiene un pool de conexiones vivas hacia el resaltador, con
+# timeouts de conexión y de lectura separados y reintentos solo en la
+# descarga (GET, idempotente).
+#
+# El circuit breaker mira las últimas llamadas: si la proporción de fallos
+# (errores de red, timeouts, 5xx) supera el umbral, se abre y las peticiones
+# fallan al instante con ``HighlighterUnavailable`` (503) en lugar de esperar
+# al timeout.  Pasado ``HIGHLIGHTER_BREAKER_OPEN_SECONDS`` deja pasar una
+# única petición de prueba (semiabierto): si va bien se cierra, si no vuelve
+# a abrirse.
+#
+# ``requests`` se importa al crear la sesión (primer resaltado), no al
+# arrancar el worker.
+import os
+import sys
+import time
+import threading
+from collections import deque
+
+CLOSED = "cerrado"
+OPEN = "abierto"
+HALF_OPEN = "semiabierto"
+
+
+class HighlighterUnavailable(Exception):
+    """El circuito está abierto: el resaltador falla y no se le envían peticiones."""
+
+    status = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, window: int = 20, min_calls: int = 5, failure_ratio: float = 0.5,
+                 open_seconds: float = 30):
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes: deque = deque(maxlen=window)  # True = fallo
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = dict(successes=0, failures=0, rejected=0, opened=0)
+
+    def before_call(self):
+        """Lanza ``HighlighterUnavailable`` si la llamada no debe hacerse."""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            remaining = self._opened_at + self.open_seconds - time.monotonic()
+            if self._state == OPEN and remaining <= 0:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True  # esta llamada es la prueba
+                return
+            self._stats["rejected"] += 1
+        raise HighlighterUnavailable(
+            "El servicio de resaltado no responde; intente de nuevo en unos segundos.",
+            max(1, int(remaining + 0.999)),
+        )
+
+    def record(self, failed: bool):
+        with self._lock:
+            self._stats["failures" if failed else "successes"] += 1
+            if self._state == HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._open_locked()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append(failed)
+            if (self._state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) / len(self._outcomes) >= self.failure_ratio):
+                self._open_locked()
+
+    def _open_locked(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._stats["opened"] += 1
+        print(f"Resaltador: circuito abierto durante {self.open_seconds:.0f}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            state = self._state
+            if state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                state = HALF_OPEN
+            return dict(
+                self._stats,
+                state=state,
+                window_calls=len(self._outcomes),
+                window_failures=sum(self._outcomes),
+            )
+
+
+class HighlighterClient:
+    def __init__(self, pool_size: int = 10, connect_timeout: float = 5, read_timeout: float = 180,
+                 get_retries: int = 2, breaker: CircuitBreaker | None = None):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.get_retries = get_retries
+        self.breaker = breaker or CircuitBreaker()
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    def _build_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        # Reintentos de urllib3 solo para GET; un POST solo se repite si no
+        # llegó a conectar (la petición no salió)
+        retry = Retry(
+            total=self.get_retries, connect=self.get_retries, read=self.get_retries,
+            status=self.get_retries, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}), raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @property
+    def session(self):
+        # Las conexiones abiertas no sobreviven al fork de gunicorn
+        if self._session is None or self._session_pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    self._session = self._build_session()
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def ensure_available(self):
+        """Falla enseguida si el circuito está abierto (sin gastar la prueba)."""
+        stats = self.breaker.stats()
+        if stats["state"] == OPEN:
+            self.breaker.before_call()
+
+    def request(self, method: str, url: str, **kwargs):
+        self.breaker.before_call()
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except BaseException:
+            # Cualquier fallo cuenta, también para liberar la prueba del semiabierto
+            self.breaker.record(True)
+            raise
+        self.breaker.record(resp.status_code >= 500)
+        return resp
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def stats(self) -> dict:
+        return dict(self.breaker.stats(), pool_size=self.pool_size,
+                    connect_timeout=self.timeout[0], read_timeout=self.timeout[1])
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_highlighter() -> HighlighterClient:
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = HighlighterClient(
+                    pool_size=int(os.getenv("HIGHLIGHTER_POOL_SIZE", "10")),
+                    connect_timeout=float(os.getenv("HIGHLIGHTER_CONNECT_TIMEOUT", "5")),
+                    read_timeout=float(os.getenv("HIGHLIGHTER_READ_TIMEOUT", "180")),
+                    get_retries=int(os.getenv("HIGHLIGHTER_GET_RETRIES", "2")),
+                    breaker=CircuitBreaker(
+                        window=int(os.getenv("HIGHLIGHTER_BREAKER_WINDOW", "20")),
+                        min_calls=int(os.getenv("HIGHLIGHTER_BREAKER_MIN_CALLS", "5")),
+                        failure_ratio=float(os.getenv("HIGHLIGHTER_BREAKER_FAILURE_RATIO", "0.5")),
+                        open_seconds=float(os.getenv("HIGHLIGHTER_BREAKER_OPEN_SECONDS", "30")),
+                    ),
+                )
+    return _CLIENT
+
+
+def is_request_error(exc: BaseException) -> bool:
+    """``True`` si ``exc`` es un error de ``requests`` (sin importarlo si nadie lo ha usado)."""
+    requests = sys.modules.get("requests")
+    return requests is not None and isinstance(exc, requests.exceptions.RequestException)
+
+
+def highlighter_stats() -> dict | None:
+    return _CLIENT.stats() if _CLIENT is not None else None
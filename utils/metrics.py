@@ -0,0 +1,291 @@
+# metrics.py — Tiempos por fase, cabecera Server-Timing y métricas Prometheus
+#
+# Cada petición de ``documentos_bp`` acumula en ``g`` el tiempo gastado en
+# cada fase (``db_connect``, ``db``, ``s3``, ``highlighter``, ``json``...).
+# Al responder se añade ``Server-Timing`` y, cuando termina de enviarse el
+# cuerpo (también en respuestas en streaming), la duración total entra en un
+# histograma por (cliente, ruta, método) y se registra en el log de
+# peticiones lentas si supera ``METRICS_SLOW_MS``.
+#
+# Cada worker de gunicorn vuelca sus contadores a ``metrics-<pid>.json`` en
+# ``METRICS_DIR``; ``/api/metrics`` suma los de todos los workers (también
+# los de workers ya reciclados, para que los contadores no retrocedan).
+import os
+import json
+import time
+import atexit
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_requests: dict[tuple, list] = {}   # (tenant, route, method, status) → [buckets..., sum, count]
+_phases: dict[tuple, list] = {}     # (tenant, route, phase) → [segundos, llamadas]
+_admission: dict[tuple, int] = {}   # (tenant, clase de ruta, resultado) → peticiones
+_last_flush = 0.0
+_dir_pid = None
+_dir = None
+
+
+def _slow_seconds() -> float:
+    return float(os.getenv("METRICS_SLOW_MS", "1000")) / 1000
+
+
+def _flush_interval() -> float:
+    return float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+
+# --- Fases ---
+
+def record(name: str, seconds: float):
+    """Suma ``seconds`` a la fase ``name`` de la petición en curso (si la hay)."""
+    if not has_request_context():
+        return
+    timings = g.get("_timings")
+    if timings is None:
+        return
+    entry = timings.get(name)
+    if entry is None:
+        timings[name] = [seconds, 1]
+    else:
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Cronometra el bloque como fase ``name``.  Las fases anidadas con el mismo
+    nombre (p. ej. ``executemany`` que llama a ``execute``) cuentan una vez.
+    """
+    active = g.get("_phases_active") if has_request_context() else None
+    if active is None or name in active:
+        yield
+        return
+    active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.discard(name)
+        record(name, time.perf_counter() - started)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask que cuenta la serialización como fase ``json``."""
+
+    def dumps(self, obj, **kwargs):
+        with phase("json"):
+            return super().dumps(obj, **kwargs)
+
+
+def instrument_s3_client(client):
+    """Registra en el cliente de boto3 la fase ``s3`` de cada llamada a la API."""
+
+    def before(context=None, **kwargs):
+        if context is not None:
+            context["_metrics_started"] = time.perf_counter()
+
+    def after(context=None, **kwargs):
+        started = (context or {}).get("_metrics_started")
+        if started is not None:
+            record("s3", time.perf_counter() - started)
+
+    client.meta.events.register("before-call.s3", before)
+    client.meta.events.register("after-call.s3", after)
+    return client
+
+
+# --- Ciclo de la petición ---
+
+def start_request():
+    g._request_started = time.perf_counter()
+    g._timings = {}
+    g._phases_active = set()
+
+
+def finish_request(response):
+    """``after_request``: añade ``Server-Timing`` y programa la observación final."""
+    started = g.get("_request_started")
+    if started is None:
+        return response
+    timings = g._timings
+    elapsed = time.perf_counter() - started
+    parts = []
+    for name, (seconds, calls) in timings.items():
+        desc = f';desc="{calls}x"' if calls > 1 else ""
+        parts.append(f"{name}{desc};dur={seconds * 1000:.1f}")
+    parts.append(f"app;dur={elapsed * 1000:.1f}")
+    response.headers["Server-Timing"] = ", ".join(parts)
+
+    # La observación se hace al cerrar la respuesta para incluir el envío del
+    # cuerpo en streaming; ``g`` ya no existe entonces, se captura aquí.
+    labels = (
+        g.get("tenant_id") or "-",
+        request.url_rule.rule if request.url_rule is not None else "-",
+        request.method,
+        str(response.status_code),
+    )
+    path = request.path
+    response.call_on_close(lambda: _observe(labels, path, started, timings))
+    return response
+
+
+def _observe(labels: tuple, path: str, started: float, timings: dict):
+    elapsed = time.perf_counter() - started
+    tenant, route, method, status = labels
+    with _lock:
+        series = _requests.get(labels)
+        if series is None:
+            series = _requests[labels] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                series[i] += 1
+        series[-2] += elapsed
+        series[-1] += 1
+        for name, (seconds, calls) in timings.items():
+            acc = _phases.setdefault((tenant, route, name), [0.0, 0])
+            acc[0] += seconds
+            acc[1] += calls
+    if elapsed >= _slow_seconds():
+        detail = " ".join(f"{name}={seconds * 1000:.0f}ms/{calls}"
+                          for name, (seconds, calls) in sorted(timings.items()))
+        print(f"Petición lenta: {method} {path} cliente={tenant} estado={status} "
+              f"total={elapsed * 1000:.0f}ms {detail}".rstrip())
+    if time.monotonic() - _last_flush >= _flush_interval():
+        flush()
+
+
+def count_admission(tenant: str, route_class: str, outcome: str):
+    """Cuenta una decisión del control de admisión (``utils/admission.py``)."""
+    with _lock:
+        key = (tenant, route_class, outcome)
+        _admission[key] = _admission.get(key, 0) + 1
+
+
+# --- Volcado entre workers ---
+
+def _metrics_dir() -> str | None:
+    global _dir, _dir_pid
+    if _dir_pid != os.getpid():
+        # En gunicorn el padre de los workers es el máster: un directorio por despliegue
+        directory = os.getenv("METRICS_DIR") or os.path.join(
+            tempfile.gettempdir(), f"gestor-doc-metrics-{os.getppid()}"
+        )
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            print(f"Métricas: no se puede usar {directory}: {e}")
+            directory = None
+        _dir, _dir_pid = directory, os.getpid()
+    return _dir
+
+
+def _snapshot() -> dict:
+    with _lock:
+        return {
+            "requests": [list(k) + [list(v)] for k, v in _requests.items()],
+            "phases": [list(k) + [list(v)] for k, v in _phases.items()],
+            "admission": [list(k) + [v] for k, v in _admission.items()],
+        }
+
+
+def flush():
+    """Escribe los contadores de este worker en su archivo (reemplazo atómico)."""
+    global _last_flush
+    _last_flush = time.monotonic()
+    if not _requests:
+        return  # p. ej. el máster de gunicorn al salir
+    directory = _metrics_dir()
+    if directory is None:
+        return
+    path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(_snapshot(), f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Métricas: no se pudo volcar {path}: {e}")
+
+
+atexit.register(flush)
+
+
+def _collect() -> tuple[dict, dict, dict]:
+    """Suma los volcados de todos los workers (el propio, en vivo)."""
+    snapshots = [_snapshot()]
+    directory = _metrics_dir()
+    own = f"metrics-{os.getpid()}.json"
+    if directory is not None:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name == own or not entry.name.endswith(".json"):
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+    requests_total: dict[tuple, list] = {}
+    phases_total: dict[tuple, list] = {}
+    admission_total: dict[tuple, int] = {}
+    for snap in snapshots:
+        for *labels, values in snap.get("requests", ()):
+            acc = requests_total.setdefault(tuple(labels), [0] * len(values))
+            for i, v in enumerate(values):
+                acc[i] += v
+        for *labels, values in snap.get("phases", ()):
+            acc = phases_total.setdefault(tuple(labels), [0.0, 0])
+            acc[0] += values[0]
+            acc[1] += values[1]
+        for *labels, value in snap.get("admission", ()):
+            admission_total[tuple(labels)] = admission_total.get(tuple(labels), 0) + value
+    return requests_total, phases_total, admission_total
+
+
+def _label_str(**labels) -> str:
+    def esc(value: str) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{k}="{esc(v)}"' for k, v in labels.items())
+
+
+def render_prometheus() -> str:
+    """Formato de texto de Prometheus (0.0.4)."""
+    requests_total, phases_total, admission_total = _collect()
+    lines = [
+        "# HELP gestor_request_duration_seconds Duración de las peticiones, incluido el envío del cuerpo.",
+        "# TYPE gestor_request_duration_seconds histogram",
+    ]
+    for (tenant, route, method, status), values in sorted(requests_total.items()):
+        base = _label_str(tenant=tenant, route=route, method=method, status=status)
+        # Los buckets ya son acumulativos (se cuenta cada ``elapsed <= bound``)
+        for bound, count in zip(BUCKETS, values):
+            lines.append(f'gestor_request_duration_seconds_bucket{{{base},le="{bound}"}} {count}')
+        lines.append(f'gestor_request_duration_seconds_bucket{{{base},le="+Inf"}} {values[-1]}')
+        lines.append(f"gestor_request_duration_seconds_sum{{{base}}} {values[-2]:.6f}")
+        lines.append(f"gestor_request_duration_seconds_count{{{base}}} {values[-1]}")
+    lines += [
+        "# HELP gestor_phase_seconds_total Tiempo acumulado por fase (db_connect, db, s3, highlighter, json...).",
+        "# TYPE gestor_phase_seconds_total counter",
+    ]
+    for (tenant, route, name), (seconds, _) in sorted(phases_total.items()):
+        lines.append(f"gestor_phase_seconds_total{{{_label_str(tenant=tenant, route=route, phase=name)}}} {seconds:.6f}")
+    lines += [
+        "# HELP gestor_phase_calls_total Número de operaciones por fase.",
+        "# TYPE gestor_phase_calls_total counter",
+    ]
+    for (tenant, route, name), (_, calls) in sorted(phases_total.items()):
+        lines.append(f"gestor_phase_calls_total{{{_label_str(tenant=tenant, route=route, phase=name)}}} {calls}")
+    lines += [
+        "# HELP gestor_admission_total Decisiones del control de admisión por cliente y clase de ruta.",
+        "# TYPE gestor_admission_total counter",
+    ]
+    for (tenant, route_class, outcome), value in sorted(admission_total.items()):
+        lines.append(f"gestor_admission_total{{{_label_str(tenant=tenant, route_class=route_class, outcome=outcome)}}} {value}")
+    return "\n".join(lines) + "\n"
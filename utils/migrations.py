@@ -0,0 +1,361 @@
+# migrations.py — Migraciones versionadas del esquema de cada cliente
+#
+# Uso:
+#   python -m utils.migrations status              # versión de cada cliente
+#   python -m utils.migrations upgrade             # aplica las pendientes
+#   python -m utils.migrations upgrade --tenant Cliente-Kino
+#
+# Cada migración es idempotente (consulta ``information_schema`` antes de
+# cambiar nada), porque en MySQL el DDL hace commit implícito y una
+# migración interrumpida puede quedar a medias; volver a ejecutarla la
+# completa.  La versión aplicada se guarda en ``schema_migrations``.
+import sys
+import time
+import argparse
+
+import pymysql
+
+from utils.db import tenant_params
+from utils.tenants import TenantConfigError, load_tenants
+
+BATCH_SIZE = 5000
+
+
+# --- Utilidades de introspección ---
+
+def _column_exists(cur, table: str, column: str) -> bool:
+    cur.execute(
+        "SELECT 1 FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+        (table, column),
+    )
+    return cur.fetchone() is not None
+
+
+def _index_exists(cur, table: str, index: str) -> bool:
+    cur.execute(
+        "SELECT 1 FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+        (table, index),
+    )
+    return cur.fetchone() is not None
+
+
+def _constraint_exists(cur, table: str, name: str) -> bool:
+    cur.execute(
+        "SELECT 1 FROM information_schema.TABLE_CONSTRAINTS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_NAME = %s",
+        (table, name),
+    )
+    return cur.fetchone() is not None
+
+
+def _delete_in_batches(cur, select_ids_sql: str, table: str) -> int:
+    """Borra por lotes las filas cuyos ids devuelve ``select_ids_sql`` (con LIMIT)."""
+    total = 0
+    while True:
+        cur.execute(select_ids_sql, (BATCH_SIZE,))
+        ids = [row["id"] for row in cur.fetchall()]
+        if not ids:
+            return total
+        placeholders = ",".join(["%s"] * len(ids))
+        cur.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+        total += len(ids)
+
+
+# --- Migraciones ---
+
+def m001_tablas_base(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS documents (
+            id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            date DATE NOT NULL,
+            path VARCHAR(512) NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS codes (
+            id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            document_id INT NOT NULL,
+            code VARCHAR(191) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+
+
+def m002_id_en_codes(cur):
+    """``codes`` necesita un id propio para limpiar duplicados por lotes."""
+    if _column_exists(cur, "codes", "id"):
+        return
+    cur.execute(
+        "SELECT 1 FROM information_schema.TABLE_CONSTRAINTS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'codes' AND CONSTRAINT_TYPE = 'PRIMARY KEY'"
+    )
+    if cur.fetchone() is None:
+        cur.execute("ALTER TABLE codes ADD COLUMN id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY FIRST")
+    else:
+        cur.execute("ALTER TABLE codes ADD COLUMN id BIGINT NOT NULL AUTO_INCREMENT UNIQUE FIRST")
+
+
+def _backfill_code_norm(cur):
+    while True:
+        cur.execute(
+            "UPDATE codes SET code_norm = UPPER(TRIM(code)) WHERE code_norm IS NULL LIMIT %s",
+            (BATCH_SIZE,),
+        )
+        if cur.rowcount == 0:
+            break
+
+
+def _delete_orphans_and_duplicates(cur):
+    _delete_in_batches(
+        cur,
+        "SELECT c.id FROM codes c LEFT JOIN documents d ON d.id = c.document_id "
+        "WHERE d.id IS NULL LIMIT %s",
+        "codes",
+    )
+    _delete_in_batches(
+        cur,
+        "SELECT c1.id FROM codes c1 JOIN codes c2 "
+        "ON c1.document_id = c2.document_id AND c1.code_norm = c2.code_norm AND c1.id > c2.id "
+        "LIMIT %s",
+        "codes",
+    )
+
+
+def _prepare_codes(cur):
+    """Rellena ``code_norm`` y quita huérfanos y duplicados (lo que necesitan las restricciones)."""
+    _backfill_code_norm(cur)
+    _delete_orphans_and_duplicates(cur)
+
+
+def m003_code_norm(cur):
+    """Columna normalizada (``UPPER(TRIM(code))``) rellenada por lotes."""
+    if not _column_exists(cur, "codes", "code_norm"):
+        cur.execute("ALTER TABLE codes ADD COLUMN code_norm VARCHAR(191) NULL AFTER code")
+    _backfill_code_norm(cur)
+
+
+def m004_limpieza(cur):
+    """Quita códigos huérfanos y duplicados antes de crear las restricciones."""
+    # El índice por documento evita que la autocombinación recorra la tabla entera
+    if not _index_exists(cur, "codes", "idx_codes_document"):
+        cur.execute("ALTER TABLE codes ADD INDEX idx_codes_document (document_id)")
+    _delete_orphans_and_duplicates(cur)
+
+
+def m005_indices(cur):
+    # La versión anterior de la aplicación pudo escribir entre 3/4 y esta
+    # migración (``code_norm`` NULL, duplicados, huérfanos): se repiten el
+    # relleno y la limpieza justo antes de las restricciones.  Si aun así un
+    # ALTER falla por una escritura concurrente, volver a ejecutarla lo completa.
+    _prepare_codes(cur)
+    cur.execute("ALTER TABLE codes MODIFY code_norm VARCHAR(191) NOT NULL")
+    if not _index_exists(cur, "codes", "uq_codes_norm_document"):
+        cur.execute("ALTER TABLE codes ADD UNIQUE INDEX uq_codes_norm_document (code_norm, document_id)")
+    if not _index_exists(cur, "documents", "idx_documents_date"):
+        cur.execute("ALTER TABLE documents ADD INDEX idx_documents_date (date)")
+    if not _index_exists(cur, "documents", "idx_documents_name"):
+        cur.execute("ALTER TABLE documents ADD INDEX idx_documents_name (name)")
+    if not _constraint_exists(cur, "codes", "fk_codes_document"):
+        cur.execute(
+            "ALTER TABLE codes ADD CONSTRAINT fk_codes_document FOREIGN KEY (document_id) "
+            "REFERENCES documents (id) ON DELETE CASCADE"
+        )
+
+
+def m006_extraccion(cur):
+    """Estado de la extracción automática de códigos y páginas de cada código."""
+    if not _column_exists(cur, "documents", "extraction_status"):
+        cur.execute("ALTER TABLE documents ADD COLUMN extraction_status VARCHAR(16) NULL")
+    if not _column_exists(cur, "documents", "extraction_error"):
+        cur.execute("ALTER TABLE documents ADD COLUMN extraction_error VARCHAR(255) NULL")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS code_pages (
+            document_id INT NOT NULL,
+            code_norm VARCHAR(191) NOT NULL,
+            page INT NOT NULL,
+            PRIMARY KEY (document_id, code_norm, page),
+            CONSTRAINT fk_code_pages_document FOREIGN KEY (document_id)
+                REFERENCES documents (id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+
+
+def m007_texto(cur):
+    """Texto de cada página con índice FULLTEXT para la búsqueda por contenido."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS document_texts (
+            document_id INT NOT NULL,
+            page INT NOT NULL,
+            content MEDIUMTEXT NOT NULL,
+            PRIMARY KEY (document_id, page),
+            FULLTEXT KEY ft_document_texts_content (content),
+            CONSTRAINT fk_document_texts_document FOREIGN KEY (document_id)
+                REFERENCES documents (id) ON DELETE CASCADE
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+
+
+def m008_borrados_pendientes(cur):
+    """Cola de objetos de R2 que no se pudieron borrar (``utils/r2_cleanup.py``)."""
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pending_object_deletes (
+            object_key VARCHAR(512) NOT NULL PRIMARY KEY,
+            attempts INT NOT NULL DEFAULT 0,
+            last_error VARCHAR(255) NULL,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_pending_object_deletes_next (next_attempt_at)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+
+
+def m009_referencias_objetos(cur):
+    """
+    Contador de referencias por objeto de R2 (``utils/object_store.py``),
+    rellenado con las claves que usan hoy los documentos.
+    """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS object_refs (
+            object_key VARCHAR(512) NOT NULL PRIMARY KEY,
+            sha256 CHAR(64) NULL,
+            size BIGINT NULL,
+            refcount INT NOT NULL DEFAULT 0,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+    cur.execute(
+        """
+        INSERT INTO object_refs (object_key, refcount)
+        SELECT path, COUNT(*) FROM documents WHERE path IS NOT NULL AND path <> '' GROUP BY path
+        ON DUPLICATE KEY UPDATE refcount = VALUES(refcount)
+        """
+    )
+
+
+def m010_borrado_en_curso(cur):
+    """Marca de borrado en curso en ``object_refs`` (``utils/r2_cleanup.py``)."""
+    if not _column_exists(cur, "object_refs", "deleting_since"):
+        cur.execute("ALTER TABLE object_refs ADD COLUMN deleting_since DATETIME NULL")
+
+
+MIGRATIONS = [
+    (1, "Tablas base documents y codes", m001_tablas_base),
+    (2, "Id propio en codes", m002_id_en_codes),
+    (3, "Columna codes.code_norm y relleno por lotes", m003_code_norm),
+    (4, "Limpieza de códigos huérfanos y duplicados", m004_limpieza),
+    (5, "Índices, unicidad (code_norm, document_id) y FK con ON DELETE CASCADE", m005_indices),
+    (6, "Estado de extracción en documents y tabla code_pages", m006_extraccion),
+    (7, "Tabla document_texts con índice FULLTEXT", m007_texto),
+    (8, "Cola de borrados pendientes en R2", m008_borrados_pendientes),
+    (9, "Tabla object_refs con las referencias de cada objeto de R2", m009_referencias_objetos),
+    (10, "Columna object_refs.deleting_since (borrado en curso)", m010_borrado_en_curso),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+# --- Ejecución ---
+
+def _ensure_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT NOT NULL PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """
+    )
+
+
+def current_version(cur) -> int:
+    _ensure_table(cur)
+    cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations")
+    return cur.fetchone()["version"]
+
+
+def upgrade(conn, log=print) -> int:
+    """Aplica las migraciones pendientes; devuelve la versión final."""
+    with conn.cursor() as cur:
+        version = current_version(cur)
+        for number, description, migrate in MIGRATIONS:
+            if number <= version:
+                continue
+            started = time.monotonic()
+            log(f"  -> {number:03d} {description}")
+            migrate(cur)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (number, description),
+            )
+            log(f"     ok ({time.monotonic() - started:.1f}s)")
+            version = number
+    return version
+
+
+def _connect(config: dict):
+    params = tenant_params(config)
+    params["autocommit"] = True  # cada lote del relleno se confirma por separado
+    return pymysql.connect(**params)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de cada cliente")
+    parser.add_argument("command", choices=["status", "upgrade"])
+    parser.add_argument("--tenant", help="solo este cliente")
+    parser.add_argument("--tenants-file", help="por defecto TENANTS_JSON o TENANTS_FILE, como la aplicación")
+    args = parser.parse_args(argv)
+
+    try:
+        tenants = load_tenants(args.tenants_file)
+    except TenantConfigError as e:
+        print(e)
+        return 2
+    if args.tenant:
+        if args.tenant not in tenants:
+            print(f"Cliente desconocido: {args.tenant}")
+            return 2
+        tenants = {args.tenant: tenants[args.tenant]}
+
+    failed = False
+    for tenant_id, config in tenants.items():
+        try:
+            conn = _connect(config)
+        except Exception as e:
+            print(f"{tenant_id}: sin conexión ({e})")
+            failed = True
+            continue
+        try:
+            if args.command == "status":
+                with conn.cursor() as cur:
+                    version = current_version(cur)
+                state = "al día" if version >= LATEST else f"{LATEST - version} pendiente(s)"
+                print(f"{tenant_id}: versión {version}/{LATEST} ({state})")
+            else:
+                print(f"{tenant_id}:")
+                version = upgrade(conn)
+                print(f"{tenant_id}: versión {version}/{LATEST}")
+        except Exception as e:
+            print(f"{tenant_id}: error ({e})")
+            failed = True
+        finally:
+            conn.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
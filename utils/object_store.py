@@ -0,0 +1,195 @@
+# object_store.py — Objetos de R2 direccionados por contenido
+#
+# Las subidas (``/upload``, ``/upload/batch`` y la edición con archivo) se
+# guardan en ``{cliente}/objetos/{sha256}`` en lugar de ``{cliente}/{nombre}``:
+# dos documentos con el mismo nombre de archivo ya no se pisan y un PDF que
+# ya está en R2 (la misma factura subida otra vez, con otro nombre o por otro
+# documento) no se vuelve a transferir: un ``HEAD`` basta para saltarse la
+# subida.
+#
+# ``object_refs`` (migración 9) cuenta cuántos documentos usan cada clave.
+# Orden de las operaciones, para que un objeto con referencias exista siempre:
+#   - alta: se fija la referencia (``acquire``, confirmada en el acto) y
+#     después se comprueba/sube el objeto; si algo falla se suelta;
+#   - baja o cambio de archivo: ``release`` en la misma transacción que
+#     borra o actualiza el documento y, tras el commit,
+#     ``r2_cleanup.delete_unreferenced`` marca las claves que quedaron a
+#     cero, las borra de R2 y quita sus filas.  Una subida del mismo
+#     contenido que fija una clave marcada espera (``wait_for_deletes``) a
+#     que el borrado termine y después vuelve a subir el objeto.
+#
+# El hash se calcula leyendo el archivo por trozos (Werkzeug ya lo tiene en
+# memoria o en un temporal), antes de subirlo.
+#
+# Subida prefirmada: el navegador sube a una clave temporal única,
+# ``subidas/{cliente}/{uuid}/{nombre}`` (el contenido aún no se conoce); al
+# completarla se lee el objeto desde R2 para calcular el hash, se fija la
+# referencia, se copia dentro de R2 a su clave por contenido (si no estaba
+# ya) y se borra el temporal.  Las subidas abandonadas quedan bajo
+# ``subidas/``: conviene una regla de ciclo de vida del bucket para ese prefijo.
+import os
+import time
+import uuid
+import hashlib
+import threading
+from collections import Counter
+
+from utils.storage import get_s3_client, get_transfer_config
+
+HASH_CHUNK_SIZE = 1024 * 1024
+PREFIX = "objetos"
+STAGING_PREFIX = "subidas"
+# Una marca de borrado más antigua es de un proceso que murió a medias
+DELETE_MARK_TTL = int(os.getenv("R2_DELETE_MARK_TTL", "120"))
+
+_STATS = dict(uploaded=0, skipped=0, bytes_uploaded=0, bytes_skipped=0)
+_STATS_LOCK = threading.Lock()
+
+
+def hash_stream(f) -> tuple[str, int]:
+    """SHA-256 (hex) y tamaño de ``f``, leído por trozos; lo deja al principio."""
+    digest = hashlib.sha256()
+    size = 0
+    f.seek(0)
+    while True:
+        chunk = f.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    f.seek(0)
+    return digest.hexdigest(), size
+
+
+def content_key(tenant_id: str, digest: str) -> str:
+    return f"{tenant_id}/{PREFIX}/{digest}"
+
+
+def staging_key(tenant_id: str, filename: str) -> str:
+    return f"{STAGING_PREFIX}/{tenant_id}/{uuid.uuid4().hex}/{filename}"
+
+
+def is_staging_key(tenant_id: str, key: str) -> bool:
+    """Si ``key`` es una clave temporal de subida del cliente ``tenant_id``."""
+    return key.startswith(f"{STAGING_PREFIX}/{tenant_id}/") and ".." not in key
+
+
+def hash_object(key: str) -> tuple[str, int]:
+    """SHA-256 (hex) y tamaño de un objeto de R2, leído por trozos."""
+    s3 = get_s3_client()
+    body = s3.get_object(Bucket=os.getenv("R2_BUCKET_NAME"), Key=key)["Body"]
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in body.iter_chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+    finally:
+        body.close()
+    return digest.hexdigest(), size
+
+
+def acquire(cur, refs: list):
+    """
+    Suma una referencia por cada ``(clave, sha256, tamaño)`` de ``refs``.
+    Con autocommit queda fijada al volver: ningún borrado posterior elimina
+    el objeto mientras no se suelte.
+    """
+    if refs:
+        cur.executemany(
+            """
+            INSERT INTO object_refs (object_key, sha256, size, refcount) VALUES (%s, %s, %s, 1)
+            ON DUPLICATE KEY UPDATE refcount = refcount + 1,
+                sha256 = COALESCE(sha256, VALUES(sha256)), size = COALESCE(size, VALUES(size))
+            """,
+            refs,
+        )
+
+
+def wait_for_deletes(cur, keys: list, poll: float = 0.2):
+    """
+    Tras ``acquire`` (con autocommit): espera a que ``r2_cleanup`` termine de
+    borrar las claves de ``keys`` que tenga marcadas, como mucho
+    ``DELETE_MARK_TTL`` segundos.
+    """
+    keys = list(dict.fromkeys(k for k in keys if k))
+    deadline = time.monotonic() + DELETE_MARK_TTL
+    while keys:
+        cur.execute(
+            f"SELECT object_key FROM object_refs WHERE object_key IN ({', '.join(['%s'] * len(keys))}) "
+            f"AND deleting_since > NOW() - INTERVAL %s SECOND",
+            [*keys, DELETE_MARK_TTL],
+        )
+        keys = [row["object_key"] for row in cur.fetchall()]
+        if not keys or time.monotonic() >= deadline:
+            break
+        time.sleep(poll)
+
+
+def release(cur, keys: list):
+    """Resta una referencia por cada aparición de cada clave (en la transacción del llamador)."""
+    counts = Counter(k for k in keys if k)
+    if counts:
+        cur.executemany(
+            "UPDATE object_refs SET refcount = GREATEST(refcount - %s, 0) WHERE object_key = %s",
+            [(n, key) for key, n in counts.items()],
+        )
+
+
+def _missing(s3, bucket: str, key: str, size: int | None) -> bool:
+    try:
+        head = s3.head_object(Bucket=bucket, Key=key)
+    except Exception:
+        return True  # 404 o error: ante la duda se sube (la clave es el propio contenido)
+    return size is not None and head.get("ContentLength") != size
+
+
+def ensure_object(f, key: str, digest: str, size: int | None, content_type: str | None) -> bool:
+    """Sube ``f`` a ``key`` salvo que R2 ya lo tenga; devuelve si hubo que subirlo."""
+    s3 = get_s3_client()
+    bucket_name = os.getenv("R2_BUCKET_NAME")
+    if not _missing(s3, bucket_name, key, size):
+        with _STATS_LOCK:
+            _STATS["skipped"] += 1
+            _STATS["bytes_skipped"] += size or 0
+        return False
+    f.seek(0)
+    s3.upload_fileobj(
+        f, bucket_name, key,
+        ExtraArgs={"ContentType": content_type or "application/pdf", "Metadata": {"sha256": digest}},
+        Config=get_transfer_config(),
+    )
+    with _STATS_LOCK:
+        _STATS["uploaded"] += 1
+        _STATS["bytes_uploaded"] += size or 0
+    return True
+
+
+def promote_staging(staging: str, key: str, digest: str, size: int, content_type: str | None) -> bool:
+    """
+    Copia (dentro de R2) la subida temporal ``staging`` a ``key`` salvo que ya
+    exista y borra el temporal; devuelve si hubo que copiarla.
+    """
+    s3 = get_s3_client()
+    bucket_name = os.getenv("R2_BUCKET_NAME")
+    copied = _missing(s3, bucket_name, key, size)
+    if copied:
+        s3.copy(
+            {"Bucket": bucket_name, "Key": staging}, bucket_name, key,
+            ExtraArgs={"ContentType": content_type or "application/pdf", "Metadata": {"sha256": digest},
+                       "MetadataDirective": "REPLACE"},
+            Config=get_transfer_config(),
+        )
+    with _STATS_LOCK:
+        _STATS["uploaded" if copied else "skipped"] += 1
+        _STATS["bytes_uploaded" if copied else "bytes_skipped"] += size or 0
+    try:
+        s3.delete_object(Bucket=bucket_name, Key=staging)
+    except Exception as e:
+        print(f"No se pudo borrar la subida temporal {staging}: {e}")
+    return copied
+
+
+def object_store_stats() -> dict:
+    with _STATS_LOCK:
+        return dict(_STATS)
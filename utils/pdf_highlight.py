@@ -0,0 +1,203 @@
+# pdf_highlight.py — Motor de resaltado local (PyMuPDF) en un pool de procesos
+#
+# Alternativa opcional al servicio externo ``HIGHLIGHTER_URL``: el PDF se
+# descarga de R2 a un temporal, un proceso del pool busca los códigos en
+# cada página, añade anotaciones de resaltado y guarda el resultado, que se
+# copia en la caché de resaltados.  El trabajo de CPU va en procesos aparte
+# para no bloquear los hilos que atienden peticiones (ni el GIL).
+#
+# ``HIGHLIGHTER_BACKEND``:
+#   - ``remote`` (por defecto): solo el servicio externo.
+#   - ``local``: solo este motor (requiere ``pymupdf``).
+#   - ``auto``: este motor si ``pymupdf`` está instalado; si falla, el externo.
+import os
+import shutil
+import tempfile
+import threading
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+MB = 1024 * 1024
+
+
+class LocalEngineUnavailable(Exception):
+    """PyMuPDF no está instalado o el pool de procesos no puede usarse."""
+
+
+def pymupdf_installed() -> bool:
+    return importlib.util.find_spec("fitz") is not None
+
+
+def backend() -> str:
+    value = (os.getenv("HIGHLIGHTER_BACKEND") or "remote").strip().lower()
+    return value if value in ("remote", "local", "auto") else "remote"
+
+
+def local_enabled() -> bool:
+    return backend() == "local" or (backend() == "auto" and pymupdf_installed())
+
+
+def remote_fallback() -> bool:
+    """Con ``auto`` un fallo del motor local se reintenta en el servicio externo."""
+    return backend() == "auto" and bool(os.getenv("HIGHLIGHTER_URL"))
+
+
+# --- Trabajo en el proceso del pool ---
+
+def highlight_file(src_path: str, dst_path: str, codes: list[str],
+                   pages: dict[str, list[int]] | None = None) -> dict:
+    """
+    Resalta ``codes`` en ``src_path`` y guarda el resultado en ``dst_path``.
+    ``pages`` (código → páginas, desde 1) viene de la extracción automática:
+    esos códigos solo se buscan en sus páginas; el resto, en todas.
+    Se ejecuta en un proceso del pool; devuelve páginas y coincidencias.
+    """
+    import fitz  # PyMuPDF; solo se importa en los procesos del pool
+
+    pages = pages or {}
+    everywhere = [code for code in codes if code not in pages]
+    by_page: dict[int, list[str]] = {}
+    for code in codes:
+        for number in pages.get(code, ()):
+            by_page.setdefault(number - 1, []).append(code)
+
+    matches = 0
+    with fitz.open(src_path) as doc:
+        for page in doc:
+            todo = everywhere + by_page.get(page.number, [])
+            if not todo:
+                continue
+            # Una sola extracción de texto por página para todos los códigos
+            textpage = page.get_textpage()
+            for code in todo:
+                for rect in page.search_for(code, textpage=textpage):
+                    page.add_highlight_annot(rect)
+                    matches += 1
+        pages = doc.page_count
+        doc.save(dst_path, garbage=3, deflate=True)
+    return {"pages": pages, "matches": matches}
+
+
+# --- Pools ---
+#
+# Dos pools: ``pdf`` (resaltado y ``search_optima`` por lotes) y
+# ``extraction`` (extracción de códigos), para que una extracción larga no
+# deje sin procesos al resaltado.  Una tarea que agota su ``timeout`` no se
+# puede cancelar si ya corre: se terminan los procesos de su pool y el
+# siguiente uso crea otro.  Las demás tareas que corrían en él se reintentan
+# una vez en el pool nuevo.
+
+PDF_POOL = "pdf"
+EXTRACTION_POOL = "extraction"
+
+_POOLS: dict[str, ProcessPoolExecutor] = {}
+_POOLS_PID = None
+_POOLS_LOCK = threading.Lock()
+
+
+def _workers(name: str) -> int:
+    if name == EXTRACTION_POOL:
+        return int(os.getenv("CODE_EXTRACT_WORKERS", "2"))
+    return int(os.getenv("HIGHLIGHTER_PROCESSES") or max(1, (os.cpu_count() or 2) - 1))
+
+
+def _pool(name: str = PDF_POOL) -> ProcessPoolExecutor:
+    global _POOLS, _POOLS_PID
+    with _POOLS_LOCK:
+        if _POOLS_PID != os.getpid():
+            _POOLS, _POOLS_PID = {}, os.getpid()
+        executor = _POOLS.get(name)
+        if executor is None:
+            # ``spawn``: el worker de gunicorn tiene hilos y un fork los dejaría a medias
+            executor = _POOLS[name] = ProcessPoolExecutor(
+                max_workers=_workers(name),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return executor
+
+
+def _reset_pool(name: str, executor: ProcessPoolExecutor, terminate: bool = False):
+    """Retira ``executor`` (si sigue siendo el actual) y, con ``terminate``, mata sus procesos."""
+    with _POOLS_LOCK:
+        if _POOLS.get(name) is executor:
+            del _POOLS[name]
+    if terminate:
+        executor._recycled = True
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(name: str, fn, args):
+    executor = _pool(name)
+    try:
+        return executor, executor.submit(fn, *args)
+    except RuntimeError:
+        # Otro hilo acaba de reciclarlo: ``_pool`` ya da uno nuevo
+        executor = _pool(name)
+        return executor, executor.submit(fn, *args)
+
+
+def run_in_pool(fn, *args, timeout: float | None = None, pool: str = PDF_POOL):
+    """Ejecuta ``fn(*args)`` en el pool de procesos ``pool`` y espera el resultado."""
+    for attempt in (1, 2):
+        executor, future = _submit(pool, fn, args)
+        try:
+            return future.result(timeout=timeout)
+        except BrokenProcessPool as e:
+            _reset_pool(pool, executor)
+            if attempt == 1 and getattr(executor, "_recycled", False):
+                continue  # lo mató el timeout de otra tarea, no esta
+            raise LocalEngineUnavailable(f"El pool de procesos PDF se cayó: {e}") from e
+        except FuturesTimeout:
+            if not future.cancel():
+                _reset_pool(pool, executor, terminate=True)
+            raise
+
+
+def map_in_pool(fn, args_list: list, timeout: float | None = None, pool: str = PDF_POOL) -> list:
+    """
+    ``[fn(*args) for args in args_list]`` repartido en el pool de procesos
+    (también lo usa ``search_optima`` por lotes).  ``timeout`` es por tarea.
+    """
+    executor = _pool(pool)
+    futures = [executor.submit(fn, *args) for args in args_list]
+    try:
+        return [future.result(timeout=timeout) for future in futures]
+    except BrokenProcessPool as e:
+        _reset_pool(pool, executor)
+        raise LocalEngineUnavailable(f"El pool de procesos PDF se cayó: {e}") from e
+    except BaseException as e:
+        running = [future for future in futures if not future.cancel() and not future.done()]
+        if running and isinstance(e, FuturesTimeout):
+            _reset_pool(pool, executor, terminate=True)
+        raise
+
+
+def highlight_object(s3, bucket: str, key: str, codes: list[str], salida, tmp_dir: str | None = None,
+                     pages: dict[str, list[int]] | None = None) -> dict:
+    """
+    Descarga ``key`` de R2, lo resalta en el pool y copia el PDF resultante
+    en el archivo binario ``salida``.  ``salida`` solo se escribe si el
+    resaltado terminó bien, así que el llamador puede recurrir a otro motor.
+    """
+    if not pymupdf_installed():
+        raise LocalEngineUnavailable("PyMuPDF (pymupdf) no está instalado")
+    fd, src = tempfile.mkstemp(dir=tmp_dir, suffix=".src.part")
+    os.close(fd)
+    dst = src[:-len(".src.part")] + ".out.part"
+    try:
+        s3.download_file(bucket, key, src)
+        result = run_in_pool(highlight_file, src, dst, codes, pages,
+                             timeout=float(os.getenv("HIGHLIGHTER_LOCAL_TIMEOUT", "120")))
+        with open(dst, "rb") as f:
+            shutil.copyfileobj(f, salida, MB)
+        return result
+    finally:
+        for path in (src, dst):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
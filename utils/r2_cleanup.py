@@ -0,0 +1,236 @@
+# r2_cleanup.py — Borrado masivo de objetos de R2 con cola de reintentos
+#
+# ``DeleteObjects`` admite hasta 1000 claves por llamada; los lotes se
+# envían en paralelo.  Las claves que R2 no pudo borrar (error por clave o
+# fallo de toda la llamada) no se pierden en el log: se guardan en
+# ``pending_object_deletes`` (migración 8) con un reintento diferido
+# (``retry_delay``: 1, 4, 9... minutos, como mucho un día), que se atiende
+# al final de cada borrado masivo o con:
+#   python -m utils.r2_cleanup retry [--tenant Cliente-Kino] [--limit 1000]
+#
+# Solo se borran claves sin referencias en ``object_refs`` (migración 9,
+# ``utils/object_store.py``); también al reintentar, porque una subida
+# posterior del mismo contenido habrá vuelto a usar la clave.  Ninguna
+# transacción queda abierta durante las llamadas a R2:
+#   1. con las filas bloqueadas se eligen las claves a cero y se marcan
+#      (``deleting_since``, migración 10); commit;
+#   2. ``DeleteObjects`` fuera de toda transacción;
+#   3. se quitan las filas que siguen a cero y se desmarcan las demás.
+# Una subida que fija una clave marcada espera a que se desmarque (o a que
+# la marca caduque) antes de comprobar si el objeto está en R2, así que no
+# se salta una subida de un objeto que está a punto de borrarse.
+import os
+import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.storage import get_s3_client
+
+DELETE_BATCH = 1000  # máximo de DeleteObjects
+DELETE_WORKERS = int(os.getenv("R2_DELETE_WORKERS", "4"))
+RETRY_BATCH = int(os.getenv("R2_DELETE_RETRY_BATCH", "200"))
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 86400
+
+
+def retry_delay(attempts: int) -> int:
+    """Segundos hasta el siguiente reintento tras ``attempts`` fallos (cuadrático, acotado)."""
+    return min(attempts * attempts * RETRY_BASE_SECONDS, RETRY_MAX_SECONDS)
+
+
+def delete_keys(keys: list[str]) -> dict[str, str]:
+    """Borra ``keys`` en lotes paralelos; devuelve ``{clave: error}`` de las que fallaron."""
+    keys = list(dict.fromkeys(k for k in keys if k))
+    if not keys:
+        return {}
+    s3 = get_s3_client()
+    bucket_name = os.getenv("R2_BUCKET_NAME")
+
+    def borrar(lote):
+        try:
+            resp = s3.delete_objects(
+                Bucket=bucket_name,
+                Delete={"Objects": [{"Key": k} for k in lote], "Quiet": True},
+            )
+        except Exception as e:
+            return {k: str(e) or e.__class__.__name__ for k in lote}
+        # Con ``Quiet`` solo vienen los errores
+        return {err.get("Key"): f"{err.get('Code')}: {err.get('Message')}" for err in resp.get("Errors") or []}
+
+    lotes = [keys[i:i + DELETE_BATCH] for i in range(0, len(keys), DELETE_BATCH)]
+    failed = {}
+    if len(lotes) == 1:
+        failed.update(borrar(lotes[0]))
+    else:
+        with ThreadPoolExecutor(max_workers=min(DELETE_WORKERS, len(lotes))) as pool:
+            for errores in pool.map(borrar, lotes):
+                failed.update(errores)
+    return failed
+
+
+def queue_failed(cur, failed: dict[str, str]):
+    """Guarda las claves no borradas para reintentarlas más tarde."""
+    if not failed:
+        return
+    keys = list(failed)
+    attempts = {}
+    for inicio in range(0, len(keys), DELETE_BATCH):
+        lote = keys[inicio:inicio + DELETE_BATCH]
+        cur.execute(
+            f"SELECT object_key, attempts FROM pending_object_deletes "
+            f"WHERE object_key IN ({', '.join(['%s'] * len(lote))}) FOR UPDATE",
+            lote,
+        )
+        attempts.update((row["object_key"], row["attempts"]) for row in cur.fetchall())
+    rows = []
+    for key, error in failed.items():
+        n = attempts.get(key, 0) + 1
+        rows.append((key, n, (error or "")[:255], retry_delay(n)))
+    cur.executemany(
+        """
+        INSERT INTO pending_object_deletes (object_key, attempts, last_error, next_attempt_at)
+        VALUES (%s, %s, %s, NOW() + INTERVAL %s SECOND)
+        ON DUPLICATE KEY UPDATE attempts = VALUES(attempts), last_error = VALUES(last_error),
+            next_attempt_at = VALUES(next_attempt_at)
+        """,
+        rows,
+    )
+
+
+def _in_batches(cur, sql: str, keys: list):
+    """Ejecuta ``sql`` (con ``{keys}`` en el lugar de la lista) por lotes de ``DELETE_BATCH`` claves."""
+    for inicio in range(0, len(keys), DELETE_BATCH):
+        lote = keys[inicio:inicio + DELETE_BATCH]
+        cur.execute(sql.format(keys=", ".join(["%s"] * len(lote))), lote)
+
+
+def delete_unreferenced(cur, keys: list[str]) -> tuple[dict[str, str], set[str]]:
+    """
+    Borra de R2 las claves de ``keys`` que ningún documento usa y encola las
+    que fallan, en tres pasos (ver la cabecera).  Las claves sin fila
+    (anteriores a la migración 9) se consideran en uso si algún documento
+    las apunta.  Debe llamarse fuera de una transacción.  Devuelve
+    ``(fallidas, en_uso)``.
+    """
+    keys = list(dict.fromkeys(k for k in keys if k))
+    if not keys:
+        return {}, set()
+    conn = cur.connection
+
+    # 1. Elegir y marcar las claves a cero
+    conn.begin()
+    try:
+        refs = {}
+        for inicio in range(0, len(keys), DELETE_BATCH):
+            lote = keys[inicio:inicio + DELETE_BATCH]
+            cur.execute(
+                f"SELECT object_key, refcount FROM object_refs "
+                f"WHERE object_key IN ({', '.join(['%s'] * len(lote))}) FOR UPDATE",
+                lote,
+            )
+            refs.update((row["object_key"], row["refcount"]) for row in cur.fetchall())
+        in_use = {k for k, n in refs.items() if n > 0}
+        sin_fila = [k for k in keys if k not in refs]
+        for inicio in range(0, len(sin_fila), DELETE_BATCH):
+            lote = sin_fila[inicio:inicio + DELETE_BATCH]
+            cur.execute(f"SELECT DISTINCT path FROM documents WHERE path IN ({', '.join(['%s'] * len(lote))})", lote)
+            in_use.update(row["path"] for row in cur.fetchall())
+
+        borrar = [k for k in keys if k not in in_use]
+        if borrar:
+            # Las claves sin fila también se marcan: una subida que las fije espera igual
+            cur.executemany(
+                "INSERT INTO object_refs (object_key, refcount, deleting_since) VALUES (%s, 0, NOW()) "
+                "ON DUPLICATE KEY UPDATE deleting_since = NOW()",
+                [(k,) for k in borrar],
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if not borrar:
+        return {}, in_use
+
+    # 2. R2, sin transacción abierta
+    failed = delete_keys(borrar)
+
+    # 3. Quitar las filas que siguen a cero; desmarcar las fallidas y las que se volvieron a fijar
+    done = [k for k in borrar if k not in failed]
+    conn.begin()
+    try:
+        _in_batches(cur, "DELETE FROM object_refs WHERE refcount = 0 AND object_key IN ({keys})", done)
+        _in_batches(cur, "UPDATE object_refs SET deleting_since = NULL WHERE object_key IN ({keys})", borrar)
+        if failed:
+            print(f"ADVERTENCIA: {len(failed)} objeto(s) de R2 sin borrar; quedan en cola de reintento")
+            queue_failed(cur, failed)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return failed, in_use
+
+
+def retry_pending(cur, limit: int = RETRY_BATCH) -> dict:
+    """Reintenta los borrados pendientes cuyo plazo ha vencido."""
+    cur.execute(
+        "SELECT object_key FROM pending_object_deletes WHERE next_attempt_at <= NOW() "
+        "ORDER BY next_attempt_at LIMIT %s",
+        (limit,),
+    )
+    keys = [row["object_key"] for row in cur.fetchall()]
+    if not keys:
+        return {"retried": 0, "deleted": 0, "failed": 0, "in_use": 0}
+    failed, in_use = delete_unreferenced(cur, keys)
+    # Borradas o vueltas a usar: ya no hay nada pendiente
+    done = [k for k in keys if k not in failed]
+    if done:
+        cur.execute(
+            f"DELETE FROM pending_object_deletes WHERE object_key IN ({', '.join(['%s'] * len(done))})",
+            done,
+        )
+    return {"retried": len(keys), "deleted": len(done) - len(in_use), "failed": len(failed), "in_use": len(in_use)}
+
+
+def main(argv=None) -> int:
+    import pymysql
+
+    from utils.db import tenant_params
+    from utils.tenants import TenantConfigError, load_tenants
+
+    parser = argparse.ArgumentParser(description="Reintento de borrados pendientes en R2")
+    parser.add_argument("command", choices=["retry"])
+    parser.add_argument("--tenant", help="solo este cliente")
+    parser.add_argument("--tenants-file", help="por defecto TENANTS_JSON o TENANTS_FILE, como la aplicación")
+    parser.add_argument("--limit", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    try:
+        tenants = load_tenants(args.tenants_file)
+    except TenantConfigError as e:
+        print(e)
+        return 2
+    if args.tenant:
+        if args.tenant not in tenants:
+            print(f"Cliente desconocido: {args.tenant}")
+            return 2
+        tenants = {args.tenant: tenants[args.tenant]}
+
+    failed = False
+    for tenant_id, config in tenants.items():
+        try:
+            conn = pymysql.connect(**tenant_params(config))
+            try:
+                with conn.cursor() as cur:
+                    result = retry_pending(cur, args.limit)
+            finally:
+                conn.close()
+            print(f"{tenant_id}: {result}")
+            failed |= result["failed"] > 0
+        except Exception as e:
+            print(f"{tenant_id}: error ({e})")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
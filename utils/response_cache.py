@@ -0,0 +1,310 @@
+# response_cache.py — Caché de respuestas de lectura con versión de datos por cliente
+#
+# Cada cliente tiene un contador de versión que suben las escrituras (alta,
+# edición y borrado de documentos).  Las respuestas de lectura se guardan
+# con la clave (cliente, ruta, parámetros normalizados, versión), así que una
+# escritura invalida todo lo anterior sin recorrer la caché, y el ``ETag``
+# ``v<versión>-<clave>`` permite responder ``304`` sin tocar la BD.
+#
+# Las respuestas se guardan en memoria de cada worker, en un LRU acotado por
+# ``RESPONSE_CACHE_MAX_MB``.  Las versiones viven siempre en disco, en
+# ``RESPONSE_CACHE_DIR`` (por defecto ``<tmp>/gestor-doc-response-cache``),
+# para que una escritura hecha por otro worker de gunicorn o por un script
+# (``code_extraction``, los CLI) invalide también la caché de este proceso;
+# cada petición solo hace un ``stat`` del archivo de versión, que se lee de
+# nuevo cuando cambia.  Si hay procesos en varios equipos, el directorio
+# debe ser compartido.
+#
+# Opcionalmente (``RESPONSE_CACHE_DISK_MAX_MB`` > 0) las respuestas también
+# se copian al directorio para compartirlas entre workers, con tope de
+# tamaño y de archivos (``RESPONSE_CACHE_DISK_MAX_FILES``) y desalojo LRU
+# (la fecha de modificación marca el último uso).
+import os
+import json
+import fcntl
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, g, make_response, request
+
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), "gestor-doc-response-cache")
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int, directory: str = DEFAULT_DIR,
+                 disk_max_bytes: int = 0, disk_max_files: int = 10000):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_max_files = disk_max_files
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[bytes, str]] = OrderedDict()
+        self._bytes = 0
+        self._versions: dict[str, tuple[tuple, int]] = {}  # cliente → (firma del archivo, versión)
+        # Estimación de lo que ocupan las respuestas en disco (None: sin medir)
+        self._disk_bytes = None
+        self._disk_files = 0
+        self._stats = dict(hits_memory=0, hits_disk=0, misses=0, not_modified=0,
+                           stores=0, evictions=0, disk_evictions=0, bumps=0)
+
+    @property
+    def disk_enabled(self) -> bool:
+        return self.disk_max_bytes > 0
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    # --- versión de datos ---
+
+    @staticmethod
+    def _tenant_slug(tenant_id: str) -> str:
+        return hashlib.sha1(tenant_id.encode("utf-8")).hexdigest()[:16]
+
+    def _version_path(self, tenant_id: str) -> str:
+        return os.path.join(self.directory, f"{self._tenant_slug(tenant_id)}.version")
+
+    @staticmethod
+    def _read_version(path: str) -> int:
+        try:
+            with open(path, "r") as f:
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def version(self, tenant_id: str) -> int:
+        path = self._version_path(tenant_id)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        # ``bump`` sustituye el archivo: otro inodo, así que la firma cambia siempre
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._versions.get(tenant_id)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        version = self._read_version(path)
+        with self._lock:
+            self._versions[tenant_id] = (signature, version)
+        return version
+
+    def bump(self, tenant_id: str) -> int:
+        """Sube la versión del cliente (tras una escritura) y devuelve la nueva."""
+        self._count("bumps")
+        path = self._version_path(tenant_id)
+        with open(f"{path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                version = self._read_version(path) + 1
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "w") as f:
+                    f.write(str(version))
+                os.replace(tmp, path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        if self.disk_enabled:
+            self._prune_disk(tenant_id, version)
+        return version
+
+    # --- respuestas ---
+
+    def _disk_path(self, tenant_id: str, version: int, key: str) -> str:
+        return os.path.join(self.directory, f"{self._tenant_slug(tenant_id)}-{version}-{key}.resp")
+
+    def get(self, tenant_id: str, version: int, key: str):
+        """Devuelve ``(cuerpo, mimetype)`` o ``None``."""
+        mem_key = f"{tenant_id}\0{version}\0{key}"
+        with self._lock:
+            entry = self._entries.get(mem_key)
+            if entry is not None:
+                self._entries.move_to_end(mem_key)
+                self._stats["hits_memory"] += 1
+                return entry
+        if self.disk_enabled:
+            path = self._disk_path(tenant_id, version, key)
+            try:
+                with open(path, "rb") as f:
+                    mimetype, _, body = f.read().partition(b"\n")
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            else:
+                entry = (body, mimetype.decode())
+                self._put_memory(mem_key, entry)
+                self._count("hits_disk")
+                return entry
+        self._count("misses")
+        return None
+
+    def put(self, tenant_id: str, version: int, key: str, body: bytes, mimetype: str):
+        self._put_memory(f"{tenant_id}\0{version}\0{key}", (body, mimetype))
+        self._count("stores")
+        if not self.disk_enabled or len(body) > self.disk_max_bytes // 4:
+            return
+        path = self._disk_path(tenant_id, version, key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(mimetype.encode() + b"\n" + body)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(body)
+                self._disk_files += 1
+                if self._disk_bytes <= self.disk_max_bytes and self._disk_files <= self.disk_max_files:
+                    return
+        self._evict_disk()
+
+    def _put_memory(self, mem_key: str, entry: tuple[bytes, str]):
+        size = len(entry[0])
+        if size > self.max_bytes // 4:
+            return  # respuestas enormes desplazarían a todo lo demás
+        with self._lock:
+            old = self._entries.pop(mem_key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[mem_key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (body, _) = self._entries.popitem(last=False)
+                self._bytes -= len(body)
+                self._stats["evictions"] += 1
+
+    def _disk_entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".resp"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _evict_disk(self):
+        """
+        Mide lo que hay en disco y, si pasa de algún tope, borra las respuestas
+        usadas hace más tiempo hasta quedar en el 90 %.  Solo se recorre el
+        directorio cuando la estimación de este proceso supera un tope.
+        """
+        entries = self._disk_entries()
+        total = sum(size for _, size, _ in entries)
+        files = len(entries)
+        if total > self.disk_max_bytes or files > self.disk_max_files:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.disk_max_bytes * 0.9 and files <= self.disk_max_files * 0.9:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                files -= 1
+                self._count("disk_evictions")
+        with self._lock:
+            self._disk_bytes, self._disk_files = total, files
+
+    def _prune_disk(self, tenant_id: str, version: int):
+        """Borra del disco las respuestas de versiones anteriores del cliente."""
+        prefix = f"{self._tenant_slug(tenant_id)}-"
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                name = entry.name
+                if not name.startswith(prefix) or not name.endswith(".resp"):
+                    continue
+                try:
+                    if int(name[len(prefix):].split("-", 1)[0]) < version:
+                        os.unlink(entry.path)
+                except (ValueError, FileNotFoundError):
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes,
+                        max_bytes=self.max_bytes, directory=self.directory,
+                        disk_bytes=self._disk_bytes, disk_files=self._disk_files if self.disk_enabled else None,
+                        disk_max_bytes=self.disk_max_bytes or None)
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _CACHE
+    if _CACHE is None:
+        with _CACHE_LOCK:
+            if _CACHE is None:
+                _CACHE = ResponseCache(
+                    max_bytes=int(float(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024),
+                    directory=os.getenv("RESPONSE_CACHE_DIR") or DEFAULT_DIR,
+                    disk_max_bytes=int(float(os.getenv("RESPONSE_CACHE_DISK_MAX_MB", "0")) * 1024 * 1024),
+                    disk_max_files=int(os.getenv("RESPONSE_CACHE_DISK_MAX_FILES", "10000")),
+                )
+    return _CACHE
+
+
+def data_version(tenant_id: str) -> int:
+    return get_response_cache().version(tenant_id)
+
+
+def bump_version(tenant_id: str) -> int:
+    return get_response_cache().bump(tenant_id)
+
+
+def _request_key(kwargs: dict) -> str:
+    """Ruta + argumentos de URL + query string ordenado + cuerpo JSON normalizado."""
+    body = request.get_json(silent=True) if request.method != "GET" else None
+    raw = json.dumps(
+        [request.endpoint, kwargs, sorted(request.args.items(multi=True)), body],
+        sort_keys=True, default=str, separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def cached_read(view):
+    """
+    Decorador para rutas de lectura de ``documentos_bp``: ``304`` si el
+    ``If-None-Match`` coincide, si no la respuesta cacheada o la generada.
+    Solo se guardan respuestas ``200`` no transmitidas en streaming.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if os.getenv("RESPONSE_CACHE_ENABLED", "1") == "0":
+            return view(*args, **kwargs)
+        cache = get_response_cache()
+        tenant_id = g.tenant_id
+        version = cache.version(tenant_id)
+        key = _request_key(kwargs)
+        etag = f"v{version}-{key}"
+
+        if request.if_none_match.contains(etag):
+            cache._count("not_modified")
+            resp = Response(status=304)
+        else:
+            entry = cache.get(tenant_id, version, key)
+            if entry is not None:
+                body, mimetype = entry
+                resp = Response(body, mimetype=mimetype)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200 or resp.is_streamed:
+                    return resp
+                cache.put(tenant_id, version, key, resp.get_data(), resp.mimetype)
+        resp.set_etag(etag)
+        # El navegador debe revalidar siempre; la revalidación cuesta un 304 sin BD
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+
+    return wrapper
+
+
+def cache_stats() -> dict | None:
+    return _CACHE.stats() if _CACHE is not None else None
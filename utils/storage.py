@@ -0,0 +1,101 @@
+# storage.py — Cliente S3 (Cloudflare R2) compartido por el proceso
+#
+# Construir un ``boto3.client`` carga los modelos de servicio de botocore y
+# crea un pool de conexiones nuevo, así que cada llamada pagaba decenas de
+# milisegundos y un handshake TLS con R2.  Los clientes de boto3 son seguros
+# entre hilos; lo que no lo es es su creación, que se hace bajo un lock.
+#
+# ``boto3``/``botocore`` se importan en el primer uso: cargarlos es la parte
+# más cara del arranque y muchas peticiones (búsquedas, listados) no los usan.
+import os
+import threading
+
+from utils.metrics import instrument_s3_client
+
+MB = 1024 * 1024
+
+_CLIENT = None
+_CLIENT_PID = None
+_CLIENT_LOCK = threading.Lock()
+_TRANSFER_CONFIG = None
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _build_client():
+    """
+    Crea un cliente S3 configurado para Cloudflare R2.
+
+    La configuración utiliza ``signature_version='s3v4'`` y ``addressing_style='virtual'``
+    según las recomendaciones de Cloudflare R2.  Además se omite el parámetro
+    ``verify=False`` para permitir la verificación TLS y se especifica
+    ``region_name='auto'`` para que R2 determine la región adecuada.
+    ``tcp_keepalive`` mantiene vivas las conexiones del pool hacia R2.
+    """
+    import boto3
+    from botocore.client import Config
+
+    cfg = Config(
+        signature_version='s3v4',
+        # ``path`` solo para servicios locales compatibles con S3 (benchmarks)
+        s3={'addressing_style': os.getenv('R2_ADDRESSING_STYLE', 'virtual')},
+        max_pool_connections=_int_env("R2_MAX_POOL_CONNECTIONS", 20),
+        tcp_keepalive=True,
+        connect_timeout=_int_env("R2_CONNECT_TIMEOUT", 10),
+        read_timeout=_int_env("R2_READ_TIMEOUT", 60),
+        retries={'max_attempts': _int_env("R2_MAX_ATTEMPTS", 3), 'mode': 'standard'},
+    )
+    # Sesión propia: la sesión por defecto de boto3 no es segura entre hilos
+    session = boto3.session.Session()
+    client = session.client(
+        's3',
+        endpoint_url=os.getenv('R2_ENDPOINT_URL'),
+        aws_access_key_id=os.getenv('R2_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.getenv('R2_SECRET_ACCESS_KEY'),
+        region_name='auto',
+        config=cfg
+    )
+    return instrument_s3_client(client)
+
+
+def get_s3_client():
+    """
+    Devuelve el cliente S3 del proceso, creándolo la primera vez.
+
+    Tras un ``fork`` de gunicorn el pool de conexiones heredado no es
+    utilizable, así que el cliente se vuelve a crear en cada worker.
+    """
+    global _CLIENT, _CLIENT_PID
+    pid = os.getpid()
+    client = _CLIENT
+    if client is not None and _CLIENT_PID == pid:
+        return client
+    with _CLIENT_LOCK:
+        if _CLIENT is None or _CLIENT_PID != pid:
+            _CLIENT = _build_client()
+            _CLIENT_PID = pid
+        return _CLIENT
+
+
+def get_transfer_config():
+    """
+    ``TransferConfig`` para ``upload_fileobj``: los PDF habituales se suben en
+    una sola petición y solo los grandes pasan a multiparte con pocas partes
+    en paralelo (cada worker atiende varias peticiones a la vez).
+    """
+    global _TRANSFER_CONFIG
+    if _TRANSFER_CONFIG is None:
+        from boto3.s3.transfer import TransferConfig
+
+        _TRANSFER_CONFIG = TransferConfig(
+            multipart_threshold=_int_env("R2_MULTIPART_THRESHOLD_MB", 16) * MB,
+            multipart_chunksize=_int_env("R2_MULTIPART_CHUNKSIZE_MB", 8) * MB,
+            max_concurrency=_int_env("R2_UPLOAD_CONCURRENCY", 4),
+            use_threads=True,
+        )
+    return _TRANSFER_CONFIG
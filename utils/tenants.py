@@ -0,0 +1,274 @@
+# tenants.py — Registro de clientes recargable en caliente
+#
+# La configuración de los clientes sale de (por orden):
+#   - ``TENANTS_JSON``: el JSON completo en la variable de entorno;
+#   - ``TENANTS_FILE``: ruta del archivo (por defecto ``tenants.json`` en el
+#     directorio de trabajo).
+#
+# Cada entrada se valida al cargar; las que no son válidas se descartan (o,
+# en una recarga, se conserva su versión anterior) y se registra el motivo.
+#
+# Recarga sin reiniciar los workers: al cambiar el archivo (se comprueba como
+# mucho cada ``TENANTS_RELOAD_SECONDS``, 5 s, durante las peticiones) o al
+# recibir ``SIGHUP`` el worker.  El registro se sustituye de golpe: las
+# peticiones en curso siguen con la configuración que ya tenían.  Los
+# recursos de cada cliente (pool y calentamiento de la BD, índice de códigos,
+# control de admisión) se crean al usarse y se liberan cuando el cliente
+# desaparece o cambia la parte de la configuración de la que dependen: el
+# pool con los datos de conexión y ``pool_*``, el índice además con
+# ``code_patterns`` y la admisión con ``admission``.  Las conexiones
+# prestadas se cierran al devolverse, sin cortar la petición que las usa.
+import os
+import re
+import json
+import time
+import signal
+import threading
+
+REQUIRED = ("db_host", "db_user", "db_pass", "db_name")
+POOL_KEYS = ("pool_size", "pool_max_overflow", "pool_timeout", "pool_max_idle",
+             "pool_recycle", "pool_ping_after")
+DB_KEYS = REQUIRED + ("db_port",) + POOL_KEYS
+
+
+class TenantConfigError(Exception):
+    """No se puede leer la configuración de clientes."""
+
+
+def validate_entry(config) -> list[str]:
+    """Errores de una entrada de ``tenants.json`` (lista vacía si es válida)."""
+    if not isinstance(config, dict):
+        return ["la entrada debe ser un objeto"]
+    errors = [f"falta '{key}'" for key in REQUIRED if not isinstance(config.get(key), str)]
+    errors += [f"'{key}' está vacío" for key in REQUIRED if key != "db_pass" and config.get(key) == ""]
+    port = config.get("db_port", 3306)
+    if not isinstance(port, int) or not 0 < port < 65536:
+        errors.append("'db_port' debe ser un entero entre 1 y 65535")
+    patterns = config.get("code_patterns")
+    if patterns is not None:
+        for pattern in [patterns] if isinstance(patterns, str) else patterns:
+            try:
+                re.compile(pattern)
+            except (re.error, TypeError) as e:
+                errors.append(f"'code_patterns' no válido ({pattern!r}: {e})")
+    if "admission" in config and not isinstance(config["admission"], dict):
+        errors.append("'admission' debe ser un objeto")
+    for key in POOL_KEYS:
+        if key in config and (isinstance(config[key], bool) or not isinstance(config[key], (int, float))):
+            errors.append(f"'{key}' debe ser un número")
+    return errors
+
+
+def _release_resources(tenant_id: str, old: dict | None = None, new: dict | None = None):
+    """
+    Libera los recursos de un cliente que dependen de lo que cambió entre
+    ``old`` y ``new`` (todos si ``new`` es ``None``: cliente eliminado).  Se
+    volverán a crear si se usa.
+    """
+    from utils import code_index
+    from utils.admission import forget as forget_admission
+    from utils.warmup import forget as forget_readiness
+
+    def changed(*keys):
+        return new is None or any(old.get(k) != new.get(k) for k in keys)
+
+    if changed(*DB_KEYS):
+        forget_readiness(tenant_id)
+    if changed(*DB_KEYS, "code_patterns"):
+        code_index.drop(tenant_id)
+    if changed("admission"):
+        forget_admission(tenant_id)
+
+
+class TenantRegistry:
+    def __init__(self, path: str | None = None, inline: str | None = None,
+                 reload_seconds: float = 5):
+        self.path = path
+        self.inline = inline
+        self.reload_seconds = reload_seconds
+        self._tenants: dict[str, dict] = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._reload_requested = False
+        self._lock = threading.Lock()
+        self._stats = dict(loads=0, reloads=0, failed_reloads=0, invalid_entries=0)
+        self._errors: dict[str, list[str]] = {}
+        self._loaded_at = None
+
+    # --- Lectura ---
+
+    def _signature_now(self):
+        if self.inline is not None:
+            return None
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read(self) -> dict:
+        try:
+            if self.inline is not None:
+                data = json.loads(self.inline)
+            else:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise TenantConfigError(f"No se pudo leer la configuración de clientes "
+                                    f"({self.path or 'TENANTS_JSON'}): {e}") from e
+        if not isinstance(data, dict):
+            raise TenantConfigError("La configuración de clientes debe ser un objeto {id: config}")
+        return data
+
+    def load(self):
+        """Carga inicial; lanza ``TenantConfigError`` si no se puede leer."""
+        with self._lock:
+            try:
+                signature = self._signature_now()
+            except OSError as e:
+                raise TenantConfigError(f"No se pudo leer la configuración de clientes ({self.path}): {e}") from e
+            self._apply(self._read(), previous={})
+            self._signature = signature
+            self._checked_at = time.monotonic()
+            self._stats["loads"] += 1
+
+    def _apply(self, data: dict, previous: dict) -> dict:
+        tenants, errors = {}, {}
+        for tenant_id, config in data.items():
+            problems = validate_entry(config)
+            if not problems:
+                tenants[tenant_id] = config
+                continue
+            errors[tenant_id] = problems
+            print(f"Clientes: entrada '{tenant_id}' no válida: {'; '.join(problems)}"
+                  + ("; se mantiene la anterior" if tenant_id in previous else ""))
+            if tenant_id in previous:
+                tenants[tenant_id] = previous[tenant_id]
+        self._tenants = tenants  # sustitución atómica: los lectores ven uno u otro
+        self._errors = errors
+        self._stats["invalid_entries"] = len(errors)
+        self._loaded_at = time.time()
+        return tenants
+
+    # --- Recarga ---
+
+    def request_reload(self, *_):
+        """Manejador de señal: solo marca; la recarga la hace la siguiente petición."""
+        self._reload_requested = True
+
+    def maybe_reload(self):
+        """Recarga si se pidió (señal) o si el archivo cambió; barato si no."""
+        now = time.monotonic()
+        if not self._reload_requested and (
+                self.inline is not None or not self.reload_seconds
+                or now - self._checked_at < self.reload_seconds):
+            return
+        if not self._lock.acquire(blocking=False):
+            return  # otro hilo ya está recargando
+        try:
+            self._checked_at = now
+            forced, self._reload_requested = self._reload_requested, False
+            try:
+                signature = self._signature_now()
+            except OSError as e:
+                print(f"Clientes: no se puede consultar {self.path}: {e}")
+                return
+            if signature == self._signature and not forced:
+                return
+            self._signature = signature
+            self._reload_locked()
+        finally:
+            self._lock.release()
+
+    def reload(self):
+        with self._lock:
+            self._signature = self._signature_now()
+            self._reload_locked()
+
+    def _reload_locked(self):
+        previous = self._tenants
+        try:
+            data = self._read()
+        except TenantConfigError as e:
+            self._stats["failed_reloads"] += 1
+            print(f"{e}; se mantiene la configuración actual")
+            return
+        current = self._apply(data, previous)
+        self._stats["reloads"] += 1
+        removed = [t for t in previous if t not in current]
+        changed = [t for t in current if t in previous and current[t] != previous[t]]
+        added = [t for t in current if t not in previous]
+        for tenant_id in removed + changed:
+            try:
+                _release_resources(tenant_id, previous[tenant_id], current.get(tenant_id))
+            except Exception as e:
+                print(f"Clientes: error liberando los recursos de '{tenant_id}': {e}")
+        if added or removed or changed:
+            print(f"Clientes recargados: +{added} -{removed} ~{changed}")
+
+    # --- Consulta ---
+
+    def get(self, tenant_id: str | None) -> dict | None:
+        return self._tenants.get(tenant_id) if tenant_id else None
+
+    def __contains__(self, tenant_id) -> bool:
+        return tenant_id in self._tenants
+
+    def tenants(self) -> dict[str, dict]:
+        """Copia superficial del registro actual."""
+        return dict(self._tenants)
+
+    def stats(self) -> dict:
+        return dict(
+            self._stats,
+            source=self.path if self.inline is None else "TENANTS_JSON",
+            tenants=sorted(self._tenants),
+            errors=self._errors,
+            loaded_at=self._loaded_at,
+        )
+
+
+_REGISTRY = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry() -> TenantRegistry:
+    """Registro del proceso, cargado la primera vez que se pide."""
+    global _REGISTRY
+    if _REGISTRY is None:
+        with _REGISTRY_LOCK:
+            if _REGISTRY is None:
+                registry = TenantRegistry(
+                    path=os.getenv("TENANTS_FILE", "tenants.json"),
+                    inline=os.getenv("TENANTS_JSON"),
+                    reload_seconds=float(os.getenv("TENANTS_RELOAD_SECONDS", "5")),
+                )
+                registry.load()
+                _REGISTRY = registry
+    return _REGISTRY
+
+
+def load_tenants(path: str | None = None) -> dict[str, dict]:
+    """
+    Clientes válidos para los scripts de línea de órdenes: los de ``path`` si
+    se indica y, si no, los mismos que ve la aplicación (``TENANTS_JSON`` o
+    ``TENANTS_FILE``).  Lanza ``TenantConfigError`` si no se pueden leer.
+    """
+    if path:
+        registry = TenantRegistry(path=path)
+    else:
+        registry = TenantRegistry(path=os.getenv("TENANTS_FILE", "tenants.json"),
+                                  inline=os.getenv("TENANTS_JSON"))
+    registry.load()
+    return registry.tenants()
+
+
+def install_reload_signal():
+    """``SIGHUP`` recarga el registro (solo desde el hilo principal)."""
+    if threading.current_thread() is not threading.main_thread() or not hasattr(signal, "SIGHUP"):
+        return
+    try:
+        signal.signal(signal.SIGHUP, get_registry().request_reload)
+    except ValueError:
+        pass
+
+
+def registry_stats() -> dict | None:
+    return _REGISTRY.stats() if _REGISTRY is not None else None
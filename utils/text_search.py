@@ -0,0 +1,194 @@
+# text_search.py — Búsqueda por contenido de los PDF (MySQL FULLTEXT)
+#
+# La extracción automática (``utils/code_extraction.py``) guarda el texto de
+# cada página en ``document_texts`` (migración 7), con un índice FULLTEXT
+# de InnoDB: el índice invertido lo mantiene MySQL y se actualiza en cada
+# alta, edición (archivo nuevo) y baja (``ON DELETE CASCADE``).
+#
+# Consultas (``BOOLEAN MODE``): todas las palabras son obligatorias y deben
+# aparecer en la misma página; ``"entre comillas"`` busca la frase exacta,
+# ``-palabra`` excluye y ``palabra*`` busca por prefijo.  Los documentos se
+# ordenan por la suma de la relevancia de sus páginas.
+#
+# Reconstrucción (documentos subidos antes de activar la búsqueda, o tras
+# cambiar ``code_patterns``):
+#   python -m utils.text_search rebuild [--tenant Cliente-Kino] [--solo-pendientes] [--workers 4]
+import re
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+_TOKENS = re.compile(r'(-?)"([^"]*)"|(\S+)')
+# Operadores de BOOLEAN MODE que no se aceptan dentro de una palabra
+_OPERATORS = re.compile(r'[+\-<>()~*"@]+')
+
+
+def boolean_query(texto: str) -> str:
+    """Traduce la consulta del usuario a ``AGAINST (... IN BOOLEAN MODE)``."""
+    partes = []
+    for negada, frase, palabra in _TOKENS.findall(texto or ""):
+        if frase:
+            frase = " ".join(_OPERATORS.sub(" ", frase).split())
+            if frase:
+                partes.append(f'{"-" if negada else "+"}"{frase}"')
+            continue
+        signo = "-" if palabra.startswith("-") else "+"
+        prefijo = palabra.endswith("*")
+        palabras = _OPERATORS.sub(" ", palabra).split()
+        for n, palabra in enumerate(palabras, 1):
+            partes.append(f"{signo}{palabra}{'*' if prefijo and n == len(palabras) else ''}")
+    # Solo exclusiones no devuelve nada en MySQL: se exige al menos un término
+    if not any(p.startswith("+") for p in partes):
+        return ""
+    return " ".join(partes)
+
+
+def search(cur, texto: str, limit: int, offset: int = 0) -> tuple[list[dict], bool]:
+    """
+    Documentos cuyo texto coincide con ``texto``, de más a menos relevante,
+    con las páginas que coinciden (la más relevante primero).  Devuelve
+    ``(filas, hay_mas)``.
+    """
+    query = boolean_query(texto)
+    if not query:
+        return [], False
+    cur.execute(
+        """
+        SELECT p.document_id, SUM(p.score) AS score
+        FROM (
+            SELECT document_id, page, MATCH(content) AGAINST (%s IN BOOLEAN MODE) AS score
+            FROM document_texts
+            WHERE MATCH(content) AGAINST (%s IN BOOLEAN MODE)
+        ) p
+        GROUP BY p.document_id
+        ORDER BY score DESC, p.document_id DESC
+        LIMIT %s OFFSET %s
+        """,
+        (query, query, limit + 1, offset),
+    )
+    hits = cur.fetchall()
+    hay_mas = len(hits) > limit
+    hits = hits[:limit]
+    if not hits:
+        return [], False
+
+    ids = [h["document_id"] for h in hits]
+    cur.execute(
+        f"SELECT id, name, date, path FROM documents WHERE id IN ({', '.join(['%s'] * len(ids))})",
+        ids,
+    )
+    documentos = {row["id"]: row for row in cur.fetchall()}
+    # Páginas en una segunda consulta (solo de los documentos devueltos):
+    # GROUP_CONCAT se corta en ``group_concat_max_len`` (1024 bytes por defecto)
+    cur.execute(
+        f"""
+        SELECT document_id, page
+        FROM document_texts
+        WHERE document_id IN ({', '.join(['%s'] * len(ids))})
+          AND MATCH(content) AGAINST (%s IN BOOLEAN MODE)
+        ORDER BY document_id, MATCH(content) AGAINST (%s IN BOOLEAN MODE) DESC, page
+        """,
+        [*ids, query, query],
+    )
+    paginas = {}
+    for row in cur.fetchall():
+        paginas.setdefault(row["document_id"], []).append(int(row["page"]))
+    filas = []
+    for h in hits:
+        row = documentos.get(h["document_id"])
+        if row is None:  # borrado entre las dos consultas
+            continue
+        filas.append(dict(
+            row,
+            score=round(float(h["score"]), 4),
+            paginas=paginas.get(h["document_id"], []),
+        ))
+    return filas, hay_mas
+
+
+# --- Reconstrucción ---
+
+def rebuild(tenant_id: str, config: dict, only_pending: bool = False, workers: int = 2, log=print) -> int:
+    """Vuelve a extraer (texto y códigos) los documentos del cliente; devuelve los fallidos."""
+    import pymysql
+
+    from utils.code_extraction import DONE, extraction_enabled, process_document
+    from utils.db import tenant_params
+
+    if not extraction_enabled(config):
+        log(f"{tenant_id}: sin extracción configurada (content_search/code_patterns o falta pymupdf)")
+        return 0
+
+    conn = pymysql.connect(**tenant_params(config))
+    try:
+        with conn.cursor() as cur:
+            sql = "SELECT id, path FROM documents WHERE path IS NOT NULL AND path <> ''"
+            if only_pending:
+                sql += f" AND (extraction_status IS NULL OR extraction_status <> '{DONE}')"
+            cur.execute(sql + " ORDER BY id")
+            documentos = cur.fetchall()
+    finally:
+        conn.close()
+    log(f"{tenant_id}: {len(documentos)} documento(s)")
+
+    def procesar(doc):
+        # Una conexión por hilo: las de PyMySQL no se comparten entre hilos
+        conn = pymysql.connect(**tenant_params(config))
+        try:
+            return process_document(conn, tenant_id, config, doc["id"], doc["path"])
+        finally:
+            conn.close()
+
+    failed = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(procesar, doc): doc for doc in documentos}
+        for n, future in enumerate(as_completed(futures), 1):
+            doc = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                log(f"  {doc['id']} ({doc['path']}): error ({e})")
+            if n % 100 == 0:
+                log(f"  {n}/{len(documentos)} ({time.monotonic() - started:.0f}s)")
+    log(f"{tenant_id}: {len(documentos) - failed} ok, {failed} con error ({time.monotonic() - started:.1f}s)")
+    return failed
+
+
+def main(argv=None) -> int:
+    from utils.tenants import TenantConfigError, load_tenants
+
+    parser = argparse.ArgumentParser(description="Índice de búsqueda por contenido de cada cliente")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--tenant", help="solo este cliente")
+    parser.add_argument("--tenants-file", help="por defecto TENANTS_JSON o TENANTS_FILE, como la aplicación")
+    parser.add_argument("--solo-pendientes", action="store_true",
+                        help="solo documentos sin extracción completada")
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    try:
+        tenants = load_tenants(args.tenants_file)
+    except TenantConfigError as e:
+        print(e)
+        return 2
+    if args.tenant:
+        if args.tenant not in tenants:
+            print(f"Cliente desconocido: {args.tenant}")
+            return 2
+        tenants = {args.tenant: tenants[args.tenant]}
+
+    failed = False
+    for tenant_id, config in tenants.items():
+        try:
+            failed |= rebuild(tenant_id, config, args.solo_pendientes, args.workers) > 0
+        except Exception as e:
+            print(f"{tenant_id}: error ({e})")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
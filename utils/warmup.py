@@ -0,0 +1,270 @@
+# warmup.py — Estado de disponibilidad de la BD de cada cliente
+#
+# En Railway la base de datos se "duerme" y tarda unos segundos en aceptar
+# conexiones.  En lugar de que cada petición duerma y reintente dentro del
+# worker de gunicorn, un único hilo por cliente intenta despertarla con
+# espera exponencial; las peticiones esperan ese intento hasta un plazo
+# corto o fallan rápido con 503 + ``Retry-After``.
+#
+# Al despertar se comprueba también la versión del esquema
+# (``schema_migrations``, ver ``utils/migrations.py``): si faltan
+# migraciones el cliente queda en ``failed`` con un mensaje que lo dice, en
+# lugar de fallar después con errores de columnas inexistentes.
+import os
+import time
+import threading
+
+import pymysql
+
+from utils.db import ConnectionPool, close_pool, get_tenant_pool
+from utils.migrations import LATEST
+
+# Errores de PyMySQL que indican que el servidor no está accesible
+# (2003 conexión rechazada, 2006 servidor desaparecido, 2013 conexión perdida)
+_CONNECTION_ERRORS = (2003, 2006, 2013)
+
+COLD = "cold"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+class DatabaseUnavailable(Exception):
+    """La BD del cliente no está lista; reintentar tras ``retry_after`` segundos."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after))
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+class TenantReadiness:
+    """
+    Máquina de estados ``cold → warming → ready`` (o ``failed``) de un cliente.
+
+    - Solo un hilo de calentamiento por cliente: reintenta con espera
+      exponencial (``base_delay`` duplicándose hasta ``max_delay``) durante
+      como mucho ``max_warmup`` segundos.
+    - Si se agota, el estado pasa a ``failed`` y no se vuelve a intentar hasta
+      pasados ``cooldown`` segundos; mientras tanto las peticiones fallan
+      rápido.
+    - Igual si la BD responde pero su esquema es anterior a
+      ``required_schema`` (``0`` no lo comprueba).
+    """
+
+    def __init__(self, tenant_id: str, pool: ConnectionPool,
+                 wait: float | None = None, base_delay: float | None = None,
+                 max_delay: float | None = None, max_warmup: float | None = None,
+                 cooldown: float | None = None, required_schema: int | None = None):
+        self.tenant_id = tenant_id
+        self.pool = pool
+        self.wait = _float_env("DB_WAKE_WAIT", 3) if wait is None else wait
+        self.base_delay = _float_env("DB_WAKE_BASE_DELAY", 0.5) if base_delay is None else base_delay
+        self.max_delay = _float_env("DB_WAKE_MAX_DELAY", 8) if max_delay is None else max_delay
+        self.max_warmup = _float_env("DB_WAKE_MAX_SECONDS", 60) if max_warmup is None else max_warmup
+        self.cooldown = _float_env("DB_WAKE_COOLDOWN", 15) if cooldown is None else cooldown
+        self.required_schema = (int(os.getenv("DB_REQUIRED_SCHEMA", LATEST))
+                                if required_schema is None else required_schema)
+
+        self._cond = threading.Condition()
+        self.state = COLD
+        self._next_attempt_at = 0.0  # instante (monotonic) del próximo intento
+        self._last_error = None
+        self._attempts = 0
+        self.schema_version = None
+        self._schema_error = None
+
+    # --- uso desde las peticiones ---
+
+    def connection(self, wait: float | None = None):
+        """
+        Presta una conexión del pool si la BD está lista.
+
+        Si no lo está, lanza (o reutiliza) el calentamiento en segundo plano y
+        espera como mucho ``wait`` segundos; después lanza ``DatabaseUnavailable``.
+        """
+        self.ensure_ready(wait)
+        try:
+            return self.pool.connection()
+        except pymysql.err.OperationalError as e:
+            if e.args and e.args[0] in _CONNECTION_ERRORS:
+                self.mark_cold(e)
+                raise DatabaseUnavailable(
+                    "La base de datos se está iniciando, intente de nuevo.",
+                    self.retry_after(),
+                ) from e
+            raise
+
+    def ensure_ready(self, wait: float | None = None):
+        wait = self.wait if wait is None else wait
+        deadline = time.monotonic() + wait
+        with self._cond:
+            if self.state == READY:
+                return
+            self._start_locked()
+            while self.state != READY:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.state == FAILED:
+                    raise DatabaseUnavailable(
+                        self._schema_error or "La base de datos se está iniciando, intente de nuevo.",
+                        self._retry_after_locked(),
+                    )
+                self._cond.wait(remaining)
+
+    def mark_cold(self, error: Exception | None = None):
+        """Una conexión falló: volver a ``cold`` y despertar en segundo plano."""
+        with self._cond:
+            self._last_error = repr(error) if error else None
+            if self.state == READY:
+                self.state = COLD
+            self._start_locked()
+
+    def start(self):
+        """Lanza el calentamiento si no hay uno en curso (p. ej. al arrancar)."""
+        with self._cond:
+            if self.state != READY:
+                self._start_locked()
+
+    def retry_after(self) -> int:
+        with self._cond:
+            return self._retry_after_locked()
+
+    def status(self) -> dict:
+        with self._cond:
+            return {
+                "state": self.state,
+                "attempts": self._attempts,
+                "retry_after": self._retry_after_locked() if self.state != READY else 0,
+                "last_error": self._schema_error or self._last_error,
+                "schema_version": self.schema_version,
+            }
+
+    # --- interno ---
+
+    def _start_locked(self):
+        if self.state == WARMING:
+            return
+        if self.state == FAILED and time.monotonic() < self._next_attempt_at:
+            return
+        self.state = WARMING
+        self._attempts = 0
+        threading.Thread(
+            target=self._warm,
+            name=f"db-warmup-{self.tenant_id}",
+            daemon=True,
+        ).start()
+
+    def _retry_after_locked(self) -> int:
+        return max(1, int(round(self._next_attempt_at - time.monotonic())) + 1)
+
+    def _read_schema_version(self) -> int:
+        conn = self.pool.connection()
+        try:
+            with conn.cursor() as cur:
+                try:
+                    cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations")
+                except pymysql.err.ProgrammingError:
+                    return 0  # sin tabla: nunca se migró
+                return cur.fetchone()["version"]
+        finally:
+            conn.close()
+
+    def _warm(self):
+        started = time.monotonic()
+        delay = self.base_delay
+        while True:
+            with self._cond:
+                self._attempts += 1
+            try:
+                # Abrir una conexión la deja ociosa en el pool para la primera petición
+                if self.required_schema:
+                    version = self._read_schema_version()
+                else:
+                    version = None
+                    self.pool.connection().close()
+            except Exception as e:
+                print(f"BD de '{self.tenant_id}' no disponible (intento {self._attempts}): {e}")
+                with self._cond:
+                    self._last_error = repr(e)
+                    if time.monotonic() - started + delay > self.max_warmup:
+                        self.state = FAILED
+                        self._next_attempt_at = time.monotonic() + self.cooldown
+                        self._cond.notify_all()
+                        return
+                    self._next_attempt_at = time.monotonic() + delay
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_delay)
+                continue
+            if version is not None and version < self.required_schema:
+                message = (f"El esquema de la base de datos está en la versión {version} y la aplicación "
+                           f"necesita la {self.required_schema}: ejecute 'python -m utils.migrations upgrade'.")
+                print(f"BD de '{self.tenant_id}': {message}")
+                with self._cond:
+                    self.schema_version = version
+                    self._schema_error = message
+                    self.state = FAILED
+                    self._next_attempt_at = time.monotonic() + self.cooldown
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self.state = READY
+                self.schema_version = version
+                self._schema_error = None
+                self._last_error = None
+                self._next_attempt_at = 0.0
+                self._cond.notify_all()
+            return
+
+
+# --- Registro por cliente ---
+
+_READINESS: dict[str, TenantReadiness] = {}
+_READINESS_LOCK = threading.Lock()
+_READINESS_PID = os.getpid()
+
+
+def get_readiness(tenant_id: str, config: dict) -> TenantReadiness:
+    global _READINESS, _READINESS_PID
+    with _READINESS_LOCK:
+        if _READINESS_PID != os.getpid():
+            # Los hilos de calentamiento no sobreviven al fork
+            _READINESS = {}
+            _READINESS_PID = os.getpid()
+        readiness = _READINESS.get(tenant_id)
+        if readiness is None:
+            readiness = TenantReadiness(tenant_id, get_tenant_pool(tenant_id, config))
+            _READINESS[tenant_id] = readiness
+        return readiness
+
+
+def forget(tenant_id: str):
+    """
+    Olvida el estado del cliente y cierra su pool (cliente eliminado o con
+    otra configuración).  Las conexiones prestadas se cierran al devolverse.
+
+    Estado y pool se sueltan bajo el mismo candado que ``get_readiness``: si
+    no, una petición podría crear un estado nuevo sobre el pool que se está
+    cerrando.
+    """
+    with _READINESS_LOCK:
+        if _READINESS_PID == os.getpid():
+            _READINESS.pop(tenant_id, None)
+        close_pool(tenant_id)
+
+
+def prewarm(tenants: dict):
+    """Despierta en segundo plano la BD de todos los clientes de ``tenants.json``."""
+    for tenant_id, config in tenants.items():
+        get_readiness(tenant_id, config).start()
+
+
+def readiness_status() -> dict:
+    with _READINESS_LOCK:
+        items = dict(_READINESS) if _READINESS_PID == os.getpid() else {}
+    return {tenant_id: r.status() for tenant_id, r in items.items()}
@@ -0,0 +1,189 @@
+# zip_export.py — Exportación de documentos en un ZIP generado al vuelo
+#
+# El archivo se escribe mientras se envía: ``ZipFile`` escribe sobre un
+# destino no posicionable (cabeceras locales con descriptor de datos al
+# final de cada entrada) y cada trozo se entrega al cliente en cuanto está
+# listo, así que ni el ZIP completo ni los PDF pasan por memoria o disco.
+# Las entradas van sin comprimir (``ZIP_STORED``: los PDF ya lo están) y con
+# ZIP64 cuando hace falta, de modo que no hay límite de 4 GiB.
+#
+# Los objetos se piden a R2 con ``EXPORT_WORKERS`` (4) hilos y una ventana
+# del mismo tamaño por delante del que se está enviando: los de hasta
+# ``EXPORT_PREFETCH_MAX_MB`` (4) se descargan enteros en el hilo; los
+# mayores solo se abren y se copian por trozos al llegar su turno.  Memoria
+# máxima por exportación ≈ ``EXPORT_WORKERS`` × ``EXPORT_PREFETCH_MAX_MB``.
+#
+# Un documento que falla no corta la descarga: queda anotado en
+# ``manifiesto.json``, la última entrada del ZIP, junto con los que sí se
+# incluyeron.
+import os
+import json
+import time
+import zipfile
+import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+from utils.storage import get_s3_client
+
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "4"))
+EXPORT_PREFETCH_MAX_BYTES = int(float(os.getenv("EXPORT_PREFETCH_MAX_MB", "4")) * 1024 * 1024)
+CHUNK_SIZE = 64 * 1024
+MANIFEST_NAME = "manifiesto.json"
+
+
+class _Sink:
+    """Destino de ``ZipFile`` sin ``seek``/``tell``: guarda lo escrito hasta que el generador lo entrega."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _entry_name(doc: dict, used: set) -> str:
+    """Nombre de la entrada: el del documento (o su clave), ``.pdf`` y sin repetir."""
+    base = secure_filename(doc.get("name") or "") or os.path.basename(doc.get("path") or "") or f"documento-{doc['id']}"
+    stem, ext = os.path.splitext(base)
+    if ext.lower() != ".pdf":
+        stem, ext = base, ".pdf"
+    name, n = stem + ext, 1
+    while name.lower() in used:
+        n += 1
+        name = f"{stem} ({n}){ext}"
+    used.add(name.lower())
+    return name
+
+
+def _date_time(doc: dict) -> tuple:
+    fecha = doc.get("date")
+    if isinstance(fecha, datetime.date) and fecha.year >= 1980:  # mínimo del formato ZIP
+        return (fecha.year, fecha.month, fecha.day, 0, 0, 0)
+    return time.localtime()[:6]
+
+
+def _fetch(s3, bucket: str, key: str):
+    """``(tamaño, contenido)``: ``bytes`` si es pequeño, el cuerpo abierto si no."""
+    resp = s3.get_object(Bucket=bucket, Key=key)
+    body = resp["Body"]
+    size = resp.get("ContentLength")
+    if size is not None and size <= EXPORT_PREFETCH_MAX_BYTES:
+        try:
+            return size, body.read()
+        finally:
+            body.close()
+    return size, body
+
+
+def _discard(future):
+    """Cancela una descarga que ya no se va a enviar o cierra su cuerpo al terminar."""
+    if future is not None and not future.cancel():
+        future.add_done_callback(_close_content)
+
+
+def _close_content(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    content = future.result()[1]
+    if not isinstance(content, bytes):
+        content.close()
+
+
+def stream_zip(docs: list, workers: int = EXPORT_WORKERS):
+    """
+    Genera (por trozos de ``bytes``) un ZIP con el PDF de cada documento de
+    ``docs`` (``id``, ``name``, ``date``, ``path``; con ``error`` si ya se
+    sabe que no se puede incluir) y ``manifiesto.json`` al final.
+    """
+    s3 = get_s3_client()
+    bucket = os.getenv("R2_BUCKET_NAME")
+    workers = max(1, min(workers, len(docs) or 1))
+    sink = _Sink()
+    zf = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    queued = iter(docs)
+
+    def submit_next():
+        doc = next(queued, None)
+        if doc is not None:
+            ok = doc.get("path") and not doc.get("error")
+            pending.append((doc, pool.submit(_fetch, s3, bucket, doc["path"]) if ok else None))
+
+    manifest, used = [], set()
+    started = time.monotonic()
+    try:
+        for _ in range(workers):
+            submit_next()
+        while pending:
+            doc, future = pending.popleft()
+            submit_next()
+            entry = {"id": doc["id"], "nombre": doc.get("name")}
+            abierta, written = False, 0
+            try:
+                if future is None:
+                    raise LookupError(doc.get("error") or "El documento no tiene archivo")
+                size, content = future.result()
+                name = _entry_name(doc, used)
+                info = zipfile.ZipInfo(name, date_time=_date_time(doc))
+                info.compress_type = zipfile.ZIP_STORED
+                if size is not None:
+                    info.file_size = size  # decide si la entrada necesita ZIP64
+                with zf.open(info, "w") as dst:
+                    abierta = True
+                    if isinstance(content, bytes):
+                        dst.write(content)
+                        written = len(content)
+                    else:
+                        try:
+                            for chunk in content.iter_chunks(CHUNK_SIZE):
+                                dst.write(chunk)
+                                written += len(chunk)
+                                data = sink.drain()
+                                if data:
+                                    yield data
+                        finally:
+                            content.close()
+                entry.update(archivo=name, estado="ok", bytes=written)
+            except Exception as e:
+                entry.update(estado="error", error=str(e) or e.__class__.__name__)
+                if abierta:
+                    # La entrada ya salió (quizá en parte): queda truncada en el ZIP
+                    entry.update(archivo=name, estado="incompleto", bytes=written)
+            manifest.append(entry)
+            data = sink.drain()
+            if data:
+                yield data
+
+        errores = sum(1 for e in manifest if e["estado"] != "ok")
+        zf.writestr(MANIFEST_NAME, json.dumps({
+            "generado": datetime.datetime.now().isoformat(timespec="seconds"),
+            "total": len(manifest),
+            "incluidos": len(manifest) - errores,
+            "errores": errores,
+            "documentos": manifest,
+        }, ensure_ascii=False, indent=2, default=str))
+        zf.close()
+        yield sink.drain()
+        print(f"Exportación ZIP: {len(manifest)} documento(s), {errores} con error "
+              f"({time.monotonic() - started:.1f}s)")
+    finally:
+        # Cliente desconectado o error: no dejar descargas ni cuerpos abiertos
+        for _, future in pending:
+            _discard(future)
+        pool.shutdown(wait=False)